@@ -1,6 +1,6 @@
 # distbuild/__init__.py -- library for Morph's distributed build plugin
 #
-# Copyright (C) 2012, 2014-2015  Codethink Limited
+# Copyright (C) 2012, 2014-2015,2026  Codethink Limited
 # 
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -17,7 +17,7 @@
 
 from stringbuffer import StringBuffer
 from sm import StateMachine
-from eventsrc import EventSource
+from eventsrc import EventSource, FdEventSource
 from socketsrc import (SocketError, NewConnection, ListeningSocketEventSource,
                        SocketReadable, SocketWriteable, SocketEventSource,
                        set_nonblocking)
@@ -30,9 +30,12 @@ from jm import JsonMachine, JsonNewMessage, JsonEof, JsonError
 from artifact_reference import (encode_artifact,
                                 encode_artifact_reference,
                                 decode_artifact_reference)
+from exec_output import (OutputBatcher, exec_output_message,
+                         decode_exec_output)
 from idgen import IdentifierGenerator
 from route_map import RouteMap
 from timer_event_source import TimerEventSource, Timer
+from critical_path import BuildTimes, critical_path_priorities
 from proxy_event_source import ProxyEventSource
 from json_router import JsonRouter
 from helper_router import (HelperRouter, HelperRequest, HelperOutput, 
@@ -41,6 +44,7 @@ from initiator_connection import (InitiatorConnection, InitiatorDisconnect,
                                   CancelRequest)
 from connection_machine import (ConnectionMachine, InitiatorConnectionMachine,
                                 Reconnect, StopConnecting)
+from job_queue import Job, JobQueue
 from worker_build_scheduler import (WorkerBuildQueuer, 
                                     WorkerConnection, 
                                     WorkerBuildRequest,
@@ -69,5 +73,6 @@ from distbuild_socket import create_socket
 
 from subprocess_eventsrc import (FileReadable, FileWriteable,
                                  SubprocessEventSource)
+from http_eventsrc import HttpEventSource, HttpResponse
 
 __all__ = locals()
@@ -1,6 +1,6 @@
 # distbuild/artifact_reference.py -- Decode/encode ArtifactReference objects
 #
-# Copyright (C) 2012, 2014-2015  Codethink Limited
+# Copyright (C) 2012, 2014-2015, 2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -22,6 +22,18 @@ import yaml
 import morphlib
 
 
+# Versions of the encoding of artifacts:
+#
+#   1. A YAML document, inside a JSON string.
+#   2. A JSON object. Artifact basenames are listed once, in 'names', and
+#      referred to by their index in that list everywhere else. The repo
+#      and ref, which are the same for every artifact, are given once.
+#
+# Anything that decodes artifacts understands all versions, and tells
+# anything that sends it artifacts which is the newest it understands.
+FORMAT_VERSION = 2
+
+
 class ArtifactReference(object): # pragma: no cover
 
     '''Container for some basic information about an artifact.'''
@@ -65,7 +77,95 @@ class ArtifactReference(object): # pragma: no cover
         return list(depth_first(self))
 
 
-def encode_artifact(artifact, repo, ref):
+def _dump(content, version):
+    '''Encode the content of an artifact graph in a format version.
+
+    The content has the layout of format version 1, except that the
+    repo and ref are given at the top rather than in each artifact.
+
+    '''
+
+    repo = content.pop('repo')
+    ref = content.pop('ref')
+
+    if version == 1:
+        for artifact_dict in content['artifacts'].itervalues():
+            artifact_dict['repo'] = repo
+            artifact_dict['ref'] = ref
+        return json.dumps(yaml.dump(content))
+
+    names = list(content['artifacts'])
+    indexes = dict((name, i) for i, name in enumerate(names))
+
+    def index(name):
+        # Dependencies of a single encoded artifact are not encoded
+        # themselves, but their names still need a place in the list.
+        if name not in indexes:
+            indexes[name] = len(names)
+            names.append(name)
+        return indexes[name]
+
+    cache_keys = list(content['sources'])
+    sources = []
+    for cache_key in cache_keys:
+        source_dict = dict(content['sources'][cache_key])
+        source_dict['cache_key'] = cache_key
+        source_dict['dependencies'] = [
+            index(name) for name in source_dict['dependencies']]
+        sources.append(source_dict)
+
+    source_indexes = dict((key, i) for i, key in enumerate(cache_keys))
+    artifacts = []
+    for name in names[:len(content['artifacts'])]:
+        artifact_dict = dict(content['artifacts'][name])
+        artifact_dict['source'] = source_indexes[
+            artifact_dict.pop('cache_key')]
+        artifacts.append(artifact_dict)
+
+    compact = {
+        'version': version,
+        'root-artifact': indexes[content['root-artifact']],
+        'root-filename': content['root-filename'],
+        'repo': repo,
+        'ref': ref,
+        'names': names,
+        'artifacts': artifacts,
+        'sources': sources,
+    }
+    return json.dumps(compact, separators=(',', ':'))
+
+
+def _load(encoded):
+    '''Decode a string from _dump() into the layout of version 1.'''
+
+    compact = json.loads(encoded)
+    if isinstance(compact, basestring):
+        return yaml.load(compact)
+
+    names = compact['names']
+    encoded_sources = {}
+    for source_dict in compact['sources']:
+        source_dict['dependencies'] = [
+            names[i] for i in source_dict['dependencies']]
+        encoded_sources[source_dict['cache_key']] = source_dict
+
+    encoded_artifacts = {}
+    for name, artifact_dict in zip(names, compact['artifacts']):
+        source_dict = compact['sources'][artifact_dict.pop('source')]
+        artifact_dict['cache_key'] = source_dict['cache_key']
+        artifact_dict['repo'] = compact['repo']
+        artifact_dict['ref'] = compact['ref']
+        encoded_artifacts[name] = artifact_dict
+
+    return {
+        'root-artifact': names[compact['root-artifact']],
+        'root-filename': compact['root-filename'],
+        'artifacts': encoded_artifacts,
+        'sources': encoded_sources,
+    }
+
+
+def encode_artifact(artifact, repo, ref, version=FORMAT_VERSION):
     '''Encode part of an Artifact object and dependencies into string form.'''
 
     def get_source_dict(source):
@@ -95,8 +195,6 @@ def encode_artifact(artifact, repo, ref):
             'arch': arch,
             'cache_key': a.source.cache_key,
             'name': a.name,
-            'repo': repo,
-            'ref': ref,
         }
         return a_dict
 
@@ -112,26 +210,28 @@ def encode_artifact(artifact, repo, ref):
     content = {
         'root-artifact': artifact.basename(),
         'root-filename': root_filename,
+        'repo': repo,
+        'ref': ref,
         'artifacts': encoded_artifacts,
         'sources': encoded_sources
     }
 
-    return json.dumps(yaml.dump(content))
+    return _dump(content, version)
 
 
-def encode_artifact_reference(artifact): # pragma: no cover
+def encode_artifact_reference(artifact,
+                              version=FORMAT_VERSION): # pragma: no cover
     '''Encode an ArtifactReference object into string form.
 
     The ArtifactReference object is encoded such that it can be recreated by
-    ``decode_artifact_reference``.
+    ``decode_artifact_reference``. Pass an older format version when the
+    string is for something that may not understand the newest one.
 
     '''
     artifact_dict = {
         'arch': artifact.arch,
         'cache_key': artifact.cache_key,
         'name': artifact.name,
-        'repo': artifact.repo,
-        'ref': artifact.ref
     }
     source_dict = {
         'filename': artifact.filename,
@@ -153,25 +253,27 @@ def encode_artifact_reference(artifact): # pragma: no cover
     content = {
         'root-artifact': artifact.basename(),
         'root-filename': artifact.root_filename,
+        'repo': artifact.repo,
+        'ref': artifact.ref,
         'artifacts': {artifact.basename(): artifact_dict},
         'sources': {artifact.cache_key: source_dict}
     }
 
-    return json.dumps(yaml.dump(content))
+    return _dump(content, version)
 
 
 def decode_artifact_reference(encoded):
     '''Decode an ArtifactReference object from `encoded`.
 
     The argument should be a string returned by ``encode_artifact``
-    or ``encode_artifact_reference``. The decoded ArtifactReference
-    object will be sufficient to represent a build graph and contain
-    enough information to allow `morph worker-build` to calculate a
-    build graph and find the original Artifact object it needs to
-    build.
+    or ``encode_artifact_reference``, in any format version. The decoded
+    ArtifactReference object will be sufficient to represent a build
+    graph and contain enough information to allow `morph worker-build`
+    to calculate a build graph and find the original Artifact object it
+    needs to build.
 
     '''
-    content = yaml.load(json.loads(encoded))
+    content = _load(encoded)
     root = content['root-artifact']
     encoded_artifacts = content['artifacts']
     encoded_sources = content['sources']
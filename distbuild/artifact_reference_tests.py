@@ -1,6 +1,6 @@
 # distbuild/artifact_reference_tests.py -- unit tests for Artifact encoding
 #
-# Copyright (C) 2012, 2014-2015  Codethink Limited
+# Copyright (C) 2012, 2014-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -15,6 +15,7 @@
 # with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import json
 import unittest
 
 import distbuild
@@ -79,12 +80,15 @@ class ArtifactReferenceTests(unittest.TestCase):
         self.art3 = MockArtifact('name3', 'chunk')
         self.art4 = MockArtifact('name4', 'chunk')
 
-    def verify_round_trip(self, artifact):
+    def verify_round_trip(self, artifact, **kwargs):
         encoded = distbuild.encode_artifact(artifact,
                                             artifact.source.repo_name,
-                                            artifact.source.sha1)
+                                            artifact.source.sha1,
+                                            **kwargs)
         decoded = distbuild.decode_artifact_reference(encoded)
         self.assertEqual(artifact.basename(), decoded.basename())
+        self.assertEqual(decoded.repo, artifact.source.repo_name)
+        self.assertEqual(decoded.ref, artifact.source.sha1)
 
         objs = {}
         queue = [decoded]
@@ -124,3 +128,28 @@ class ArtifactReferenceTests(unittest.TestCase):
         self.art3.source.dependencies = [self.art4]
         self.art1.source.dependencies = [self.art2, self.art3]
         self.verify_round_trip(self.art1)
+
+    def test_encodes_plain_json(self):
+        encoded = distbuild.encode_artifact(self.art1,
+                                            self.art1.source.repo_name,
+                                            self.art1.source.sha1)
+        content = json.loads(encoded)
+        self.assertEqual(content['version'],
+                         distbuild.artifact_reference.FORMAT_VERSION)
+
+    def test_works_with_format_version_1(self):
+        self.art2.source.dependencies = [self.art4]
+        self.art1.source.dependencies = [self.art2, self.art3]
+        self.verify_round_trip(self.art1, version=1)
+
+    def test_encodes_a_single_artifact_reference(self):
+        self.art1.source.dependencies = [self.art2]
+        encoded = distbuild.encode_artifact(self.art1,
+                                            self.art1.source.repo_name,
+                                            self.art1.source.sha1)
+        decoded = distbuild.decode_artifact_reference(encoded)
+        single = distbuild.decode_artifact_reference(
+            distbuild.encode_artifact_reference(decoded))
+        self.assertEqual(single.basename(), decoded.basename())
+        self.assertEqual(single.repo, decoded.repo)
+        self.assertEqual(single.root_filename, decoded.root_filename)
@@ -1,6 +1,6 @@
 # distbuild/build_controller.py -- control the steps for one build
 #
-# Copyright (C) 2012, 2014-2015  Codethink Limited
+# Copyright (C) 2012, 2014-2015,2026  Codethink Limited
 # 
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -23,13 +23,8 @@ import urlparse
 import json
 
 import distbuild
-
-
-# Artifact build states. These are used to loosely track the state of the
-# remote cache.
-UNBUILT = 'not-built'
-BUILDING = 'building'
-BUILT = 'built'
+from distbuild.build_graph import (UNBUILT, BUILDING, BUILT, BuildGraph,
+                                   map_build_graph)
 
 
 class _Start(object): pass
@@ -144,32 +139,6 @@ def build_step_name(artifact):
     return artifact.source_name
 
 
-def map_build_graph(artifact, callback, components=[]):
-    """Run callback on each artifact in the build graph and return result.
-
-    If components is given, then only look at the components given and
-    their dependencies. Also, return a list of the components after they
-    have had callback called on them.
-
-    """
-    result = []
-    mapped_components = []
-    done = set()
-    if components:
-        queue = list(components)
-    else:
-        queue = [artifact]
-    while queue:
-        a = queue.pop()
-        if a not in done:
-            result.append(callback(a))
-            queue.extend(a.dependencies)
-            done.add(a)
-            if a in components:
-                mapped_components.append(a)
-    return result, mapped_components
-
-
 def find_artifacts(components, artifact):
     found = []
     for a in artifact.walk():
@@ -178,32 +147,6 @@ def find_artifacts(components, artifact):
     return found
 
 
-def find_artifacts_that_are_ready_to_build(root_artifact, components=[]):
-    '''Return unbuilt artifacts whose dependencies are all built.
-
-    The 'root_artifact' parameter is expected to be a tree of ArtifactReference
-    objects. These must have the 'state' attribute set to BUILT or UNBUILT. If
-    'components' is passed, then only those artifacts and their dependencies
-    will be built.
-
-    '''
-    def is_ready_to_build(artifact):
-        return (artifact.state == UNBUILT and
-                all(a.state == BUILT
-                    for a in artifact.dependencies))
-
-    artifacts, _ = map_build_graph(root_artifact, lambda a: a,
-                                   components)
-    return [a for a in artifacts if is_ready_to_build(a)]
-
-
-def find_artifacts_that_are_building(root_artifact, components=[]):
-    '''Return artifacts in BUILDING state.'''
-    artifacts, _ = map_build_graph(root_artifact, lambda a: a,
-                                   components)
-    return [a for a in artifacts if a.state == BUILDING]
-
-
 class BuildController(distbuild.StateMachine):
 
     '''Control one build-request fulfillment.
@@ -219,18 +162,23 @@ class BuildController(distbuild.StateMachine):
     _idgen = distbuild.IdentifierGenerator('BuildController')
     
     def __init__(self, initiator_connection, build_request_message,
-                 artifact_cache_server, morph_instance):
+                 artifact_cache_server, morph_instance, build_times):
         distbuild.crash_point()
         distbuild.StateMachine.__init__(self, 'init')
         self._initiator_connection = initiator_connection
         self._request = build_request_message
         self._artifact_cache_server = artifact_cache_server
         self._morph_instance = morph_instance
+        self._build_times = build_times
         self._helper_id = None
         self.debug_transitions = False
         self.debug_graph_state = False
         self._debug_build_output = False
         self.allow_detach = build_request_message['allow_detach']
+        # The initiator only wants to hear about steps starting, finishing
+        # and failing, not their output.
+        self._summary_output = build_request_message.get(
+            'summary_output', False)
         self.build_info = {
             'id': build_request_message['id'],
             'morphology': build_request_message['morphology'],
@@ -482,6 +430,12 @@ class BuildController(distbuild.StateMachine):
             artifact.state = UNBUILT
         map_build_graph(self._artifact, set_initial_state)
 
+        self._graph = BuildGraph(self._artifact, self._components)
+        self._components = self._graph.components
+
+        self._priorities = distbuild.critical_path_priorities(
+            self._artifact, self._build_times)
+
         self.mainloop.queue_event(BuildController,
                                   BuildStarted(self._request['id']))
 
@@ -507,12 +461,7 @@ class BuildController(distbuild.StateMachine):
 
         self._helper_id = self._idgen.next()
 
-        artifact_names = []
-        def collect_unbuilt_artifacts(artifact):
-            if artifact.state == UNBUILT:
-                artifact_names.append(artifact.basename())
-        map_build_graph(self._artifact, collect_unbuilt_artifacts,
-                        self._components)
+        artifact_names = [a.basename() for a in self._graph.unbuilt()]
 
         url = urlparse.urljoin(self._artifact_cache_server, '/1.0/artifacts')
         msg = distbuild.message('http-request',
@@ -556,14 +505,11 @@ class BuildController(distbuild.StateMachine):
         # Mark things as built that are now built. We only check the unbuilt
         # artifacts, so 'cache_state' will have no info for things we already
         # thought were built.
-        def update_state(artifact):
-            if artifact.state == UNBUILT:
-                is_in_cache = cache_state[artifact.basename()]
-                if is_in_cache:
-                    logging.debug('Found a build of %s in the cache', artifact)
-                    artifact.state = BUILT
-        _, self._components = map_build_graph(self._artifact, update_state,
-                                              self._components)
+        for artifact in self._graph.unbuilt():
+            is_in_cache = cache_state[artifact.basename()]
+            if is_in_cache:
+                logging.debug('Found a build of %s in the cache', artifact)
+                self._graph.set_state(artifact, BUILT)
 
         # Send 'Need to build xx/yy artifacts' message, the first time round.
         if self.sent_cache_status == False:
@@ -573,8 +519,7 @@ class BuildController(distbuild.StateMachine):
         # Dump state (for debugging).
         if self.debug_graph_state:
             logging.debug('Current state of build graph nodes:')
-            for a, _ in map_build_graph(self._artifact,
-                                        lambda a: a, self._components):
+            for a in self._graph.artifacts:
                 logging.debug('  %s state is %s' % (a.name, a.state))
                 if a.state != BUILT:
                     for dep in a.dependencies:
@@ -587,13 +532,10 @@ class BuildController(distbuild.StateMachine):
             return
 
         # Enqueue anything which it is now possible for us to build.
-        ready_to_build = find_artifacts_that_are_ready_to_build(
-            self._artifact, self._components)
+        ready_to_build = self._graph.ready()
 
         if len(ready_to_build) == 0:
-            building = find_artifacts_that_are_building(
-                self._artifact, self._components)
-            if len(building) == 0:
+            if len(self._graph.building()) == 0:
                 self.fail(
                     "Not possible to build anything else. This may be due to "
                     "an internal error, or due to artifacts being deleted "
@@ -628,21 +570,29 @@ class BuildController(distbuild.StateMachine):
         self.mainloop.queue_event(BuildController, cache_state_msg)
 
     def _queue_worker_builds(self, artifacts):
-        '''Send a set of chunks to the WorkerBuildQueuer class for building.'''
+        '''Send a set of chunks to the WorkerBuildQueuer class for building.
+
+        Artifacts with the longest path left to the root artifact are
+        sent first, and given a higher priority.
+
+        '''
         distbuild.crash_point()
 
         logging.debug('Queuing more worker-builds to run')
+        artifacts.sort(key=lambda a: self._priorities.get(a, 0))
         while len(artifacts) > 0:
             artifact = artifacts.pop()
+            priority = self._priorities.get(artifact, 0)
 
             logging.debug(
-                'Requesting worker-build of %s (%s)' %
-                    (artifact.name, artifact.cache_key))
+                'Requesting worker-build of %s (%s), priority %.0f' %
+                    (artifact.name, artifact.cache_key, priority))
             request = distbuild.WorkerBuildRequest(artifact,
-                                                   self._request['id'])
+                                                   self._request['id'],
+                                                   priority)
             self.mainloop.queue_event(distbuild.WorkerBuildQueuer, request)
 
-            artifact.state = BUILDING
+            self._graph.set_state(artifact, BUILDING)
             if artifact.kind == 'chunk':
                 # Chunk artifacts are not built independently
                 # so when we're building any chunk artifact
@@ -651,7 +601,7 @@ class BuildController(distbuild.StateMachine):
                 same_chunk_artifacts = [a for a in artifacts
                                         if a.cache_key == artifact.cache_key]
                 for a in same_chunk_artifacts:
-                    a.state = BUILDING
+                    self._graph.set_state(a, BUILDING)
                     artifacts.remove(a)
 
     def _maybe_notify_initiator_disconnected(self, event_source, event):
@@ -743,6 +693,9 @@ class BuildController(distbuild.StateMachine):
         if self._request['id'] not in event.msg['ids']:
             return # not for us
 
+        if self._summary_output:
+            return
+
         if self._debug_build_output:
             logging.debug('BC: got output: %s' % repr(event.msg))
 
@@ -780,13 +733,7 @@ class BuildController(distbuild.StateMachine):
         self.mainloop.queue_event(BuildController, progress)
 
     def _find_artifact(self, cache_key):
-        artifacts, _ = map_build_graph(self._artifact, lambda a: a,
-                                       self._components)
-        wanted = [a for a in artifacts if a.cache_key == cache_key]
-        if wanted:
-            return wanted[0]
-        else:
-            return None
+        return self._graph.find(cache_key)
 
     def _maybe_check_result_and_queue_more_builds(self, event_source, event):
         '''Handle completion of a build, from the WorkerBuildQueuer.
@@ -814,19 +761,15 @@ class BuildController(distbuild.StateMachine):
             self._request['id'], build_step_name(artifact), event.worker_name)
         self.mainloop.queue_event(BuildController, finished)
 
-        artifact.state = BUILT
-
-        def set_state(a):
-            if a.cache_key == artifact.cache_key:
-                a.state = BUILT
+        self._graph.set_state(artifact, BUILT)
 
         if artifact.kind == 'chunk':
             # Building a single chunk artifact
             # yields all chunk artifacts for the given source
             # so we set the state of this source's artifacts
             # to BUILT
-            _, self._components = map_build_graph(self._artifact, set_state,
-                                                  self._components)
+            for a in self._graph.with_cache_key(artifact.cache_key):
+                self._graph.set_state(a, BUILT)
 
         self._query_cache_state()
 
@@ -0,0 +1,151 @@
+# distbuild/build_graph.py -- track the state of a build graph
+#
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import collections
+
+
+# Artifact build states. These are used to loosely track the state of the
+# remote cache.
+UNBUILT = 'not-built'
+BUILDING = 'building'
+BUILT = 'built'
+
+
+def map_build_graph(artifact, callback, components=[]):
+    """Run callback on each artifact in the build graph and return result.
+
+    If components is given, then only look at the components given and
+    their dependencies. Also, return a list of the components after they
+    have had callback called on them.
+
+    """
+    result = []
+    mapped_components = []
+    done = set()
+    if components:
+        queue = list(components)
+    else:
+        queue = [artifact]
+    while queue:
+        a = queue.pop()
+        if a not in done:
+            result.append(callback(a))
+            queue.extend(a.dependencies)
+            done.add(a)
+            if a in components:
+                mapped_components.append(a)
+    return result, mapped_components
+
+
+class BuildGraph(object):
+
+    '''Keep track of which artifacts in a build graph can be built.
+
+    An artifact is ready to build when it is UNBUILT and all of its
+    dependencies are BUILT. Rather than checking that for the whole
+    graph each time something changes, this keeps a count of the
+    dependencies of each artifact that are not built yet, and the
+    artifacts that depend on each one. Changing the state of an
+    artifact with set_state() only updates the counts of the artifacts
+    that depend on it.
+
+    The graph covers root_artifact, or if components are given, the
+    components and their dependencies, the same artifacts that
+    map_build_graph() visits. Lists of artifacts are returned in the
+    order map_build_graph() would visit them. The initial state of
+    each artifact is taken from its 'state' attribute.
+
+    '''
+
+    def __init__(self, root_artifact, components=[]):
+        self.artifacts, self.components = map_build_graph(
+            root_artifact, lambda a: a, components)
+
+        self._order = {}
+        self._dependents = collections.defaultdict(list)
+        self._by_cache_key = collections.defaultdict(list)
+        self._unbuilt_dependencies = {}
+        self._unbuilt = set()
+        self._ready = set()
+        self._building = set()
+
+        for i, artifact in enumerate(self.artifacts):
+            self._order[artifact] = i
+            self._by_cache_key[artifact.cache_key].append(artifact)
+            for dependency in artifact.dependencies:
+                self._dependents[dependency].append(artifact)
+            self._unbuilt_dependencies[artifact] = len(
+                [d for d in artifact.dependencies if d.state != BUILT])
+        for artifact in self.artifacts:
+            self._update(artifact)
+
+    def set_state(self, artifact, state):
+        '''Change the state of an artifact in the graph.'''
+
+        was_built = artifact.state == BUILT
+        artifact.state = state
+        if was_built != (state == BUILT):
+            change = -1 if state == BUILT else 1
+            for dependent in self._dependents[artifact]:
+                self._unbuilt_dependencies[dependent] += change
+                self._update(dependent)
+        self._update(artifact)
+
+    def ready(self):
+        '''Return the UNBUILT artifacts whose dependencies are all built.'''
+
+        return self._in_order(self._ready)
+
+    def building(self):
+        '''Return the artifacts that are BUILDING.'''
+
+        return self._in_order(self._building)
+
+    def unbuilt(self):
+        '''Return the artifacts that are UNBUILT.'''
+
+        return self._in_order(self._unbuilt)
+
+    def find(self, cache_key):
+        '''Return the first artifact with cache_key, or None.'''
+
+        artifacts = self._by_cache_key.get(cache_key)
+        return artifacts[0] if artifacts else None
+
+    def with_cache_key(self, cache_key):
+        '''Return all artifacts with cache_key.
+
+        Building a chunk gives all the chunk artifacts from its source,
+        which share a cache key.
+
+        '''
+
+        return list(self._by_cache_key.get(cache_key, []))
+
+    def _in_order(self, artifacts):
+        return sorted(artifacts, key=self._order.__getitem__)
+
+    def _update(self, artifact):
+        unbuilt = artifact.state == UNBUILT
+        ready = unbuilt and self._unbuilt_dependencies[artifact] == 0
+        for wanted, members in ((unbuilt, self._unbuilt),
+                                (ready, self._ready),
+                                (artifact.state == BUILDING, self._building)):
+            if wanted:
+                members.add(artifact)
+            else:
+                members.discard(artifact)
@@ -0,0 +1,128 @@
+# distbuild/build_graph_tests.py -- unit tests for build graph tracking
+#
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import random
+import unittest
+
+import distbuild
+from distbuild.build_graph import (UNBUILT, BUILDING, BUILT, BuildGraph,
+                                   map_build_graph)
+
+
+def artifact(name, dependencies=(), cache_key=None):
+    a = distbuild.artifact_reference.ArtifactReference(
+        name, {'name': name, 'source_name': name, 'kind': 'chunk',
+               'cache_key': cache_key or name,
+               'dependencies': list(dependencies)})
+    a.state = UNBUILT
+    return a
+
+
+def random_graph(size, seed):
+    '''Return the root of a random build graph of size artifacts.
+
+    Some artifacts share a cache key, like the artifacts of a chunk.
+
+    '''
+
+    rng = random.Random(seed)
+    artifacts = []
+    for i in range(size):
+        dependencies = rng.sample(artifacts, min(len(artifacts), 3))
+        cache_key = 'key-%d' % (i // 2)
+        artifacts.append(artifact('a%d' % i, dependencies, cache_key))
+    return artifact('root', artifacts, 'root')
+
+
+def scan_for_ready(root, components=[]):
+    '''Find ready artifacts by looking at the whole graph.'''
+
+    artifacts, _ = map_build_graph(root, lambda a: a, components)
+    return [a for a in artifacts
+            if a.state == UNBUILT and
+               all(d.state == BUILT for d in a.dependencies)]
+
+
+class BuildGraphTests(unittest.TestCase):
+
+    def test_artifacts_with_no_dependencies_are_ready(self):
+        leaf = artifact('leaf')
+        root = artifact('root', [leaf])
+        graph = BuildGraph(root)
+        self.assertEqual(graph.ready(), [leaf])
+        self.assertEqual(graph.unbuilt(), [root, leaf])
+
+    def test_building_an_artifact_makes_its_dependents_ready(self):
+        leaf = artifact('leaf')
+        root = artifact('root', [leaf])
+        graph = BuildGraph(root)
+        graph.set_state(leaf, BUILDING)
+        self.assertEqual(graph.ready(), [])
+        self.assertEqual(graph.building(), [leaf])
+        graph.set_state(leaf, BUILT)
+        self.assertEqual(graph.ready(), [root])
+        self.assertEqual(graph.building(), [])
+
+    def test_takes_initial_state_from_artifacts(self):
+        leaf = artifact('leaf')
+        leaf.state = BUILT
+        root = artifact('root', [leaf])
+        graph = BuildGraph(root)
+        self.assertEqual(graph.ready(), [root])
+
+    def test_unbuilding_an_artifact_makes_dependents_wait(self):
+        leaf = artifact('leaf')
+        root = artifact('root', [leaf])
+        graph = BuildGraph(root)
+        graph.set_state(leaf, BUILT)
+        graph.set_state(leaf, UNBUILT)
+        self.assertEqual(graph.ready(), [leaf])
+
+    def test_only_covers_components_and_their_dependencies(self):
+        leaf = artifact('leaf')
+        other = artifact('other')
+        component = artifact('component', [leaf])
+        root = artifact('root', [component, other])
+        graph = BuildGraph(root, [component])
+        self.assertEqual(graph.components, [component])
+        self.assertEqual(graph.ready(), [leaf])
+        self.assertEqual(graph.find('other'), None)
+
+    def test_finds_artifacts_by_cache_key(self):
+        first = artifact('first', cache_key='key')
+        second = artifact('second', cache_key='key')
+        root = artifact('root', [first, second])
+        graph = BuildGraph(root)
+        self.assertEqual(graph.find('key'), graph.with_cache_key('key')[0])
+        self.assertEqual(set(graph.with_cache_key('key')),
+                         set([first, second]))
+        self.assertEqual(graph.with_cache_key('missing'), [])
+
+    def test_matches_scanning_the_whole_graph(self):
+        root = random_graph(200, seed=1)
+        graph = BuildGraph(root)
+        rng = random.Random(2)
+        while root.state != BUILT:
+            ready = graph.ready()
+            self.assertEqual(ready, scan_for_ready(root))
+            for a in ready:
+                graph.set_state(a, BUILDING)
+            building = graph.building()
+            for a in rng.sample(building, max(1, len(building) // 3)):
+                for same in graph.with_cache_key(a.cache_key):
+                    graph.set_state(same, BUILT)
+            self.assertEqual(graph.ready(), scan_for_ready(root))
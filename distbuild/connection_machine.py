@@ -1,6 +1,6 @@
 # distbuild/connection_machine.py -- state machine for connecting to server
 #
-# Copyright (C) 2012, 2014-2015  Codethink Limited
+# Copyright (C) 2012, 2014-2015,2026  Codethink Limited
 # 
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -38,29 +38,6 @@ class ConnectError(object):
         self.exception = exception
 
 
-class ProxyEventSource(object):
-
-    '''Proxy event sources that may come and go.'''
-
-    def __init__(self):
-        self.event_source = None
-
-    def get_select_params(self):
-        if self.event_source:
-            return self.event_source.get_select_params()
-        else:
-            return [], [], [], None
-            
-    def get_events(self, r, w, x):
-        if self.event_source:
-            return self.event_source.get_events(r, w, x)
-        else:
-            return []
-            
-    def is_finished(self):
-        return False
-
-
 class ConnectionMachine(distbuild.StateMachine):
 
     def __init__(self, addr, port, machine, extra_args,
@@ -76,7 +53,7 @@ class ConnectionMachine(distbuild.StateMachine):
         self._max_retries = max_retries
 
     def setup(self):
-        self._sock_proxy = ProxyEventSource()
+        self._sock_proxy = distbuild.ProxyEventSource()
         self.mainloop.add_event_source(self._sock_proxy)
         self._start_connect()
         
@@ -147,6 +124,9 @@ class ConnectionMachine(distbuild.StateMachine):
         logging.info(
             'Stopping connection attempts to %s:%s' % (self._addr, self._port))
         self.mainloop.remove_event_source(self._timer)
+        if self._sock_proxy.event_source is not None:
+            self._sock_proxy.event_source.close()
+            self._sock_proxy.event_source = None
         if self._socket is not None:
             self._socket.close()
             self._socket = None
@@ -0,0 +1,78 @@
+# distbuild/critical_path.py -- prioritise builds on the critical path
+#
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import collections
+
+
+class BuildTimes(object):
+
+    '''Remember how long the build of each source took.
+
+    Durations are kept by source name rather than cache key, so that a
+    new version of gcc is expected to take about as long as the last
+    one did. Sources that have not been built yet get a default
+    estimate for their kind.
+
+    '''
+
+    default_durations = {
+        'chunk': 60.0,
+        'stratum': 5.0,
+        'system': 300.0,
+    }
+    default_duration = 60.0
+
+    def __init__(self):
+        self._durations = {}
+
+    def record(self, artifact, seconds):
+        self._durations[artifact.source_name] = seconds
+
+    def estimate(self, artifact):
+        '''Return how many seconds building artifact should take.'''
+
+        if artifact.source_name in self._durations:
+            return self._durations[artifact.source_name]
+        return self.default_durations.get(
+            artifact.kind, self.default_duration)
+
+
+def critical_path_priorities(root_artifact, build_times):
+    '''Return the length of the longest path to root for each artifact.
+
+    The result maps each artifact in the build graph of root_artifact
+    to the estimated time from starting its build to finishing the
+    build of root_artifact, if there were as many workers as wanted.
+    Building artifacts with the longest remaining path first keeps
+    the build of long chains, like the one through gcc and glibc, from
+    waiting behind leaves that nothing else needs soon.
+
+    '''
+
+    artifacts = root_artifact.walk()
+    dependents = collections.defaultdict(list)
+    for artifact in artifacts:
+        for dependency in artifact.dependencies:
+            dependents[dependency].append(artifact)
+
+    # walk() returns each artifact after its dependencies, so going
+    # backwards each one comes after everything that depends on it.
+    priorities = {}
+    for artifact in reversed(artifacts):
+        remaining = max([priorities[d] for d in dependents[artifact]] or [0])
+        priorities[artifact] = build_times.estimate(artifact) + remaining
+    return priorities
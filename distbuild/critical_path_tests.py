@@ -0,0 +1,148 @@
+# distbuild/critical_path_tests.py -- unit tests for build prioritisation
+#
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+
+import distbuild
+from distbuild.job_queue import Job, JobQueue
+
+
+def artifact(name, kind='chunk', dependencies=()):
+    return distbuild.artifact_reference.ArtifactReference(
+        name, {'source_name': name, 'kind': kind,
+               'dependencies': list(dependencies)})
+
+
+def system_graph():
+    '''Return a system with a long chain and many leaves, and timings.
+
+    After gcc, there are twenty small chunks that nothing else depends
+    on, and a chain of three big ones.
+
+    '''
+
+    durations = {'gcc': 300, 'glib': 200, 'gtk': 300, 'webkit': 600,
+                 'core': 5, 'system': 300}
+    gcc = artifact('gcc')
+    leaves = []
+    for i in range(20):
+        name = 'a%02d' % i
+        durations[name] = 60
+        leaves.append(artifact(name, dependencies=[gcc]))
+    glib = artifact('glib', dependencies=[gcc])
+    gtk = artifact('gtk', dependencies=[glib])
+    webkit = artifact('webkit', dependencies=[gtk])
+    core = artifact('core', 'stratum', leaves + [webkit])
+    system = artifact('system', 'system', [core])
+
+    build_times = distbuild.BuildTimes()
+    for a in system.walk():
+        build_times.record(a, durations[a.source_name])
+    return system, build_times
+
+
+def simulate(root, build_times, priorities, workers):
+    '''Return how long building root takes, serving jobs from a JobQueue.'''
+
+    queue = JobQueue(owner='simulation')
+    queued = set()
+    built = set()
+    running = []  # (finish time, job)
+    now = 0
+
+    while root not in built:
+        ready = [a for a in root.walk()
+                 if a not in queued and all(d in built
+                                            for d in a.dependencies)]
+        for a in sorted(ready, key=lambda a: a.source_name):
+            queue.add(Job(a.source_name, a, 'initiator', priorities.get(a, 0)))
+            queued.add(a)
+
+        while len(running) < workers:
+            job = queue.get_next_job()
+            if job is None:
+                break
+            job.who = 'worker'
+            running.append(
+                (now + build_times.estimate(job.artifact), job))
+
+        running.sort(key=lambda r: r[0])
+        now, job = running.pop(0)
+        queue.remove(job)
+        built.add(job.artifact)
+
+    return now
+
+
+class BuildTimesTests(unittest.TestCase):
+
+    def test_estimates_by_kind_until_a_build_is_recorded(self):
+        build_times = distbuild.BuildTimes()
+        gcc = artifact('gcc')
+        self.assertEqual(build_times.estimate(gcc),
+                         build_times.default_durations['chunk'])
+        build_times.record(gcc, 1234)
+        self.assertEqual(build_times.estimate(gcc), 1234)
+
+    def test_uses_a_default_for_unknown_kinds(self):
+        build_times = distbuild.BuildTimes()
+        self.assertEqual(build_times.estimate(artifact('x', 'cluster')),
+                         build_times.default_duration)
+
+
+class CriticalPathPrioritiesTests(unittest.TestCase):
+
+    def test_adds_longest_path_to_root(self):
+        system, build_times = system_graph()
+        priorities = distbuild.critical_path_priorities(system, build_times)
+        by_name = dict((a.source_name, p) for a, p in priorities.items())
+        self.assertEqual(by_name['system'], 300)
+        self.assertEqual(by_name['core'], 305)
+        self.assertEqual(by_name['a00'], 365)
+        self.assertEqual(by_name['glib'], 1405)
+        self.assertEqual(by_name['gcc'], 1705)
+
+
+class JobQueueTests(unittest.TestCase):
+
+    def test_serves_highest_priority_first(self):
+        queue = JobQueue(owner='test')
+        low = Job('low', artifact('low'), 'initiator', 1)
+        high = Job('high', artifact('high'), 'initiator', 10)
+        queue.add(low)
+        queue.add(high)
+        self.assertEqual(queue.get_next_job(), high)
+        high.who = 'worker'
+        self.assertEqual(queue.get_next_job(), low)
+        queue.remove(low)
+        self.assertEqual(queue.get_next_job(), None)
+
+    def test_serves_equal_priorities_in_order_added(self):
+        queue = JobQueue(owner='test')
+        first = Job('first', artifact('first'), 'initiator')
+        queue.add(first)
+        queue.add(Job('second', artifact('second'), 'initiator'))
+        self.assertEqual(queue.get_next_job(), first)
+
+    def test_critical_path_first_is_faster_than_fifo(self):
+        system, build_times = system_graph()
+        priorities = distbuild.critical_path_priorities(system, build_times)
+        fifo = simulate(system, build_times, {}, workers=2)
+        critical_path_first = simulate(system, build_times, priorities,
+                                       workers=2)
+        self.assertEqual(fifo, 2305)
+        self.assertEqual(critical_path_first, 1765)
@@ -1,6 +1,6 @@
 # mainloop/eventsrc.py -- interface for event sources
 #
-# Copyright (C) 2012, 2014-2015  Codethink Limited
+# Copyright (C) 2012, 2014-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -23,7 +23,9 @@ class EventSource(object):
     
     An event source watches one file descriptor, and returns events
     related to it. The events may vary depending on the file descriptor.
-    The actual watching is done using select.select.
+    The main loop asks for the file descriptors to watch by calling
+    get_select_params on every iteration. Event sources with many or
+    long-lived file descriptors should use FdEventSource instead.
     
     '''
     
@@ -42,7 +44,8 @@ class EventSource(object):
     def get_events(self, r, w, x):
         '''Return events related to this file descriptor.
         
-        The arguments are the return values of select.select.
+        The arguments are the sets of file descriptors that are
+        readable, writeable, or have an exceptional condition.
         
         '''
         
@@ -57,3 +60,62 @@ class EventSource(object):
         
         return False
 
+
+
+class FdEventSource(EventSource):
+
+    '''An event source that tells the main loop what it is watching.
+
+    Rather than being asked on every iteration of the main loop, the
+    event source calls set_interest whenever it starts or stops
+    watching a file descriptor for being readable or writeable, and
+    the main loop only changes its poller then. get_events is only
+    called when one of its file descriptors is ready.
+
+    '''
+
+    def __init__(self):
+        self.mainloop = None
+        self._owner = self
+        # fd -> (read, write)
+        self._interest = {}
+
+    def attach(self, mainloop, owner=None):
+        '''Start watching file descriptors with a main loop.
+
+        The main loop calls this when the event source is added to it.
+        Events are reported as coming from owner, if given, instead of
+        from this event source, which is how a ProxyEventSource works.
+
+        '''
+
+        self.mainloop = mainloop
+        self._owner = owner or self
+        for fd, (read, write) in self._interest.items():
+            mainloop.watch(self._owner, fd, read, write)
+
+    def detach(self):
+        '''Stop watching file descriptors with the main loop.'''
+
+        if self.mainloop is not None:
+            for fd in self._interest:
+                self.mainloop.unwatch(self._owner, fd)
+        self.mainloop = None
+        self._owner = self
+
+    def set_interest(self, fd, read, write):
+        '''Say whether fd should be watched for reading and writing.'''
+
+        if read or write:
+            if self._interest.get(fd) == (read, write):
+                return
+            self._interest[fd] = (read, write)
+        elif self._interest.pop(fd, None) is None:
+            return
+        if self.mainloop is not None:
+            self.mainloop.watch(self._owner, fd, read, write)
+
+    def get_select_params(self):
+        r = [fd for fd, (read, write) in self._interest.items() if read]
+        w = [fd for fd, (read, write) in self._interest.items() if write]
+        return r, w, [], None
@@ -0,0 +1,126 @@
+# distbuild/exec_output.py -- batch and compress command output
+#
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import base64
+import zlib
+
+
+# A batch of output is sent when it gets this big, or this many seconds
+# after it was started, whichever comes first.
+MAX_BATCH_SIZE = 64 * 1024
+MAX_BATCH_DELAY = 0.2
+
+
+def exec_output_message(request_id, stream, data, compress=False):
+    '''Return an exec-output message with data from stream.
+
+    If compress is true, and compressing the data makes it smaller, the
+    data is sent compressed with zlib and base64 encoded, and the
+    message's 'compression' field says so.
+
+    '''
+
+    other = 'stderr' if stream == 'stdout' else 'stdout'
+    msg = {
+        'type': 'exec-output',
+        'id': request_id,
+        stream: data,
+        other: '',
+    }
+    if compress:
+        compressed = base64.b64encode(zlib.compress(data))
+        if len(compressed) < len(data):
+            msg[stream] = compressed
+            msg['compression'] = 'zlib'
+    return msg
+
+
+def decode_exec_output(msg):
+    '''Return an exec-output message with its output uncompressed.'''
+
+    if msg.get('compression') != 'zlib':
+        return msg
+    new = dict(msg)
+    del new['compression']
+    for stream in ('stdout', 'stderr'):
+        if new[stream]:
+            new[stream] = zlib.decompress(base64.b64decode(new[stream]))
+    return new
+
+
+class OutputBatcher(object):
+
+    '''Collect the output of running commands into fewer messages.
+
+    A command that writes a lot of output in small pieces would
+    otherwise make an exec-output message for each read from its pipes.
+    Output is collected for each request until there is max_size of it,
+    and the caller arranges for flush_all to be called max_delay seconds
+    after pending() becomes true, so that output is never held for long.
+
+    Each batch has output from one stream only. Output from the other
+    stream of the same request sends the batch first, so that the
+    output arrives in the order it was read.
+
+    '''
+
+    def __init__(self, max_size=MAX_BATCH_SIZE, max_delay=MAX_BATCH_DELAY):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        # request id -> (stream, list of data, size, compress)
+        self._batches = {}
+
+    def add(self, request_id, stream, data, compress=False):
+        '''Add output from a request, returning messages to send now.'''
+
+        messages = []
+        batch = self._batches.get(request_id)
+        if batch is not None and batch[0] != stream:
+            messages.extend(self.flush(request_id))
+            batch = None
+        if batch is None:
+            batch = (stream, [], 0, compress)
+        stream, pieces, size, compress = batch
+        pieces.append(data)
+        size += len(data)
+        self._batches[request_id] = (stream, pieces, size, compress)
+        if size >= self.max_size:
+            messages.extend(self.flush(request_id))
+        return messages
+
+    def flush(self, request_id):
+        '''Return messages with all the output collected for a request.'''
+
+        batch = self._batches.pop(request_id, None)
+        if batch is None:
+            return []
+        stream, pieces, size, compress = batch
+        return [exec_output_message(
+            request_id, stream, ''.join(pieces), compress)]
+
+    def flush_all(self):
+        '''Return messages with all the output collected.'''
+
+        messages = []
+        for request_id in list(self._batches):
+            messages.extend(self.flush(request_id))
+        return messages
+
+    def pending(self):
+        '''Is there output that has not been sent yet?'''
+
+        return bool(self._batches)
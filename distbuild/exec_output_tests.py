@@ -0,0 +1,95 @@
+# distbuild/exec_output_tests.py -- unit tests for command output batching
+#
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+
+import distbuild
+
+
+def output(messages):
+    '''Return the (stream, data) pairs in a list of exec-output messages.'''
+
+    result = []
+    for msg in messages:
+        msg = distbuild.decode_exec_output(msg)
+        for stream in ('stdout', 'stderr'):
+            if msg[stream]:
+                result.append((stream, msg[stream]))
+    return result
+
+
+class ExecOutputMessageTests(unittest.TestCase):
+
+    def test_makes_message_with_output_from_one_stream(self):
+        msg = distbuild.exec_output_message('id', 'stderr', 'oops\n')
+        self.assertEqual(msg, {'type': 'exec-output', 'id': 'id',
+                               'stdout': '', 'stderr': 'oops\n'})
+        self.assertEqual(distbuild.decode_exec_output(msg), msg)
+
+    def test_compresses_output_when_asked_to(self):
+        data = 'gcc -c foo.c\n' * 1000
+        msg = distbuild.exec_output_message('id', 'stdout', data, True)
+        self.assertEqual(msg['compression'], 'zlib')
+        self.assertTrue(len(msg['stdout']) < len(data) / 10)
+        self.assertEqual(distbuild.decode_exec_output(msg),
+                         {'type': 'exec-output', 'id': 'id',
+                          'stdout': data, 'stderr': ''})
+
+    def test_does_not_compress_output_that_would_grow(self):
+        msg = distbuild.exec_output_message('id', 'stdout', 'x', True)
+        self.assertEqual(msg['stdout'], 'x')
+        self.assertNotIn('compression', msg)
+
+
+class OutputBatcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.batcher = distbuild.OutputBatcher(max_size=10)
+
+    def test_collects_small_pieces_of_output(self):
+        for c in 'abc':
+            self.assertEqual(self.batcher.add('id', 'stdout', c), [])
+        self.assertTrue(self.batcher.pending())
+        self.assertEqual(output(self.batcher.flush('id')),
+                         [('stdout', 'abc')])
+        self.assertFalse(self.batcher.pending())
+        self.assertEqual(self.batcher.flush('id'), [])
+
+    def test_sends_batch_when_it_is_big_enough(self):
+        self.batcher.add('id', 'stdout', '12345')
+        self.assertEqual(output(self.batcher.add('id', 'stdout', '67890')),
+                         [('stdout', '1234567890')])
+        self.assertFalse(self.batcher.pending())
+
+    def test_keeps_order_of_output_from_both_streams(self):
+        messages = []
+        for stream, data in [('stdout', 'a'), ('stdout', 'b'),
+                             ('stderr', 'c'), ('stdout', 'd')]:
+            messages.extend(self.batcher.add('id', stream, data))
+        messages.extend(self.batcher.flush_all())
+        self.assertEqual(output(messages), [('stdout', 'ab'),
+                                            ('stderr', 'c'),
+                                            ('stdout', 'd')])
+
+    def test_keeps_output_of_requests_apart(self):
+        self.batcher.add('first', 'stdout', 'a')
+        self.batcher.add('second', 'stdout', 'b', compress=True)
+        messages = self.batcher.flush_all()
+        self.assertEqual(sorted((msg['id'], msg['stdout'])
+                                for msg in messages),
+                         [('first', 'a'), ('second', 'b')])
+        self.assertFalse(self.batcher.pending())
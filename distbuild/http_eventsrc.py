@@ -0,0 +1,175 @@
+# distbuild/http_eventsrc.py -- make HTTP requests without blocking
+#
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import collections
+import errno
+import httplib
+import logging
+import os
+import Queue
+import socket
+import threading
+import urlparse
+
+import distbuild
+
+
+class HttpResponse(object):
+
+    def __init__(self, request_id, status, body):
+        self.request_id = request_id
+        self.status = status
+        self.body = body
+
+
+class HttpEventSource(distbuild.FdEventSource):
+
+    '''Event source that makes HTTP requests in the background.
+
+    Requests are made by up to max_requests threads at once, and more
+    wait for a free thread. When a request finishes, the thread tells
+    the main loop through a pipe, and the event source returns an
+    HttpResponse event with the request's id.
+
+    Connections to each host are kept open for the next request, unless
+    the server closes them. A request that fails on a connection that
+    was kept open is tried again on a new one, as the server may have
+    closed it in the meantime. timeout is how many seconds to wait for
+    the server to accept a connection or send anything before giving
+    up. Requests that fail get status 418, with the error as the body.
+
+    '''
+
+    def __init__(self, max_requests=4, timeout=600):
+        distbuild.FdEventSource.__init__(self)
+        self.max_requests = max_requests
+        self.timeout = timeout
+        self.closed = False
+        self._requests = Queue.Queue()
+        self._responses = collections.deque()
+        self._lock = threading.Lock()
+        self._threads = 0
+        # host:port -> connections kept open
+        self._idle = collections.defaultdict(list)
+        self._read_fd, self._write_fd = os.pipe()
+        distbuild.set_nonblocking(self._read_fd)
+        self.set_interest(self._read_fd, True, False)
+
+    def request(self, request_id, method, url, headers=None, body=None):
+        '''Start a request, which will be answered with an HttpResponse.'''
+
+        assert not self.closed
+        self._requests.put((request_id, method, url, headers, body))
+        with self._lock:
+            if self._threads < self.max_requests:
+                self._threads += 1
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+
+    def get_events(self, r, w, x):
+        try:
+            os.read(self._read_fd, 4096)
+        except OSError as e:  # pragma: no cover
+            if e.errno != errno.EAGAIN:
+                raise
+        events = []
+        while self._responses:
+            events.append(self._responses.popleft())
+        return events
+
+    def close(self):
+        '''Stop making requests.
+
+        Requests that have not started are dropped, and the responses of
+        ones that are running are ignored. Connections that are kept open
+        are closed now, and the ones running requests use are closed when
+        the requests finish.
+
+        '''
+
+        self.closed = True
+        self.set_interest(self._read_fd, False, False)
+        os.close(self._read_fd)
+        with self._lock:
+            for i in range(self._threads):
+                self._requests.put(None)
+            if self._threads == 0:
+                os.close(self._write_fd)
+        self._close_idle()
+
+    def _close_idle(self):
+        with self._lock:
+            idle = self._idle
+            self._idle = collections.defaultdict(list)
+        for conns in idle.itervalues():
+            for conn in conns:
+                conn.close()
+
+    def is_finished(self):
+        return self.closed
+
+    def _work(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                break
+            request_id, method, url, headers, body = request
+            status, data = self._fetch(method, url, headers, body)
+            self._responses.append(HttpResponse(request_id, status, data))
+            try:
+                os.write(self._write_fd, 'x')
+            except OSError as e:
+                # The event source was closed while the request ran.
+                if e.errno != errno.EPIPE:  # pragma: no cover
+                    raise
+        with self._lock:
+            self._threads -= 1
+            if self._threads == 0:
+                os.close(self._write_fd)
+        self._close_idle()
+
+    def _fetch(self, method, url, headers, body):
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+        if query:
+            path += '?' + query
+
+        while True:
+            conn, reused = self._connection(netloc)
+            try:
+                conn.request(method, path, body, headers or {})
+                res = conn.getresponse()
+                data = res.read()
+            except (socket.error, httplib.HTTPException) as e:
+                conn.close()
+                if reused:
+                    logging.debug('HTTP connection to %s was closed, '
+                                  'trying a new one: %s', netloc, e)
+                    continue
+                return 418, str(e)  # teapot
+            if res.will_close:
+                conn.close()
+            else:
+                with self._lock:
+                    self._idle[netloc].append(conn)
+            return res.status, data
+
+    def _connection(self, netloc):
+        with self._lock:
+            if self._idle[netloc]:
+                return self._idle[netloc].pop(), True
+        return httplib.HTTPConnection(netloc, timeout=self.timeout), False
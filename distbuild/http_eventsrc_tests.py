@@ -0,0 +1,183 @@
+# distbuild/http_eventsrc_tests.py -- unit tests for background HTTP requests
+#
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import BaseHTTPServer
+import SocketServer
+import socket
+import threading
+import time
+import unittest
+
+import distbuild
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    '''Answer every request with its path, after an optional delay.
+
+    /slow waits half a second before answering, /bye says the connection
+    will be closed, and /close answers and then closes the connection
+    without saying that it will.
+
+    '''
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/slow':
+            time.sleep(0.5)
+        body = self.path
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        if self.path == '/bye':
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+        if self.path == '/close':
+            self.close_connection = 1
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(
+            self, ('127.0.0.1', 0), StubHandler)
+        self.connections = 0
+        self.open_connections = 0
+        self._lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        with self._lock:
+            self.open_connections += 1
+        SocketServer.ThreadingMixIn.process_request(
+            self, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            SocketServer.ThreadingMixIn.process_request_thread(
+                self, request, client_address)
+        finally:
+            with self._lock:
+                self.open_connections -= 1
+
+    def wait_for_connections_to_close(self, timeout=5):
+        deadline = time.time() + timeout
+        while self.open_connections > 0 and time.time() < deadline:
+            time.sleep(0.01)
+        return self.open_connections == 0
+
+
+class HttpEventSourceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.loop = distbuild.mainloop.TestableMainLoop()
+        self.http = distbuild.HttpEventSource(max_requests=2, timeout=5)
+        self.loop.add_event_source(self.http)
+
+    def tearDown(self):
+        if not self.http.closed:
+            self.http.close()
+        self.assertTrue(self.server.wait_for_connections_to_close())
+        self.server.shutdown()
+        self.server.server_close()
+
+    def responses(self, count):
+        '''Run the main loop until count responses have come back.'''
+
+        responses = []
+        while len(responses) < count:
+            self.loop._events_sent_this_cycle = []
+            self.loop._run_once()
+            responses.extend(
+                event for source, event in self.loop._events_sent_this_cycle
+                if source is self.http)
+        return sorted((r.request_id, r.status, r.body) for r in responses)
+
+    def test_makes_requests_at_the_same_time(self):
+        started = time.time()
+        self.http.request(1, 'GET', self.url + '/slow')
+        self.http.request(2, 'GET', self.url + '/slow')
+        self.assertEqual(self.responses(2),
+                         [(1, 200, '/slow'), (2, 200, '/slow')])
+        self.assertTrue(time.time() - started < 0.9)
+
+    def test_keeps_connections_open(self):
+        self.http.request(1, 'GET', self.url + '/first?x=1')
+        self.assertEqual(self.responses(1), [(1, 200, '/first?x=1')])
+        self.http.request(2, 'GET', self.url + '/second')
+        self.assertEqual(self.responses(1), [(2, 200, '/second')])
+        self.assertEqual(self.server.connections, 1)
+
+    def test_does_not_keep_connections_server_will_close(self):
+        self.http.request(1, 'GET', self.url + '/bye')
+        self.assertEqual(self.responses(1), [(1, 200, '/bye')])
+        self.assertEqual(self.http._idle.values(), [[]])
+
+    def test_retries_on_new_connection_if_server_closed_it(self):
+        self.http.request(1, 'GET', self.url + '/close')
+        self.assertEqual(self.responses(1), [(1, 200, '/close')])
+        self.http.request(2, 'GET', self.url + '/again')
+        self.assertEqual(self.responses(1), [(2, 200, '/again')])
+        self.assertEqual(self.server.connections, 2)
+
+    def test_reports_failed_requests(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        url = 'http://127.0.0.1:%d/' % sock.getsockname()[1]
+        sock.close()
+        self.http.request(1, 'GET', url)
+        [(request_id, status, body)] = self.responses(1)
+        self.assertEqual(status, 418)
+
+    def test_ignores_responses_after_closing(self):
+        self.http.request(1, 'GET', self.url + '/slow')
+        time.sleep(0.1)
+        self.http.close()
+        self.assertTrue(self.http.is_finished())
+        time.sleep(0.6)
+        self.assertEqual(self.http._threads, 0)
+
+    def test_closes_kept_connections(self):
+        self.http.request(1, 'GET', self.url + '/first')
+        self.http.request(2, 'GET', self.url + '/second')
+        self.assertEqual(self.responses(2),
+                         [(1, 200, '/first'), (2, 200, '/second')])
+        self.http.close()
+        self.assertTrue(self.server.wait_for_connections_to_close())
+
+    def test_closes_connections_of_requests_running_when_closed(self):
+        self.http.request(1, 'GET', self.url + '/slow')
+        time.sleep(0.1)
+        self.http.close()
+        self.assertTrue(self.server.wait_for_connections_to_close())
+        self.assertEqual(self.http._idle, {})
+
+    def test_closes_without_having_made_requests(self):
+        self.http.close()
+        self.assertTrue(self.http.is_finished())
@@ -1,6 +1,6 @@
 # distbuild/initiator.py -- state machine for the initiator
 #
-# Copyright (C) 2012, 2014-2015  Codethink Limited
+# Copyright (C) 2012, 2014-2015,2026  Codethink Limited
 # 
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -118,6 +118,10 @@ class Initiator(distbuild.StateMachine):
             protocol_version=distbuild.protocol.VERSION,
             allow_detach=self.allow_detach,
         )
+        if self._app.settings['initiator-summary-output']:
+            # Controllers refuse fields they don't know, so this is only
+            # sent when it's wanted.
+            msg['summary_output'] = True
         self._jm.send(msg)
         logging.debug('Initiator: sent to controller: %s', repr(msg))
 
@@ -1,6 +1,6 @@
 # distbuild/initiator_connection.py -- communicate with initiator
 #
-# Copyright (C) 2012, 2014-2015  Codethink Limited
+# Copyright (C) 2012, 2014-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -59,11 +59,13 @@ class InitiatorConnection(distbuild.StateMachine):
     _idgen = distbuild.IdentifierGenerator('InitiatorConnection')
     _route_map = distbuild.RouteMap()
 
-    def __init__(self, conn, artifact_cache_server, morph_instance):
+    def __init__(self, conn, artifact_cache_server, morph_instance,
+                 build_times):
         distbuild.StateMachine.__init__(self, 'idle')
         self.conn = conn
         self.artifact_cache_server = artifact_cache_server
         self.morph_instance = morph_instance
+        self.build_times = build_times
         self.initiator_name = conn.remotename()
         self._debug_build_output = False
 
@@ -173,7 +175,7 @@ class InitiatorConnection(distbuild.StateMachine):
         event.msg['id'] = new_id
         build_controller = distbuild.BuildController(
             self, event.msg, self.artifact_cache_server,
-            self.morph_instance)
+            self.morph_instance, self.build_times)
         self.mainloop.add_state_machine(build_controller)
         self.mainloop.build_info.append(build_controller.build_info)
 
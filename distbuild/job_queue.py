@@ -0,0 +1,199 @@
+# distbuild/job_queue.py -- queue of worker build jobs
+#
+# Copyright (C) 2012, 2014-2015,2026  Codethink Limited
+# 
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import heapq
+import itertools
+import logging
+import time
+
+
+class Job(object):
+
+    def __init__(self, job_id, artifact, initiator_id, priority=0):
+        self.id = job_id
+        self.artifact = artifact
+        self.initiators = [initiator_id]
+        self.priority = priority
+        self.who = None  # we don't know who's going to do this yet
+        self.started = None
+
+        self._state = 'queued'
+        # The JobQueues that this job is in, which index it by state
+        # and by initiator.
+        self._queues = []
+
+    def describe_state(self):
+        if self.who is not None:
+            return self._state + ', given to %s' % self.who
+        else:
+            return self._state
+
+    def running(self):
+        return self._state == 'running'
+
+    def failed(self):
+        return self._state == 'failed'
+
+    def set_state(self, state):
+        assert state in ['queued', 'running', 'complete', 'failed']
+        logging.debug('Setting job state for job %s with id %s to %s',
+                      self.artifact.basename(), self.id, state)
+        if state == 'running' and self._state != 'running':
+            self.started = time.time()
+        self._state = state
+        for queue in self._queues:
+            queue._update_state(self)
+
+    def add_initiator(self, initiator_id):
+        self.initiators.append(initiator_id)
+        for queue in self._queues:
+            queue._index_initiator(self, initiator_id)
+
+    def remove_initiator(self, initiator_id):
+        self.initiators.remove(initiator_id)
+        for queue in self._queues:
+            queue._unindex_initiator(self, initiator_id)
+
+
+class JobQueue(object):
+    '''Tracks worker build jobs that are queued, or in progress.
+
+    Jobs that have not been given to a worker yet are served highest
+    priority first, and in the order they were added if their
+    priorities are the same.
+
+    Jobs are indexed by id, artifact basename, initiator and whether
+    they are running, so that looking them up doesn't get slower as
+    the queue grows. Jobs tell the queues they are in when their state
+    or initiators change.
+
+    '''
+
+    def __init__(self, owner):
+        self._owner = owner
+        self._jobs = {}
+        # artifact basename -> {job id: job}
+        self._by_artifact = {}
+        # initiator id -> {job id: job}
+        self._by_initiator = {}
+        # job id -> job, for running jobs
+        self._running = {}
+        # Heap of (-priority, sequence number, job). Jobs that have been
+        # given to a worker or removed are dropped when they reach the top.
+        self._waiting = []
+        self._sequence = itertools.count()
+
+    def get_running_job_for_artifact(self, artifact_basename):
+        jobs = [job for job in
+                self._by_artifact.get(artifact_basename, {}).itervalues()
+                if job.running()]
+        if len(jobs) > 1:
+            logging.warn('More than one running job for %s',
+                         artifact_basename)
+        if not jobs:
+            return None
+        return jobs[0]
+
+    def get_job_for_id(self, id):
+        return self._jobs.get(id, None)
+
+    def get_jobs_for_initiator(self, initiator_id):
+        return self._by_initiator.get(initiator_id, {}).values()
+
+    def add(self, job):
+        artifact_basename = job.artifact.basename()
+
+        if self.has_job_for_artifact(artifact_basename):
+            logging.info(
+                "Duplicate job for %s added to %s job queue.",
+                artifact_basename, self._owner)
+        self._jobs[job.id] = job
+        self._by_artifact.setdefault(artifact_basename, {})[job.id] = job
+        for initiator_id in job.initiators:
+            self._index_initiator(job, initiator_id)
+        self._update_state(job)
+        job._queues.append(self)
+        if job.who is None:
+            heapq.heappush(self._waiting,
+                           (-job.priority, next(self._sequence), job))
+
+    def remove(self, job):
+        if job.id in self._jobs:
+            del self._jobs[job.id]
+            artifact_basename = job.artifact.basename()
+            _remove_from_index(self._by_artifact, artifact_basename, job)
+            for initiator_id in job.initiators:
+                _remove_from_index(self._by_initiator, initiator_id, job)
+            self._running.pop(job.id, None)
+            job._queues.remove(self)
+        else:
+            logging.warning("Tried to remove a job that doesn't exist "
+                            "(%s)", job.artifact.basename())
+
+    def _index_initiator(self, job, initiator_id):
+        self._by_initiator.setdefault(initiator_id, {})[job.id] = job
+
+    def _unindex_initiator(self, job, initiator_id):
+        if initiator_id not in job.initiators:
+            _remove_from_index(self._by_initiator, initiator_id, job)
+
+    def _update_state(self, job):
+        if job.running():
+            self._running[job.id] = job
+        else:
+            self._running.pop(job.id, None)
+
+    def has_job_for_artifact(self, artifact_basename):
+        return artifact_basename in self._by_artifact
+
+    def __iter__(self):
+        return self._jobs.itervalues()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def remove_jobs(self, jobs):
+        for job in jobs:
+            self.remove(job)
+
+    def get_next_job(self):
+        '''Return the waiting job with the highest priority, or None.'''
+
+        while self._waiting:
+            job = self._waiting[0][2]
+            if job.who is None and self._jobs.get(job.id) is job:
+                return job
+            heapq.heappop(self._waiting)
+        return None
+
+    def running_jobs(self):
+        return self._running.values()
+
+    def __repr__(self):
+        items = []
+        for job in self._jobs.itervalues():
+            items.append(
+                '%s (%s)' % (job.artifact.basename(), job.describe_state()))
+        return str(items)
+
+
+def _remove_from_index(index, key, job):
+    jobs = index.get(key)
+    if jobs is not None:
+        jobs.pop(job.id, None)
+        if not jobs:
+            del index[key]
@@ -0,0 +1,142 @@
+# distbuild/job_queue_tests.py -- unit tests for the job queue
+#
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+
+import distbuild
+from distbuild.job_queue import Job, JobQueue
+
+
+class DummyArtifact(object):
+
+    def __init__(self, basename):
+        self._basename = basename
+
+    def basename(self):
+        return self._basename
+
+
+class UnscannableDict(dict):
+
+    def _scan(self, *args):
+        raise AssertionError('Looked at every job')
+
+    __iter__ = itervalues = values = keys = items = _scan
+
+
+class JobTests(unittest.TestCase):
+
+    def test_describes_state(self):
+        job = Job('job', DummyArtifact('gcc'), 'initiator')
+        self.assertEqual(job.describe_state(), 'queued')
+        self.assertFalse(job.failed())
+        job.who = 'worker'
+        job.set_state('failed')
+        self.assertEqual(job.describe_state(), 'failed, given to worker')
+        self.assertTrue(job.failed())
+
+
+class JobQueueTests(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = JobQueue(owner='test')
+        self.job = Job('job', DummyArtifact('gcc'), 'initiator')
+        self.queue.add(self.job)
+
+    def test_lists_jobs(self):
+        other = Job('other', DummyArtifact('gcc'), 'initiator')
+        self.queue.add(other)
+        self.assertEqual(len(self.queue), 2)
+        self.assertEqual(set(self.queue), set([self.job, other]))
+        self.assertEqual(repr(self.queue).count('gcc (queued)'), 2)
+        self.queue.remove_jobs([self.job, other])
+        self.assertEqual(len(self.queue), 0)
+
+    def test_ignores_removing_job_that_is_not_queued(self):
+        self.queue.remove(self.job)
+        self.queue.remove(self.job)
+        self.assertEqual(len(self.queue), 0)
+
+    def test_serves_nothing_once_every_job_is_given_out(self):
+        self.assertEqual(self.queue.get_next_job(), self.job)
+        self.job.who = 'worker'
+        self.assertEqual(self.queue.get_next_job(), None)
+        self.assertEqual(self.queue._waiting, [])
+
+    def test_finds_first_of_several_running_jobs_for_artifact(self):
+        other = Job('other', DummyArtifact('gcc'), 'initiator')
+        self.queue.add(other)
+        self.job.set_state('running')
+        other.set_state('running')
+        self.assertIn(self.queue.get_running_job_for_artifact('gcc'),
+                      [self.job, other])
+
+
+class JobQueueIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = JobQueue(owner='test')
+        self.job = Job('job', DummyArtifact('gcc'), 'initiator')
+        self.queue.add(self.job)
+
+    def test_finds_jobs_by_artifact(self):
+        self.assertTrue(self.queue.has_job_for_artifact('gcc'))
+        self.assertFalse(self.queue.has_job_for_artifact('glibc'))
+        self.queue.remove(self.job)
+        self.assertFalse(self.queue.has_job_for_artifact('gcc'))
+
+    def test_finds_running_jobs_when_their_state_changes(self):
+        self.assertEqual(self.queue.get_running_job_for_artifact('gcc'),
+                         None)
+        self.job.set_state('running')
+        self.assertEqual(self.queue.get_running_job_for_artifact('gcc'),
+                         self.job)
+        self.assertEqual(self.queue.running_jobs(), [self.job])
+        self.job.set_state('failed')
+        self.assertEqual(self.queue.running_jobs(), [])
+
+    def test_updates_every_queue_a_job_is_in(self):
+        other = JobQueue(owner='other')
+        other.add(self.job)
+        self.job.set_state('running')
+        self.assertEqual(self.queue.running_jobs(), [self.job])
+        self.assertEqual(other.running_jobs(), [self.job])
+        other.remove(self.job)
+        self.job.set_state('complete')
+        self.assertEqual(self.queue.running_jobs(), [])
+
+    def test_finds_jobs_by_initiator(self):
+        self.job.add_initiator('other')
+        self.assertEqual(self.queue.get_jobs_for_initiator('other'),
+                         [self.job])
+        self.job.remove_initiator('initiator')
+        self.assertEqual(self.queue.get_jobs_for_initiator('initiator'), [])
+        self.queue.remove(self.job)
+        self.assertEqual(self.queue.get_jobs_for_initiator('other'), [])
+
+    def test_does_not_look_at_every_job(self):
+        for i in range(100):
+            self.queue.add(Job(i, DummyArtifact('a%d' % i), 'initiator'))
+        self.queue._jobs = UnscannableDict(self.queue._jobs)
+
+        self.job.set_state('running')
+        self.queue.has_job_for_artifact('gcc')
+        self.queue.get_running_job_for_artifact('gcc')
+        self.queue.get_job_for_id('job')
+        self.queue.running_jobs()
+        self.queue.get_next_job()
+        self.queue.remove(self.job)
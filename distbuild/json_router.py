@@ -1,6 +1,6 @@
 # distbuild/json_router.py -- state machine to route JSON messages
 #
-# Copyright (C) 2012, 2014-2015  Codethink Limited
+# Copyright (C) 2012, 2014-2015,2026  Codethink Limited
 # 
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -31,6 +31,9 @@ class JsonRouter(distbuild.StateMachine):
     sent to the next free helper. The helper's response will retain
     the unique id, so that the response can be routed to the right
     client.
+
+    A worker-info-request is answered by the router itself, with the
+    number of builds the worker runs at the same time.
     
     '''
 
@@ -40,9 +43,10 @@ class JsonRouter(distbuild.StateMachine):
     request_counter = distbuild.IdentifierGenerator('JsonRouter')
     route_map = distbuild.RouteMap()
 
-    def __init__(self, conn):
+    def __init__(self, conn, build_slots=1):
         distbuild.StateMachine.__init__(self, 'idle')
         self.conn = conn
+        self.build_slots = build_slots
         logging.debug('JsonMachine: connection from %s', conn.getpeername())
 
     def setup(self):
@@ -72,8 +76,15 @@ class JsonRouter(distbuild.StateMachine):
             'exec-output': self.do_exec_output,
             'exec-response': self.do_response,
             'helper-ready': self.do_helper_ready,
+            'worker-info-request': self.do_worker_info,
         }
         handler = handlers.get(event.msg['type'])
+        if handler is None:
+            # Sent by a newer controller or helper: ignore it, rather than
+            # stopping everything.
+            logging.warning('JsonRouter: ignoring unknown message type %s',
+                            event.msg['type'])
+            return
         handler(event_source, event)
 
     def do_request(self, client, event):
@@ -81,6 +92,13 @@ class JsonRouter(distbuild.StateMachine):
         if self.pending_helpers:
             self._send_request()
 
+    def do_worker_info(self, client, event):
+        msg = distbuild.message(
+            'worker-info', id=event.msg['id'], build_slots=self.build_slots,
+            artifact_format=distbuild.artifact_reference.FORMAT_VERSION)
+        client.send(msg)
+        logging.debug('JsonRouter: sent to client: %s', repr(msg))
+
     def do_cancel(self, client, event):
         for id in self.route_map.get_outgoing_ids(event.msg['id']):
             logging.debug('JsonRouter: looking up request for id %s', id)
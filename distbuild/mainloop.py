@@ -1,6 +1,6 @@
-# mainloop/mainloop.py -- select-based main loop
+# mainloop/mainloop.py -- poll-based main loop
 #
-# Copyright (C) 2012, 2014-2015  Codethink Limited
+# Copyright (C) 2012, 2014-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -18,13 +18,19 @@
 import fcntl
 import logging
 import os
-import select
 import collections
 
+from poller import make_poller
+
+
+# Owner of the file descriptors of event sources that are asked for
+# them on every iteration, rather than watching them themselves.
+_POLLED = object()
+
 
 class MainLoop(object):
 
-    '''A select-based main loop.
+    '''A poll-based main loop.
     
     The main loop watches a set of file descriptors wrapped in 
     EventSource objects, and when something happens with them,
@@ -32,15 +38,35 @@ class MainLoop(object):
     feeds into user-supplied state machines. The state machines
     can create further events, which are processed further.
     
-    When nothing is happening, the main loop sleeps in the
-    select.select call.
+    When nothing is happening, the main loop sleeps in its poller,
+    which uses epoll where it can, and poll or select otherwise.
+
+    An event source with an attach method (an FdEventSource) calls
+    watch and unwatch when what it is interested in changes, and is
+    only asked for events when one of its file descriptors is ready.
+    Other event sources are asked with get_select_params on every
+    iteration, and are always asked for events.
+
+    Each event is only offered to the machines that have a transition
+    for its source and class, in the order the machines were added.
     
     '''
 
     def __init__(self):
-        self._machines = []
+        # Machines, in the order they were added, mapped to a sequence
+        # number that keeps that order.
+        self._machines = collections.OrderedDict()
+        self._next_machine_number = 0
+        # (event source, event class) -> machines with transitions for it
+        self._listeners = {}
+        # Event sources without an attach method
         self._sources = []
-        self._events = []
+        # fd -> {event source: (read, write)}
+        self._watches = {}
+        # fd -> (read, write) for the event sources in self._sources
+        self._polled = {}
+        self._poller = make_poller()
+        self._events = collections.deque()
         self.build_info = collections.deque(maxlen=1000)
         self.dump_filename = None
         
@@ -48,7 +74,10 @@ class MainLoop(object):
         logging.debug('MainLoop.add_state_machine: %s' % machine)
         machine.mainloop = self
         machine.setup()
-        self._machines.append(machine)
+        self._machines[machine] = self._next_machine_number
+        self._next_machine_number += 1
+        for state, event_source, event_class in machine.transition_keys():
+            self.listen(machine, event_source, event_class)
         if self.dump_filename:
             filename = '%s%s.dot' % (self.dump_filename, 
                                      machine.__class__.__name__)
@@ -56,43 +85,131 @@ class MainLoop(object):
 
     def remove_state_machine(self, machine):
         logging.debug('MainLoop.remove_state_machine: %s' % machine)
-        self._machines.remove(machine)
+        del self._machines[machine]
+        for state, event_source, event_class in machine.transition_keys():
+            listeners = self._listeners.get((event_source, event_class))
+            if listeners is not None:
+                listeners.discard(machine)
+                if not listeners:
+                    del self._listeners[(event_source, event_class)]
+
+    def listen(self, machine, event_source, event_class):
+        '''Offer events of a class from a source to a machine.
+
+        This is called for each transition of a machine when it's added,
+        and by the machine for transitions it adds later.
+
+        '''
+
+        if machine in self._machines:
+            key = (event_source, event_class)
+            self._listeners.setdefault(key, set()).add(machine)
+
+    def _listeners_for(self, event_source, event):
+        listeners = self._listeners.get((event_source, event.__class__))
+        if not listeners:
+            return []
+        return sorted(listeners, key=self._machines.get)
 
     def state_machines_of_type(self, machine_type):
         return [m for m in self._machines if isinstance(m, machine_type)]
 
     def add_event_source(self, event_source):
         logging.debug('MainLoop.add_event_source: %s' % event_source)
-        self._sources.append(event_source)
+        attach = getattr(event_source, 'attach', None)
+        if attach is not None:
+            attach(self)
+        else:
+            self._sources.append(event_source)
     
     def remove_event_source(self, event_source):
         logging.debug('MainLoop.remove_event_source: %s' % event_source)
-        self._sources.remove(event_source)
-    
+        detach = getattr(event_source, 'detach', None)
+        if detach is not None:
+            detach()
+        else:
+            self._sources.remove(event_source)
+
+    def watch(self, event_source, fd, read, write):
+        '''Change what an event source watches fd for.
+
+        The poller is only told if what fd is watched for changes, or
+        if the event source is new to fd, in case fd is a reused number
+        the poller has forgotten about.
+
+        '''
+
+        owners = self._watches.get(fd, {})
+        old = self._combined_interest(owners)
+        is_new = event_source not in owners
+        if read or write:
+            owners[event_source] = (read, write)
+        elif is_new:
+            return
+        else:
+            del owners[event_source]
+
+        if owners:
+            self._watches[fd] = owners
+            new = self._combined_interest(owners)
+            if is_new or new != old:
+                self._poller.register(fd, *new)
+        else:
+            del self._watches[fd]
+            self._poller.unregister(fd)
+
+    def unwatch(self, event_source, fd):
+        '''Stop an event source watching fd.'''
+
+        self.watch(event_source, fd, False, False)
+
+    def _combined_interest(self, owners):
+        read = any(r for r, w in owners.itervalues())
+        write = any(w for r, w in owners.itervalues())
+        return read, write
+
     def _setup_select(self):
-        r = []
-        w = []
-        x = []
+        polled = {}
         timeout = None
 
         self._sources = [s for s in self._sources if not s.is_finished()]
         
         for event_source in self._sources:
             sr, sw, sx, st = event_source.get_select_params()
-            r.extend(sr)
-            w.extend(sw)
-            x.extend(sx)
+            for fd in sr:
+                polled[fd] = (True, polled.get(fd, (False, False))[1])
+            for fd in sw:
+                polled[fd] = (polled.get(fd, (False, False))[0], True)
             if timeout is None:
                 timeout = st
             elif st is not None:
                 timeout = min(timeout, st)
 
-        return r, w, x, timeout
+        for fd in self._polled:
+            if fd not in polled:
+                self.unwatch(_POLLED, fd)
+        for fd, (read, write) in polled.iteritems():
+            if self._polled.get(fd) != (read, write):
+                self.watch(_POLLED, fd, read, write)
+        self._polled = polled
+
+        return timeout
 
     def _run_once(self):
-        r, w, x, timeout = self._setup_select()
-        assert r or w or x or timeout is not None
-        r, w, x = select.select(r, w, x, timeout)
+        timeout = self._setup_select()
+        assert self._watches or timeout is not None
+        r, w, x = self._poller.poll(timeout)
+
+        ready = []
+        seen = set([_POLLED])
+        for fd in r | w | x:
+            for event_source in self._watches.get(fd, ()):
+                if event_source not in seen:
+                    seen.add(event_source)
+                    ready.append(event_source)
+        for event_source in ready:
+            for event in event_source.get_events(r, w, x):
+                self.queue_event(event_source, event)
 
         for event_source in self._sources:
             if event_source.is_finished():
@@ -102,7 +219,7 @@ class MainLoop(object):
                     self.queue_event(event_source, event)
 
         for event_source, event in self._dequeue_events():
-            for machine in self._machines[:]:
+            for machine in self._listeners_for(event_source, event):
                 for new_event in machine.handle_event(event_source, event):
                     self.queue_event(event_source, new_event)
                 if machine.state is None:
@@ -128,7 +245,7 @@ class MainLoop(object):
 
     def _dequeue_events(self):
         while self._events:
-            event_source, event = self._events.pop(0)
+            event_source, event = self._events.popleft()
 
             yield event_source, event
 
@@ -0,0 +1,291 @@
+# distbuild/mainloop_tests.py -- unit tests for the main loop
+#
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import socket
+import unittest
+
+import distbuild
+
+
+class Tick(distbuild.EventSource):
+
+    '''Wake the main loop up straight away, without making any events.'''
+
+    def get_select_params(self):
+        return [], [], [], 0
+
+    def get_events(self, r, w, x):
+        return []
+
+    def is_finished(self):
+        return False
+
+
+class Ping(object):
+
+    pass
+
+
+class Pong(object):
+
+    pass
+
+
+class Recorder(distbuild.StateMachine):
+
+    def __init__(self, name, log, source, children=()):
+        distbuild.StateMachine.__init__(self, 'waiting')
+        self.name = name
+        self.log = log
+        self.source = source
+        self.children = children
+
+    def setup(self):
+        for child in self.children:
+            self.mainloop.add_state_machine(child)
+        self.add_transitions([
+            ('waiting', self.source, Ping, 'waiting', self._record),
+            ('waiting', self.source, Pong, None, self._record),
+        ])
+
+    def _record(self, event_source, event):
+        self.log.append((self.name, event.__class__.__name__))
+
+
+class Replier(Recorder):
+
+    '''Answer each Ping with a Pong, which stops every Recorder.'''
+
+    def _record(self, event_source, event):
+        Recorder._record(self, event_source, event)
+        if isinstance(event, Ping):
+            return [Pong()]
+
+
+class Spawner(Recorder):
+
+    '''Start a new machine when stopped by a Pong.'''
+
+    def _record(self, event_source, event):
+        Recorder._record(self, event_source, event)
+        if isinstance(event, Pong):
+            self.mainloop.add_state_machine(
+                Dumper('child', self.log, object()))
+
+
+class Dumper(Recorder):
+
+    def dump_dot(self, filename):
+        self.log.append(('dump_dot', filename))
+
+
+class PolledSocket(distbuild.EventSource):
+
+    '''Watch a socket for reading, being asked on every iteration.'''
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def get_select_params(self):
+        return [self.sock.fileno()], [], [], None
+
+    def get_events(self, r, w, x):
+        if self.sock.fileno() in r:
+            return [Ping()]
+        return []
+
+    def is_finished(self):
+        return False
+
+
+class Timer(distbuild.EventSource):
+
+    '''Ask to be woken up, and to write to a file descriptor.
+
+    The timer finishes after it has been asked for its parameters once.
+
+    '''
+
+    def __init__(self, fd, timeout):
+        self.fd = fd
+        self.timeout = timeout
+        self.finished = False
+
+    def get_select_params(self):
+        self.finished = True
+        return [], [self.fd], [], self.timeout
+
+    def get_events(self, r, w, x):
+        return []
+
+    def is_finished(self):
+        return self.finished
+
+
+class MainLoopTests(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = distbuild.mainloop.TestableMainLoop()
+        self.loop.add_event_source(Tick())
+        self.source = object()
+        self.log = []
+
+    def test_offers_events_in_order_machines_were_added(self):
+        child = Recorder('child', self.log, self.source)
+        for name in ['a', 'b']:
+            self.loop.add_state_machine(
+                Recorder(name, self.log, self.source))
+        self.loop.add_state_machine(
+            Recorder('parent', self.log, self.source, [child]))
+        self.loop.queue_event(self.source, Ping())
+        self.loop.queue_event(self.source, Ping())
+        self.loop._run_once()
+        self.assertEqual(self.log, [('a', 'Ping'), ('b', 'Ping'),
+                                    ('child', 'Ping'), ('parent', 'Ping')] * 2)
+
+    def test_only_offers_events_to_interested_machines(self):
+        other = Recorder('other', self.log, object())
+        self.loop.add_state_machine(other)
+        self.loop.add_state_machine(Recorder('me', self.log, self.source))
+        self.loop.queue_event(self.source, Ping())
+        self.loop._run_once()
+        self.assertEqual(self.log, [('me', 'Ping')])
+
+    def test_offers_events_for_transitions_added_later(self):
+        machine = Recorder('me', self.log, object())
+        self.loop.add_state_machine(machine)
+        machine.add_transition('waiting', self.source, Ping, 'waiting',
+                               machine._record)
+        self.loop.queue_event(self.source, Ping())
+        self.loop._run_once()
+        self.assertEqual(self.log, [('me', 'Ping')])
+
+    def test_removes_finished_machines(self):
+        machine = Recorder('me', self.log, self.source)
+        self.loop.add_state_machine(machine)
+        self.loop.queue_event(self.source, Pong())
+        self.loop.queue_event(self.source, Ping())
+        self.loop._run_once()
+        self.assertEqual(self.log, [('me', 'Pong')])
+        self.assertEqual(self.loop.state_machines_of_type(Recorder), [])
+        self.assertEqual(self.loop._listeners, {})
+
+    def test_queues_events_returned_by_machines(self):
+        self.loop.add_state_machine(Replier('me', self.log, self.source))
+        self.loop.queue_event(self.source, Ping())
+        self.loop.run()
+        self.assertEqual(self.log, [('me', 'Ping'), ('me', 'Pong')])
+
+    def test_dumps_machines_when_asked_to(self):
+        self.loop.dump_filename = 'prefix-'
+        self.loop.add_state_machine(Dumper('me', self.log, self.source))
+        self.assertEqual(self.log, [('dump_dot', 'prefix-Dumper.dot')])
+
+    def test_runs_until_event(self):
+        self.loop.add_state_machine(Replier('me', self.log, self.source))
+        self.loop.add_state_machine(Recorder('other', self.log, object()))
+        self.loop.queue_event(self.source, Ping())
+        event = self.loop.run_until_event(self.source, Pong)
+        self.assertEqual(event.__class__, Pong)
+        self.assertEqual(self.log, [('me', 'Ping'), ('me', 'Pong')])
+
+    def test_runs_until_new_state_machine(self):
+        self.loop.add_state_machine(Replier('me', self.log, self.source))
+        self.loop.add_state_machine(Spawner('parent', self.log, self.source))
+        self.loop.queue_event(self.source, Ping())
+        machine = self.loop.run_until_new_state_machine(Dumper)
+        self.assertEqual(machine.name, 'child')
+
+
+class MainLoopWatchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = distbuild.mainloop.TestableMainLoop()
+        self.loop.add_event_source(Tick())
+        self.sock, self.peer = socket.socketpair()
+        self.src = distbuild.SocketEventSource(self.sock)
+        self.src.stop_writing()
+
+    def tearDown(self):
+        if self.src.sock is not None:
+            self.src.close()
+        self.peer.close()
+
+    def events_from(self, event_source):
+        self.loop._events_sent_this_cycle = []
+        self.loop._run_once()
+        return [event.__class__ for source, event in
+                self.loop._events_sent_this_cycle if source is event_source]
+
+    def test_watches_attached_event_source(self):
+        self.loop.add_event_source(self.src)
+        self.assertEqual(self.events_from(self.src), [])
+        self.peer.send('x')
+        self.assertEqual(self.events_from(self.src),
+                         [distbuild.SocketReadable])
+
+    def test_updates_interest_incrementally(self):
+        self.loop.add_event_source(self.src)
+        fd = self.sock.fileno()
+        self.assertEqual(self.loop._watches, {fd: {self.src: (True, False)}})
+        self.src.start_writing()
+        self.assertEqual(self.loop._watches, {fd: {self.src: (True, True)}})
+        self.src.close()
+        self.assertEqual(self.loop._watches, {})
+
+    def test_stops_watching_removed_event_source(self):
+        self.loop.add_event_source(self.src)
+        self.loop.remove_event_source(self.src)
+        self.peer.send('x')
+        self.assertEqual(self.loop._watches, {})
+        self.assertEqual(self.events_from(self.src), [])
+
+    def test_proxy_reports_events_as_its_own(self):
+        proxy = distbuild.ProxyEventSource()
+        self.loop.add_event_source(proxy)
+        proxy.event_source = self.src
+        self.peer.send('x')
+        self.assertEqual(self.events_from(proxy), [distbuild.SocketReadable])
+        proxy.event_source = None
+        self.assertEqual(self.loop._watches, {})
+
+    def test_ignores_unwatching_fd_that_was_not_watched(self):
+        self.loop.unwatch(self.src, self.sock.fileno())
+        self.assertEqual(self.loop._watches, {})
+
+    def test_uses_shortest_timeout_of_polled_sources(self):
+        fd = self.sock.fileno()
+        for timeout in [10, None, 0]:
+            self.loop.add_event_source(Timer(fd, timeout))
+        self.assertEqual(self.loop._setup_select(), 0)
+        self.assertEqual(self.loop._polled, {fd: (False, True)})
+
+    def test_removes_polled_sources_that_finish(self):
+        timer = Timer(self.sock.fileno(), 0)
+        self.loop.add_event_source(timer)
+        self.loop._run_once()
+        self.assertNotIn(timer, self.loop._sources)
+
+    def test_polls_event_sources_without_attach(self):
+        polled = PolledSocket(self.sock)
+        self.loop.add_event_source(polled)
+        self.assertEqual(self.events_from(polled), [])
+        self.peer.send('x')
+        self.assertEqual(self.events_from(polled), [Ping])
+        self.loop.remove_event_source(polled)
+        self.loop._run_once()
+        self.assertEqual(self.loop._watches, {})
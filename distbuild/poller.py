@@ -0,0 +1,196 @@
+# distbuild/poller.py -- wait for file descriptors to become ready
+#
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import errno
+import fcntl
+import select
+
+
+class SelectPoller(object):
+
+    '''Wait for file descriptors with select.select.
+
+    All pollers have the same interface. A file descriptor is
+    registered once, with whether it should be watched for being
+    readable and writeable, and registered again only when that
+    changes. poll() returns three sets of the file descriptors that
+    are readable, writeable, or have an exceptional condition, like
+    select.select does.
+
+    This one works everywhere, but is limited to FD_SETSIZE file
+    descriptors, and each call is linear in the number registered.
+
+    '''
+
+    def __init__(self):
+        self._readers = set()
+        self._writers = set()
+
+    def register(self, fd, read, write):
+        '''Watch fd, or change what it is watched for.'''
+
+        if read:
+            self._readers.add(fd)
+        else:
+            self._readers.discard(fd)
+        if write:
+            self._writers.add(fd)
+        else:
+            self._writers.discard(fd)
+
+    def unregister(self, fd):
+        '''Stop watching fd.'''
+
+        self._readers.discard(fd)
+        self._writers.discard(fd)
+
+    def poll(self, timeout):
+        '''Wait until file descriptors are ready, or timeout seconds.
+
+        A timeout of None waits for ever.
+
+        '''
+
+        r, w, x = select.select(self._readers, self._writers, [], timeout)
+        return set(r), set(w), set(x)
+
+
+class PollPoller(object):
+
+    '''Wait for file descriptors with select.poll.'''
+
+    _errors = select.POLLHUP | select.POLLERR | select.POLLNVAL
+
+    def __init__(self):
+        self._poll = select.poll()
+        self._masks = {}
+
+    def register(self, fd, read, write):
+        mask = 0
+        if read:
+            mask |= select.POLLIN | select.POLLPRI
+        if write:
+            mask |= select.POLLOUT
+        # select.poll.register changes the mask of a registered fd.
+        self._poll.register(fd, mask)
+        self._masks[fd] = mask
+
+    def unregister(self, fd):
+        if self._masks.pop(fd, None) is not None:
+            self._poll.unregister(fd)
+
+    def poll(self, timeout):
+        if timeout is not None:
+            timeout = timeout * 1000
+        return _split_events(
+            self._poll.poll(timeout), self._masks,
+            select.POLLIN | select.POLLPRI, select.POLLOUT, self._errors)
+
+
+class EpollPoller(object):
+
+    '''Wait for file descriptors with select.epoll.
+
+    The kernel keeps the set of registered file descriptors, so a call
+    to poll() costs time in proportion to the ones that are ready, not
+    to all of them.
+
+    The kernel forgets a file descriptor when it is closed. If it was
+    closed without being unregistered, and the number gets reused, it
+    is registered again rather than modified.
+
+    '''
+
+    _errors = select.EPOLLHUP | select.EPOLLERR
+
+    def __init__(self):
+        self._epoll = select.epoll()
+        flags = fcntl.fcntl(self._epoll.fileno(), fcntl.F_GETFD)
+        fcntl.fcntl(self._epoll.fileno(), fcntl.F_SETFD,
+                    flags | fcntl.FD_CLOEXEC)
+        self._masks = {}
+
+    def register(self, fd, read, write):
+        mask = 0
+        if read:
+            mask |= select.EPOLLIN | select.EPOLLPRI
+        if write:
+            mask |= select.EPOLLOUT
+        if fd in self._masks:
+            try:
+                self._epoll.modify(fd, mask)
+            except (IOError, OSError) as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                self._epoll.register(fd, mask)
+        else:
+            try:
+                self._epoll.register(fd, mask)
+            except (IOError, OSError) as e:
+                if e.errno != errno.EEXIST:
+                    raise
+                self._epoll.modify(fd, mask)
+        self._masks[fd] = mask
+
+    def unregister(self, fd):
+        if self._masks.pop(fd, None) is not None:
+            try:
+                self._epoll.unregister(fd)
+            except (IOError, OSError) as e:
+                # The fd was closed before being unregistered.
+                if e.errno not in (errno.EBADF, errno.ENOENT):
+                    raise
+
+    def poll(self, timeout):
+        if timeout is None:
+            timeout = -1
+        return _split_events(
+            self._epoll.poll(timeout), self._masks,
+            select.EPOLLIN | select.EPOLLPRI, select.EPOLLOUT, self._errors)
+
+
+def _split_events(events, masks, readable, writeable, errors):
+    '''Turn (fd, event mask) pairs into sets of ready fds.
+
+    An error or hangup makes an fd ready for whatever it is watched
+    for, as select.select does, so that reading or writing it reports
+    what happened.
+
+    '''
+
+    r = set()
+    w = set()
+    for fd, event in events:
+        mask = masks.get(fd, 0)
+        if event & errors:
+            event |= mask
+        if event & mask & readable:
+            r.add(fd)
+        if event & mask & writeable:
+            w.add(fd)
+    return r, w, set()
+
+
+def make_poller():
+    '''Return the best poller this platform has.'''
+
+    if hasattr(select, 'epoll'):
+        return EpollPoller()
+    elif hasattr(select, 'poll'):
+        return PollPoller()
+    else:
+        return SelectPoller()
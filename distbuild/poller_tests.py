@@ -0,0 +1,143 @@
+# distbuild/poller_tests.py -- unit tests for the pollers
+#
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import errno
+import os
+import select
+import unittest
+
+from distbuild import poller
+
+
+class PollerTests(object):
+
+    def setUp(self):
+        self.poller = self.make_poller()
+        self.read_fd, self.write_fd = os.pipe()
+
+    def tearDown(self):
+        for fd in (self.read_fd, self.write_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def test_times_out_when_nothing_is_ready(self):
+        self.poller.register(self.read_fd, True, False)
+        self.assertEqual(self.poller.poll(0), (set(), set(), set()))
+
+    def test_reports_readable_and_writeable_fds(self):
+        self.poller.register(self.read_fd, True, False)
+        self.poller.register(self.write_fd, False, True)
+        os.write(self.write_fd, 'x')
+        r, w, x = self.poller.poll(None)
+        self.assertEqual(r, set([self.read_fd]))
+        self.assertEqual(w, set([self.write_fd]))
+
+    def test_changes_what_fd_is_watched_for(self):
+        self.poller.register(self.write_fd, True, False)
+        self.assertEqual(self.poller.poll(0), (set(), set(), set()))
+        self.poller.register(self.write_fd, False, True)
+        self.assertEqual(self.poller.poll(0)[1], set([self.write_fd]))
+
+    def test_stops_watching_unregistered_fds(self):
+        self.poller.register(self.write_fd, False, True)
+        self.poller.unregister(self.write_fd)
+        self.assertEqual(self.poller.poll(0), (set(), set(), set()))
+
+    def test_reports_hangup_as_readable(self):
+        self.poller.register(self.read_fd, True, False)
+        os.close(self.write_fd)
+        self.assertEqual(self.poller.poll(0)[0], set([self.read_fd]))
+
+    def test_registers_reused_fd_again(self):
+        self.poller.register(self.read_fd, True, False)
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+        self.read_fd, self.write_fd = os.pipe()
+        os.write(self.write_fd, 'x')
+        self.poller.register(self.read_fd, True, False)
+        self.assertEqual(self.poller.poll(0)[0], set([self.read_fd]))
+
+
+class SelectPollerTests(PollerTests, unittest.TestCase):
+
+    make_poller = poller.SelectPoller
+
+
+class PollPollerTests(PollerTests, unittest.TestCase):
+
+    make_poller = poller.PollPoller
+
+
+class FailingEpoll(object):
+
+    '''Fail every change to the registered fds with an unexpected error.'''
+
+    def fail(self, *args):
+        raise IOError(errno.ENOMEM, os.strerror(errno.ENOMEM))
+
+    register = modify = unregister = fail
+
+
+class EpollPollerTests(PollerTests, unittest.TestCase):
+
+    make_poller = poller.EpollPoller
+
+    def test_modifies_fd_the_kernel_already_has(self):
+        self.poller._epoll.register(self.write_fd, 0)
+        self.poller.register(self.write_fd, False, True)
+        self.assertEqual(self.poller.poll(0)[1], set([self.write_fd]))
+
+    def test_ignores_unregistering_closed_fd(self):
+        self.poller.register(self.read_fd, True, False)
+        os.close(self.read_fd)
+        self.poller.unregister(self.read_fd)
+        self.assertEqual(self.poller.poll(0), (set(), set(), set()))
+
+    def test_reports_other_errors(self):
+        self.poller.register(self.read_fd, True, False)
+        self.poller._epoll = FailingEpoll()
+        self.assertRaises(IOError, self.poller.register,
+                          self.read_fd, False, True)
+        self.assertRaises(IOError, self.poller.register,
+                          self.write_fd, False, True)
+        self.assertRaises(IOError, self.poller.unregister, self.read_fd)
+
+
+class MakePollerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.select = poller.select
+
+    def tearDown(self):
+        poller.select = self.select
+
+    def test_uses_best_poller_available(self):
+        class FakeSelect(object):
+            pass
+        poller.select = FakeSelect()
+        self.assertEqual(type(poller.make_poller()), poller.SelectPoller)
+        poller.select.poll = select.poll
+        self.assertEqual(type(poller.make_poller()), poller.PollPoller)
+        if hasattr(select, 'epoll'):
+            poller.select = select
+            self.assertEqual(type(poller.make_poller()), poller.EpollPoller)
+
+
+if not hasattr(select, 'epoll'):
+    del EpollPollerTests
@@ -1,6 +1,6 @@
 # distbuild/protocol.py -- abstractions for the JSON messages
 #
-# Copyright (C) 2012, 2014-2015  Codethink Limited
+# Copyright (C) 2012, 2014-2015,2026  Codethink Limited
 # 
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -86,6 +86,13 @@ _required_fields = {
     'exec-cancel': [
         'id',
     ],
+    'worker-info-request': [
+        'id',
+    ],
+    'worker-info': [
+        'id',
+        'build_slots',
+    ],
     'http-request': [
         'id',
         'url',
@@ -125,8 +132,15 @@ _required_fields = {
 _optional_fields = {
     'build-request': [
         'original_ref',
-        'component_names'
-    ]
+        'component_names',
+        'summary_output',
+    ],
+    'worker-info': [
+        'artifact_format',
+    ],
+    'exec-request': [
+        'compress_output',
+    ],
 }
 
 
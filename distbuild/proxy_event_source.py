@@ -1,6 +1,6 @@
 # distbuild/proxy_event_source.py -- proxy for temporary event sources
 #
-# Copyright (C) 2012, 2014-2015  Codethink Limited
+# Copyright (C) 2012, 2014-2015,2026  Codethink Limited
 # 
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -24,10 +24,39 @@ import distbuild
 
 class ProxyEventSource(object):
 
-    '''Proxy event sources that may come and go.'''
+    '''Proxy event sources that may come and go.
+
+    The proxied event source is not added to the main loop itself.
+    When this proxy is in a main loop, the file descriptors of the
+    proxied FdEventSource are watched on the proxy's behalf.
+
+    '''
 
     def __init__(self):
-        self.event_source = None
+        self.mainloop = None
+        self._event_source = None
+
+    @property
+    def event_source(self):
+        return self._event_source
+
+    @event_source.setter
+    def event_source(self, event_source):
+        if self._event_source is not None and self.mainloop is not None:
+            self._event_source.detach()
+        self._event_source = event_source
+        if event_source is not None and self.mainloop is not None:
+            event_source.attach(self.mainloop, owner=self)
+
+    def attach(self, mainloop):
+        self.mainloop = mainloop
+        if self._event_source is not None:
+            self._event_source.attach(mainloop, owner=self)
+
+    def detach(self):
+        if self._event_source is not None:
+            self._event_source.detach()
+        self.mainloop = None
 
     def get_select_params(self):
         if self.event_source:
@@ -43,4 +72,3 @@ class ProxyEventSource(object):
             
     def is_finished(self):
         return False
-
@@ -1,6 +1,6 @@
 # mainloop/sm.py -- state machine abstraction
 #
-# Copyright (C) 2012, 2014-2015  Codethink Limited
+# Copyright (C) 2012, 2014-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -75,6 +75,13 @@ class StateMachine(object):
         assert key not in self._transitions, \
             'Transition %s already registered' % str(key)
         self._transitions[key] = (new_state, callback)
+        mainloop = getattr(self, 'mainloop', None)
+        if mainloop is not None:
+            mainloop.listen(self, source, event_class)
+
+    def transition_keys(self):
+        '''Return the (state, source, event class) of every transition.'''
+        return self._transitions.keys()
 
     def add_transitions(self, specification):
         '''Add many transitions.
@@ -1,6 +1,6 @@
 # distbuild/sm_tests.py -- unit tests for state machine abstraction
 #
-# Copyright (C) 2012, 2014-2015  Codethink Limited
+# Copyright (C) 2012, 2014-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -95,3 +95,27 @@ class StateMachineTests(unittest.TestCase):
         self.assertEqual(self.event_sources, [self.event_source])
         self.assertEqual(self.events, [self.event])
 
+
+    def test_lists_transition_keys(self):
+        spec = [
+            ('init', self.event_source, DummyEvent, 'init', self.callback),
+            ('init', self.event_source, str, 'init', None),
+        ]
+        self.sm.add_transitions(spec)
+        self.assertEqual(
+            sorted(self.sm.transition_keys()),
+            sorted([('init', self.event_source, DummyEvent),
+                    ('init', self.event_source, str)]))
+
+    def test_tells_main_loop_about_transitions_added_later(self):
+        listened = []
+
+        class DummyMainLoop(object):
+
+            def listen(self, machine, event_source, event_class):
+                listened.append((machine, event_source, event_class))
+
+        self.sm.mainloop = DummyMainLoop()
+        self.sm.add_transition(
+            'init', self.event_source, DummyEvent, 'init', None)
+        self.assertEqual(listened, [(self.sm, self.event_source, DummyEvent)])
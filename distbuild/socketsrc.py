@@ -1,6 +1,6 @@
 # mainloop/socketsrc.py -- events and event sources for sockets
 #
-# Copyright (C) 2012, 2014-2015  Codethink Limited
+# Copyright (C) 2012, 2014-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -22,7 +22,7 @@ import socket
 
 import distbuild
 
-from eventsrc import EventSource
+from eventsrc import FdEventSource
 
 
 def set_nonblocking(handle):
@@ -56,23 +56,21 @@ class NewConnection(object):
         self.addr = addr
         
 
-class ListeningSocketEventSource(EventSource):
+class ListeningSocketEventSource(FdEventSource):
 
     '''An event source for a socket that listens for connections.'''
 
     def __init__(self, addr, port):
+        FdEventSource.__init__(self)
         self.sock = distbuild.create_socket()
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         logging.info('Binding socket to %s', addr)
         self.sock.bind((addr, port))
         self.sock.listen(5)
-        self._accepting = True
+        self._accepting = False
+        self.start_accepting()
         logging.info('Listening at %s' % self.sock.localname())
 
-    def get_select_params(self):
-        r = [self.sock.fileno()] if self._accepting else []
-        return r, [], [], None
-
     def get_events(self, r, w, x):
         if self._accepting and self.sock.fileno() in r:
             try:
@@ -89,9 +87,11 @@ class ListeningSocketEventSource(EventSource):
 
     def start_accepting(self):
         self._accepting = True
+        self.set_interest(self.sock.fileno(), True, False)
         
     def stop_accepting(self):
         self._accepting = False
+        self.set_interest(self.sock.fileno(), False, False)
 
 
 class SocketReadable(object):
@@ -110,7 +110,7 @@ class SocketWriteable(object):
         self.sock = sock
 
 
-class SocketEventSource(EventSource):
+class SocketEventSource(FdEventSource):
 
     '''Event source for normal sockets (for I/O).
     
@@ -126,20 +126,17 @@ class SocketEventSource(EventSource):
     '''
 
     def __init__(self, sock):
+        FdEventSource.__init__(self)
         self.sock = sock
         self._reading = True
         self._writing = True
+        self._update_interest()
 
         set_nonblocking(sock)
 
     def __repr__(self):
         return '<SocketEventSource at %x: socket %s>' % (id(self), self.sock)
 
-    def get_select_params(self):
-        r = [self.sock.fileno()] if self._reading else []
-        w = [self.sock.fileno()] if self._writing else []
-        return r, w, [], None
-
     def get_events(self, r, w, x):
         events = []
         fd = self.sock.fileno()
@@ -152,17 +149,25 @@ class SocketEventSource(EventSource):
             
         return events
 
+    def _update_interest(self):
+        if self.sock is not None:
+            self.set_interest(self.sock.fileno(), self._reading, self._writing)
+
     def start_reading(self):
         self._reading = True
+        self._update_interest()
         
     def stop_reading(self):
         self._reading = False
+        self._update_interest()
 
     def start_writing(self):
         self._writing = True
+        self._update_interest()
         
     def stop_writing(self):
         self._writing = False
+        self._update_interest()
 
     def read(self, max_bytes):
         fd = self.sock.fileno()
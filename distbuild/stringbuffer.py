@@ -1,6 +1,6 @@
 # mainloop/stringbuffer.py -- efficient buffering of strings as a queue
 #
-# Copyright (C) 2012, 2014-2015  Codethink Limited
+# Copyright (C) 2012, 2014-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -21,41 +21,49 @@ class StringBuffer(object):
     
     The data may arrive in small pieces, and it is buffered in a way that
     avoids excessive string catenation or splitting.
+
+    The data is kept in one bytearray, which grows at the end as data
+    is added. Removed data is only cut off the front once it is at
+    least as long as what is left, so adding and removing data costs
+    time in proportion to its length, however small the pieces are.
+    readline remembers how far it has looked for a newline, so that a
+    long line arriving in small pieces is only scanned once.
+
+    Unicode strings are added as UTF-8.
     
     '''
 
     def __init__(self):
-        self.strings = []
-        self.len = 0
+        self._buf = bytearray()
+        # Offset of the start of the data in self._buf
+        self._start = 0
+        # Offset in self._buf up to which there is no newline
+        self._scanned = 0
         
     def add(self, data):
         '''Add data to buffer.'''
-        self.strings.append(data)
-        self.len += len(data)
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self._buf.extend(data)
         
     def remove(self, num_bytes):
         '''Remove specified number of bytes from buffer.'''
-        while num_bytes > 0 and self.strings:
-            first = self.strings[0]
-            if len(first) <= num_bytes:
-                num_bytes -= len(first)
-                del self.strings[0]
-                self.len -= len(first)
-            else:
-                self.strings[0] = first[num_bytes:]
-                self.len -= num_bytes
-                num_bytes = 0
+        self._start = min(self._start + max(num_bytes, 0), len(self._buf))
+        self._compact()
+
+    def _compact(self):
+        if self._start == len(self._buf):
+            self._buf = bytearray()
+            self._start = self._scanned = 0
+        elif self._start >= len(self._buf) - self._start:
+            del self._buf[:self._start]
+            self._scanned = max(self._scanned - self._start, 0)
+            self._start = 0
 
     def peek(self):
         '''Return contents of buffer as one string.'''
         
-        if len(self.strings) == 0:
-            return ''
-        elif len(self.strings) == 1:
-            return self.strings[0]
-        else:
-            self.strings = [''.join(self.strings)]
-            return self.strings[0]
+        return str(self._buf[self._start:])
 
     def read(self, max_bytes):
         '''Return up to max_bytes from the buffer.
@@ -66,36 +74,18 @@ class StringBuffer(object):
         
         '''
         
-        use = []
-        size = 0
-        for s in self.strings:
-            n = max_bytes - size
-            if len(s) <= n:
-                use.append(s)
-                size += len(s)
-            else:
-                use.append(s[:n])
-                size += n
-                break
-        return ''.join(use)
+        return str(self._buf[self._start:self._start + max_bytes])
 
     def readline(self):
         '''Return a complete line (ends with '\n') or None.'''
 
-        for i, s in enumerate(self.strings):
-            newline = s.find('\n')
-            if newline != -1:
-                if newline+1 == len(s):
-                    use = self.strings[:i+1]
-                    del self.strings[:i+1]
-                else:
-                    pre = s[:newline+1]
-                    use = self.strings[:i] + [pre]
-                    del self.strings[:i]
-                    self.strings[0] = s[newline+1:]
-                return ''.join(use)
-        return None
+        newline = self._buf.find('\n', max(self._start, self._scanned))
+        if newline == -1:
+            self._scanned = len(self._buf)
+            return None
+        line = str(self._buf[self._start:newline+1])
+        self.remove(len(line))
+        return line
             
     def __len__(self):
-        return self.len
-
+        return len(self._buf) - self._start
@@ -1,6 +1,6 @@
 # distbuild/stringbuffer_tests.py -- unit tests
 #
-# Copyright (C) 2012, 2014-2015  Codethink Limited
+# Copyright (C) 2012, 2014-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -149,3 +149,55 @@ class StringBufferReadlineTests(unittest.TestCase):
         self.assertEqual(self.buf.readline(), 'foo\n')
         self.assertEqual(self.buf.peek(), 'bar')
 
+
+    def test_extracts_line_added_in_many_pieces(self):
+        for c in 'foo':
+            self.buf.add(c)
+            self.assertEqual(self.buf.readline(), None)
+        self.buf.add('\nbar')
+        self.assertEqual(self.buf.readline(), 'foo\n')
+        self.assertEqual(self.buf.readline(), None)
+        self.buf.add('\n')
+        self.assertEqual(self.buf.readline(), 'bar\n')
+        self.assertEqual(len(self.buf), 0)
+
+    def test_finds_line_after_data_is_removed(self):
+        self.buf.add('foobar')
+        self.assertEqual(self.buf.readline(), None)
+        self.buf.remove(5)
+        self.buf.add('\n')
+        self.assertEqual(self.buf.readline(), 'r\n')
+
+
+class StringBufferUnicodeTests(unittest.TestCase):
+
+    def test_adds_unicode_as_utf8(self):
+        buf = distbuild.StringBuffer()
+        buf.add(u'caf\xe9\n')
+        self.assertEqual(len(buf), 6)
+        self.assertEqual(buf.readline(), 'caf\xc3\xa9\n')
+
+
+class StringBufferQueueTests(unittest.TestCase):
+
+    def test_behaves_like_a_string_when_used_as_a_queue(self):
+        buf = distbuild.StringBuffer()
+        expected = ''
+        for i in range(200):
+            piece = 'x' * (i % 7) + '\n' * (i % 3 == 0)
+            buf.add(piece)
+            expected += piece
+            if i % 5 == 0:
+                self.assertEqual(buf.read(3), expected[:3])
+                buf.remove(3)
+                expected = expected[3:]
+            if i % 4 == 0:
+                line = buf.readline()
+                if '\n' in expected:
+                    end = expected.index('\n') + 1
+                    self.assertEqual(line, expected[:end])
+                    expected = expected[end:]
+                else:
+                    self.assertEqual(line, None)
+            self.assertEqual(len(buf), len(expected))
+            self.assertEqual(buf.peek(), expected)
@@ -1,6 +1,6 @@
 # distbuild/subprocess_eventsrc.py -- for managing subprocesses
 #
-# Copyright (C) 2014-2015  Codethink Limited
+# Copyright (C) 2014-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -38,7 +38,7 @@ class FileWriteable(object):
         self.file = f
 
 
-class SubprocessEventSource(distbuild.EventSource):
+class SubprocessEventSource(distbuild.FdEventSource):
     '''Event source for monitoring one or more subprocesses.
 
     This will send FileReadable and FileWritable events based on the
@@ -49,45 +49,77 @@ class SubprocessEventSource(distbuild.EventSource):
     descriptors will return None, at which point you can be sure that the
     subprocess is no longer running.
 
+    Files must be closed with close_file, so that they stop being
+    watched before their file descriptors can be reused.
+
     '''
 
     def __init__(self):
+        distbuild.FdEventSource.__init__(self)
         self.procs = []
         self.closed = False
-
-    def get_select_params(self):
-        r = []
-        w = []
-        for requst_id, p in self.procs:
-            if p.stdin_contents is not None:
-                w.append(p.stdin)
-            if p.stdout is not None:
-                r.append(p.stdout)
-            if p.stderr is not None:
-                r.append(p.stderr)
-        return r, w, [], None
+        # fd -> (request_id, process, file)
+        self._files = {}
 
     def get_events(self, r, w, x):
         events = []
 
-        for request_id, p in self.procs:
-            if p.stdin in w:
-                events.append(FileWriteable(request_id, p, p.stdin))
-            if p.stdout in r:
-                events.append(FileReadable(request_id, p, p.stdout))
-            if p.stderr in r:
-                events.append(FileReadable(request_id, p, p.stderr))
+        for fd in w:
+            if fd in self._files:
+                events.append(FileWriteable(*self._files[fd]))
+        for fd in r:
+            if fd in self._files:
+                events.append(FileReadable(*self._files[fd]))
 
         return events
 
+    def _watch(self, request_id, process, f, read, write):
+        fd = f.fileno()
+        self._files[fd] = (request_id, process, f)
+        self.set_interest(fd, read, write)
+
+    def _unwatch(self, f):
+        fd = f.fileno()
+        del self._files[fd]
+        self.set_interest(fd, False, False)
+
     def add(self, request_id, process):
 
         self.procs.append((request_id, process))
         distbuild.set_nonblocking(process.stdin)
         distbuild.set_nonblocking(process.stdout)
         distbuild.set_nonblocking(process.stderr)
+        if process.stdin_contents is not None:
+            self._watch(request_id, process, process.stdin, False, True)
+        self._watch(request_id, process, process.stdout, True, False)
+        self._watch(request_id, process, process.stderr, True, False)
+
+    def close_file(self, process, f):
+        '''Stop watching and close one of the files of a process.
+
+        Closing stdout or stderr sets that attribute of the process to
+        None. Closing stdin sets its stdin_contents to None.
+
+        '''
+
+        self._unwatch(f)
+        f.close()
+        if f is process.stdin:
+            process.stdin_contents = None
+        elif f is process.stdout:
+            process.stdout = None
+        elif f is process.stderr:
+            process.stderr = None
+
+    def _open_files(self, process):
+        files = [process.stdout, process.stderr]
+        if process.stdin_contents is not None:
+            files.append(process.stdin)
+        return [f for f in files if f is not None]
 
     def remove(self, process):
+        for f in self._open_files(process):
+            self._unwatch(f)
         self.procs = [t for t in self.procs if t[1] != process]
 
     def kill_by_id(self, request_id):
@@ -98,6 +130,9 @@ class SubprocessEventSource(distbuild.EventSource):
                 os.killpg(process.pid, signal.SIGKILL)
 
     def close(self):
+        for request_id, process in self.procs:
+            for f in self._open_files(process):
+                self._unwatch(f)
         self.procs = []
         self.closed = True
 
@@ -1,6 +1,6 @@
 # distbuild/worker_build_scheduler.py -- schedule worker-builds on workers
 #
-# Copyright (C) 2012, 2014-2015  Codethink Limited
+# Copyright (C) 2012, 2014-2015,2026  Codethink Limited
 # 
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -19,6 +19,7 @@ import collections
 import httplib
 import logging
 import socket
+import time
 import urllib
 import urlparse
 
@@ -27,9 +28,10 @@ import distbuild
 
 class WorkerBuildRequest(object):
 
-    def __init__(self, artifact, initiator_id):
+    def __init__(self, artifact, initiator_id, priority=0):
         self.artifact = artifact
         self.initiator_id = initiator_id
+        self.priority = priority
 
 class WorkerCancelPending(object):
     
@@ -99,100 +101,6 @@ class _Disconnected(object):
         self.who = who
 
 
-class Job(object):
-
-    def __init__(self, job_id, artifact, initiator_id):
-        self.id = job_id
-        self.artifact = artifact
-        self.initiators = [initiator_id]
-        self.who = None  # we don't know who's going to do this yet
-
-        self._state = 'queued'
-
-    def describe_state(self):
-        if self.who is not None:
-            return self._state + ', given to %s' % self.who
-        else:
-            return self._state
-
-    def running(self):
-        return self._state == 'running'
-
-    def failed(self):
-        return self._state == 'failed'
-
-    def set_state(self, state):
-        assert state in ['queued', 'running', 'complete', 'failed']
-        logging.debug('Setting job state for job %s with id %s to %s',
-                      self.artifact.basename(), self.id, state)
-        self._state = state
-
-
-class JobQueue(object):
-    '''Tracks worker build jobs that are queued, or in progress.'''
-
-    def __init__(self, owner):
-        self._owner = owner
-        self._jobs = {}
-
-    def get_running_job_for_artifact(self, artifact_basename):
-        jobs =  [job for job in self.running_jobs()
-                 if job.artifact.basename() == artifact_basename]
-        if len(jobs) > 1:
-            logging.warn('More than one running job for %s',
-                         artifact_basename)
-        if not jobs:
-            return None
-        return jobs[0]
-
-    def get_job_for_id(self, id):
-        return self._jobs.get(id, None)
-
-    def add(self, job):
-        artifact_basename = job.artifact.basename()
-
-        if self.has_job_for_artifact(artifact_basename):
-            logging.info(
-                "Duplicate job for %s added to %s job queue.",
-                artifact_basename, self._owner)
-        self._jobs[job.id] = job
-
-    def remove(self, job):
-        if job.id in self._jobs:
-            del self._jobs[job.id]
-        else:
-            logging.warning("Tried to remove a job that doesn't exist "
-                            "(%s)", job.artifact.basename())
-
-    def has_job_for_artifact(self, artifact_basename):
-        for job in self:
-            if job.artifact.basename() == artifact_basename:
-                return True
-
-    def __iter__(self):
-        return self._jobs.itervalues()
-
-    def remove_jobs(self, jobs):
-        for job in jobs:
-            self.remove(job)
-
-    def get_next_job(self):
-        # for now just return the first thing we find that's not being built
-        waiting = [job for job in self if job.who == None]
-
-        return waiting.pop() if len(waiting) > 0 else None
-
-    def running_jobs(self):
-        return [job for job in self if job.running()]
-
-    def __repr__(self):
-        items = []
-        for job in self._jobs.itervalues():
-            items.append(
-                '%s (%s)' % (job.artifact.basename(), job.describe_state()))
-        return str(items)
-
-
 class _BuildFinished(object):
 
     def __init__(self, job):
@@ -201,17 +109,20 @@ class _BuildFinished(object):
 
 class _BuildFailed(object):
 
-    pass
+    def __init__(self, job):
+        self.job = job
 
 
 class _BuildCancelled(object):
 
-    pass
+    def __init__(self, job):
+        self.job = job
 
         
 class _Cached(object):
 
-    pass
+    def __init__(self, job):
+        self.job = job
 
 
 class _JobStarted(object):
@@ -239,18 +150,23 @@ class WorkerBuildQueuer(distbuild.StateMachine):
     into a queue. It also catches _NeedJob events, from a
     WorkerConnection, and responds to them with _HaveAJob events,
     when it has an outstanding request.
+
+    It records how long each job took in build_times, a BuildTimes
+    shared with the BuildControllers, which use it to work out the
+    priority of the builds they request.
     
     '''
-    
-    def __init__(self):
+
+    def __init__(self, build_times):
         distbuild.StateMachine.__init__(self, 'idle')
+        self.build_times = build_times
 
     def setup(self):
         distbuild.crash_point()
 
         logging.debug('WBQ: Setting up %s' % self)
         self._available_workers = []
-        self._jobs = JobQueue(owner='controller')
+        self._jobs = distbuild.JobQueue(owner='controller')
         self._idgen = distbuild.IdentifierGenerator('Job')
 
         spec = [
@@ -278,6 +194,8 @@ class WorkerBuildQueuer(distbuild.StateMachine):
 
     def _set_job_finished(self, event_source, event):
         job = event.job
+        if job.started is not None:
+            self.build_times.record(job.artifact, time.time() - job.started)
         job.set_state('complete')
         self._jobs.remove(job)
 
@@ -300,7 +218,7 @@ class WorkerBuildQueuer(distbuild.StateMachine):
         job = self._jobs.get_running_job_for_artifact(
             event.artifact.basename())
         if job is not None:
-            job.initiators.append(event.initiator_id)
+            job.add_initiator(event.initiator_id)
 
             # Completed jobs are not tracked, so we can't tell here if the
             # job was already built. It shouldn't happen, because the
@@ -321,7 +239,8 @@ class WorkerBuildQueuer(distbuild.StateMachine):
             self.mainloop.queue_event(WorkerConnection, progress)
         else:
             logging.debug('WBQ: Creating job for: %s' % event.artifact.name)
-            job = Job(self._idgen.next(), event.artifact, event.initiator_id)
+            job = distbuild.Job(self._idgen.next(), event.artifact,
+                                event.initiator_id, event.priority)
             self._jobs.add(job)
 
             if self._available_workers:
@@ -360,12 +279,12 @@ class WorkerBuildQueuer(distbuild.StateMachine):
                               [i for i in job.initiators
                                 if i != event.initiator_id])
 
-                job.initiators.remove(event.initiator_id)
+                job.remove_initiator(event.initiator_id)
 
             return False
 
-        self._jobs.remove_jobs(
-            [job for job in self._jobs if cancel_this(job)])
+        jobs = self._jobs.get_jobs_for_initiator(event.initiator_id)
+        self._jobs.remove_jobs([job for job in jobs if cancel_this(job)])
 
     def _handle_worker(self, event_source, event):
         distbuild.crash_point()
@@ -392,15 +311,14 @@ class WorkerBuildQueuer(distbuild.StateMachine):
         self.mainloop.queue_event(worker.who, _HaveAJob(job))
 
     def _handle_worker_disconnected(self, event_source, event):
-        self._remove_worker(self, event.who)
+        self._remove_worker(event.who)
 
     def _remove_worker(self, worker):
         logging.debug('WBQ: Removing worker %s from queue', worker.name())
 
-        # There should only be one InitiatorConnection instance per worker in
-        # the _available_workers list. But anything can happen in space! So we
-        # take care to remove all GiveJob messages in the list that came from
-        # the disconnected worker, not the first.
+        # There is one _NeedJob message in the _available_workers list for
+        # each free build slot of a worker, so we take care to remove all
+        # of the ones that came from the disconnected worker, not the first.
         self._available_workers = filter(
             lambda worker_msg: worker_msg.who != worker,
             self._available_workers)
@@ -408,26 +326,48 @@ class WorkerBuildQueuer(distbuild.StateMachine):
 
 class WorkerConnection(distbuild.StateMachine):
 
-    '''Communicate with a single worker.'''
+    '''Communicate with a single worker.
+
+    A worker has one or more build slots. If ask_worker_info is set, we
+    ask it how many when we connect, and which formats for artifacts it
+    understands; otherwise it is assumed to have one slot and to only
+    understand the first format, as workers older than that question do
+    not know how to answer it.
+
+    We ask the WorkerBuildQueuer for a job for each free slot, and a
+    slot is free again once its job has failed, been cancelled or had its
+    artifacts cached. Messages about a job are matched to it by the job
+    id.
+
+    '''
     
     _request_ids = distbuild.IdentifierGenerator('WorkerConnection')
     _initiator_request_map = collections.defaultdict(set)
 
     def __init__(self, cm, conn, writeable_cache_server, 
-                 worker_cache_server_port, morph_instance):
-        distbuild.StateMachine.__init__(self, 'idle')
+                 worker_cache_server_port, morph_instance,
+                 ask_worker_info=False):
+        distbuild.StateMachine.__init__(self, 'connected')
         self._cm = cm
         self._conn = conn
         self._writeable_cache_server = writeable_cache_server
         self._worker_cache_server_port = worker_cache_server_port
         self._morph_instance = morph_instance
+        self._ask_worker_info = ask_worker_info
         self._debug_exec_output = False
 
         addr, port = self._conn.getpeername()
         name = socket.getfqdn(addr)
         self._worker_name = '%s:%s' % (name, port)
 
-        self._jobs = JobQueue(owner=self.name())
+        self._jobs = distbuild.JobQueue(owner=self.name())
+
+        # Until the worker says otherwise, assume it has one build slot,
+        # and only understands the first format for artifacts.
+        self._build_slots = 1
+        self._artifact_format = 1
+        # Jobs that are using a build slot, by job id
+        self._slot_jobs = {}
 
     def name(self):
         return self._worker_name
@@ -445,30 +385,32 @@ class WorkerConnection(distbuild.StateMachine):
         
         spec = [
             # state, source, event_class, new_state, callback
-            ('idle', self._jm, distbuild.JsonEof, None,  self._disconnected),
-            ('idle', self, _HaveAJob, 'building', self._start_build),
-            
-            ('building', distbuild.BuildController,
-                distbuild.BuildCancel, 'building',
-                self._maybe_cancel),
-
-            ('building', self._jm, distbuild.JsonEof, None,
+            ('connected', self._jm, distbuild.JsonEof, None,
                 self._disconnected),
-            ('building', self._jm, distbuild.JsonNewMessage, 'building',
+            ('connected', self._jm, distbuild.JsonNewMessage, 'connected',
                 self._handle_json_message),
-            ('building', self, _BuildFailed, 'idle', self._request_job),
-            ('building', self, _BuildCancelled, 'idle', self._request_job),
-            ('building', self, _BuildFinished, 'caching',
+            ('connected', self, _HaveAJob, 'connected', self._start_build),
+            ('connected', distbuild.BuildController,
+                distbuild.BuildCancel, 'connected',
+                self._maybe_cancel),
+            ('connected', self, _BuildFailed, 'connected', self._free_slot),
+            ('connected', self, _BuildCancelled, 'connected',
+                self._free_slot),
+            ('connected', self, _BuildFinished, 'connected',
                 self._request_caching),
-
-            ('caching', self._jm, distbuild.JsonEof, None, self._disconnected),
-            ('caching', distbuild.HelperRouter, distbuild.HelperResult,
-                'caching', self._maybe_handle_helper_result),
-            ('caching', self, _Cached, 'idle', self._request_job),
-            ('caching', self, _BuildFailed, 'idle', self._request_job),
+            ('connected', distbuild.HelperRouter, distbuild.HelperResult,
+                'connected', self._maybe_handle_helper_result),
+            ('connected', self, _Cached, 'connected', self._free_slot),
         ]
         self.add_transitions(spec)
-        
+
+        # Workers older than the worker-info-request message drop the
+        # connection when they get one, so only ask if told to.
+        if self._ask_worker_info:
+            msg = distbuild.message('worker-info-request',
+                                    id=self._request_ids.next())
+            self._jm.send(msg)
+
         self._request_job(None, None)
 
     def _maybe_cancel(self, event_source, build_cancel):
@@ -494,7 +436,7 @@ class WorkerConnection(distbuild.StateMachine):
                     'WC: Not cancelling running job %s, other initiators want '
                     'it done: %s', job.artifact.basename(),
                     [i for i in job.initiators if i != initiator_id])
-                job.initiators.remove(initiator_id)
+                job.remove_initiator(initiator_id)
 
     def _cancel_job(self, job):
         logging.debug(
@@ -511,7 +453,8 @@ class WorkerConnection(distbuild.StateMachine):
         # The new build will then fail when the exec-response for the old
         # build finally arrives.
         job.set_state('failed')
-        self.mainloop.queue_event(self, _BuildCancelled())
+        self.mainloop.queue_event(WorkerConnection, _JobFailed(job))
+        self.mainloop.queue_event(self, _BuildCancelled(job))
 
     def _disconnected(self, event_source, event):
         distbuild.crash_point()
@@ -529,10 +472,9 @@ class WorkerConnection(distbuild.StateMachine):
             logging.warn('Worker %s already has job %s', self.name(),
                          job.id)
 
-        running_jobs = self._jobs.running_jobs()
-        if len(running_jobs) != 0:
-            logging.warn('This worker already has running jobs: %s',
-                         running_jobs)
+        if len(self._slot_jobs) >= self._build_slots:
+            logging.warn('This worker has no free build slots, it is '
+                         'running: %s', self._slot_jobs.values())
 
     def _start_build(self, event_source, event):
         distbuild.crash_point()
@@ -541,6 +483,7 @@ class WorkerConnection(distbuild.StateMachine):
         self._sanity_check_new_job(job)
 
         self._jobs.add(job)
+        self._slot_jobs[job.id] = job
         job.set_state('running')
 
         logging.debug('WC: starting build: %s for %s' %
@@ -556,7 +499,9 @@ class WorkerConnection(distbuild.StateMachine):
         msg = distbuild.message('exec-request',
             id=job.id,
             argv=argv,
-            stdin_contents=distbuild.encode_artifact_reference(job.artifact),
+            stdin_contents=distbuild.encode_artifact_reference(
+                job.artifact, self._artifact_format),
+            compress_output=True,
         )
         self._jm.send(msg)
 
@@ -576,12 +521,20 @@ class WorkerConnection(distbuild.StateMachine):
         logging.debug(
             'WC: from worker %s: %r' % (self._worker_name, event.msg))
 
+        if event.msg['type'] == 'worker-info':
+            self._handle_worker_info(event.msg)
+            return
+
         handlers = {
             'exec-output': self._handle_exec_output,
             'exec-response': self._handle_exec_response,
         }
 
-        handler = handlers[event.msg['type']]
+        handler = handlers.get(event.msg['type'])
+        if handler is None:
+            logging.warning('WC: ignoring unknown message type %s from '
+                            'worker %s', event.msg['type'], self.name())
+            return
         job = self._jobs.get_job_for_id(event.msg['id'])
 
         if job:
@@ -590,10 +543,28 @@ class WorkerConnection(distbuild.StateMachine):
             logging.warn('Received %s for unknown job %s',
                          event.msg['type'], event.msg['id'])
 
+    def _handle_worker_info(self, msg):
+        '''Ask for a job for each extra build slot the worker has.
+
+        Workers that understand newer formats for artifacts say so, and
+        are sent artifacts in the newest format both ends understand.
+
+        '''
+
+        logging.debug('WC: worker %s has %d build slots',
+                      self.name(), msg['build_slots'])
+        self._artifact_format = min(
+            msg.get('artifact_format', 1),
+            distbuild.artifact_reference.FORMAT_VERSION)
+        extra_slots = msg['build_slots'] - self._build_slots
+        self._build_slots = msg['build_slots']
+        for i in range(extra_slots):
+            self._request_job(None, None)
+
     def _handle_exec_output(self, msg, job):
         '''Handle output from a job that the worker is or was running.'''
 
-        new = dict(msg)
+        new = dict(distbuild.decode_exec_output(msg))
         new['ids'] = job.initiators
 
         if self._debug_exec_output:
@@ -605,6 +576,13 @@ class WorkerConnection(distbuild.StateMachine):
     def _handle_exec_response(self, msg, job):
         '''Handle completion of a job that the worker is or was running.'''
 
+        if job.id not in self._slot_jobs:
+            # The job was cancelled, and its slot has been given to
+            # another job already.
+            logging.debug('WC: ignoring exec-response for cancelled job %s',
+                          job.id)
+            return
+
         logging.debug('WC: finished building: %s' % job.artifact.name)
         logging.debug('initiators that need to know: %s' % job.initiators)
 
@@ -616,7 +594,7 @@ class WorkerConnection(distbuild.StateMachine):
             new_event = WorkerBuildFailed(new, job.artifact.cache_key)
             self.mainloop.queue_event(WorkerConnection, new_event)
             self.mainloop.queue_event(WorkerConnection, _JobFailed(job))
-            self.mainloop.queue_event(self, _BuildFailed())
+            self.mainloop.queue_event(self, _BuildFailed(job))
         else:
             # Build succeeded. We have more work to do: caching the result.
             self.mainloop.queue_event(self, _BuildFinished(job))
@@ -626,6 +604,14 @@ class WorkerConnection(distbuild.StateMachine):
         distbuild.crash_point()
         self.mainloop.queue_event(WorkerConnection, _NeedJob(self))
 
+    def _free_slot(self, event_source, event):
+        '''Ask for another job, if event's job was using a build slot.'''
+
+        job = event.job
+        if self._slot_jobs.pop(job.id, None) is not None:
+            self._jobs.remove(job)
+            self._request_job(event_source, event)
+
     def _request_caching(self, event_source, event):
         # This code should be moved into the morphlib.remoteartifactcache
         # module. It would be good to share it with morphlib.buildcommand,
@@ -692,7 +678,7 @@ class WorkerConnection(distbuild.StateMachine):
                 job._exec_response, job.artifact.cache_key, job.who.name())
             self.mainloop.queue_event(WorkerConnection, finished_event)
 
-            self.mainloop.queue_event(self, _Cached())
+            self.mainloop.queue_event(self, _Cached(job))
         else:
             logging.error(
                 'Failed to populate artifact cache: %s %s' %
@@ -710,7 +696,7 @@ class WorkerConnection(distbuild.StateMachine):
                 job._exec_response, job.artifact.cache_key)
             self.mainloop.queue_event(WorkerConnection, failed_event)
 
-            self.mainloop.queue_event(self, _BuildFailed())
+            self.mainloop.queue_event(self, _BuildFailed(job))
 
         # Caching is the last step of a job, so we're now done with it.
         self.mainloop.queue_event(WorkerConnection, _JobFinished(job))
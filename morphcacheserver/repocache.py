@@ -1,4 +1,4 @@
-# Copyright (C) 2013,2014-2015 Codethink Limited
+# Copyright (C) 2013,2014-2015,2026 Codethink Limited
 # 
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -17,8 +17,11 @@ import cliapp
 import os
 import re
 import string
+import threading
 import urlparse
 
+import morphlib
+
 
 class RepositoryNotFoundError(cliapp.AppException):
 
@@ -50,6 +53,8 @@ class RepoCache(object):
         self.repo_cache_dir = repo_cache_dir
         self.bundle_cache_dir = bundle_cache_dir
         self.direct_mode = direct_mode
+        self._cat_files = {}
+        self._cat_files_lock = threading.Lock()
 
     def resolve_ref(self, repo_url, ref):
         quoted_url = self._quote_url(repo_url)
@@ -71,11 +76,20 @@ class RepoCache(object):
         except cliapp.AppException:
             raise
 
+    def _cat_file_for(self, repo_dir):
+        '''Return the shared object reader for a cached repository.'''
+
+        with self._cat_files_lock:
+            if repo_dir not in self._cat_files:
+                self._cat_files[repo_dir] = morphlib.gitcatfile.CatFile(
+                    repo_dir)
+            return self._cat_files[repo_dir]
+
     def _tree_from_commit(self, repo_dir, commitsha):
-        commit_info = self.app.runcmd(['git', 'log', '-1',
-                                       '--format=format:%T', commitsha],
-                                      cwd=repo_dir)
-        return commit_info.strip()
+        info = self._cat_file_for(repo_dir).info('%s^{tree}' % commitsha)
+        if info is None:
+            raise InvalidReferenceError(repo_dir, commitsha)
+        return info[0]
 
     def cat_file(self, repo_url, ref, filename):
         quoted_url = self._quote_url(repo_url)
@@ -141,16 +155,30 @@ class RepoCache(object):
             return ''.join([transl(x) for x in url])
 
     def _rev_parse(self, repo_dir, ref):
-        return self.app.runcmd(['git', 'rev-parse', '--verify', ref],
-                               cwd=repo_dir)[0:40]
+        info = self._cat_file_for(repo_dir).info(ref)
+        if info is None:
+            raise InvalidReferenceError(repo_dir, ref)
+        return info[0]
 
     def _cat_file(self, repo_dir, sha1, filename):
-        return self.app.runcmd(
-                ['git', 'cat-file', 'blob', '%s:%s' % (sha1, filename)],
-                cwd=repo_dir)
+        blob = self._cat_file_for(repo_dir).read('%s:%s' % (sha1, filename))
+        if blob is None or blob[1] != 'blob':
+            raise cliapp.AppException(
+                'File %s does not exist in ref %s of repo %s' %
+                (filename, sha1, repo_dir))
+        return blob[2]
 
     def _ls_tree(self, repo_dir, sha1, path):
-        return self.app.runcmd(['git', 'ls-tree', sha1, path], cwd=repo_dir)
+        entry = None
+        if path and not path.startswith('/') and not path.endswith('/'):
+            entry = self._cat_file_for(repo_dir).tree_entry(sha1, path)
+        if entry is None:
+            # Let git work out what an unusual path means.
+            return self.app.runcmd(['git', 'ls-tree', sha1, path],
+                                   cwd=repo_dir)
+        mode, name, object_sha1 = entry
+        kind = {'040000': 'tree', '160000': 'commit'}.get(mode, 'blob')
+        return '%s %s %s\t%s\n' % (mode, kind, object_sha1, path)
 
     def _is_valid_sha1(self, ref):
         valid_chars = 'abcdefABCDEF0123456789'
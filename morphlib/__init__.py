@@ -1,4 +1,4 @@
-# Copyright (C) 2011-2015  Codethink Limited
+# Copyright (C) 2011-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -47,14 +47,17 @@ class Error(cliapp.AppException):
 
 
 import artifact
+import artifactcacheindex
 import artifactcachereference
 import artifactresolver
 import artifactsplitrule
+import artifactstream
 import branchmanager
 import bins
 import buildbranch
 import buildcommand
 import buildenvironment
+import buildscheduler
 import buildsystem
 import builder
 import cachedrepo
@@ -63,15 +66,18 @@ import cmdline_parse_utils
 import defaults
 import definitions_repo
 import definitions_version
+import dircache
 import extensions
 import extractedtarball
 import fsutils
 import git
+import gitcatfile
 import gitdir
 import gitindex
 import localartifactcache
 import localrepocache
 import mountableimage
+import morphologycache
 import morphologyfinder
 import morphology
 import morphloader
@@ -82,9 +88,12 @@ import repoaliasresolver
 import savefile
 import source
 import sourcepool
+import sourcepoolcache
 import sourceresolver
 import stagingarea
+import stagingbasecache
 import stopwatch
+import treecache
 import util
 
 import yamlparse
@@ -1,4 +1,4 @@
-# Copyright (C) 2011-2015  Codethink Limited
+# Copyright (C) 2011-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -18,6 +18,7 @@ import logging
 import os
 import pipes
 import sys
+import threading
 import time
 import urlparse
 import warnings
@@ -56,6 +57,18 @@ defaults = {
 
 class Morph(cliapp.Application):
 
+    # The status prefix is kept per thread, so that components which are
+    # built at the same time each label their own status messages.
+    _thread_state = threading.local()
+
+    @property
+    def status_prefix(self):
+        return getattr(self._thread_state, 'status_prefix', '')
+
+    @status_prefix.setter
+    def status_prefix(self, prefix):
+        self._thread_state.status_prefix = prefix
+
     def add_settings(self):
         self.settings.boolean(['verbose', 'v'],
                               'write build log on stdout')
@@ -88,6 +101,20 @@ class Morph(cliapp.Application):
                               'do not update the cached git repositories '
                               'automatically',
                               group=group_advanced)
+        self.settings.integer(['concurrent-git-updates'],
+                              'update or clone up to N cached git '
+                              'repositories at the same time while working '
+                              'out what to build (default: %default)',
+                              metavar='N',
+                              default=4,
+                              group=group_advanced)
+        self.settings.integer(['concurrent-artifact-downloads'],
+                              'fetch up to N artifacts from the artifact '
+                              'cache server at the same time '
+                              '(default: %default)',
+                              metavar='N',
+                              default=4,
+                              group=group_advanced)
         self.settings.boolean(['build-log-on-stdout'],
                               'internal option for use by distbuild to'
                               'transfer logs from the worker to the'
@@ -139,6 +166,13 @@ class Morph(cliapp.Application):
                               metavar='N',
                               default=defaults['max-jobs'],
                               group=group_build)
+        self.settings.integer(['concurrent-builds'],
+                              'build up to N independent components at '
+                              'the same time, sharing out max-jobs between '
+                              'them (default: %default)',
+                              metavar='N',
+                              default=1,
+                              group=group_build)
         self.settings.boolean(['no-ccache'], 'do not use ccache',
                               group=group_build)
         self.settings.boolean(['no-distcc'],
@@ -160,6 +194,24 @@ class Morph(cliapp.Application):
                               'those changes. Disable this behaviour with the '
                               '`ignore` setting.',
                               group=group_build)
+        self.settings.choice(['staging-area-mode'],
+                             ['hardlink', 'reflink', 'overlayfs'],
+                             'how to install build dependencies into '
+                             'staging areas: hardlink every file, make '
+                             'copy-on-write clones of every file (falling '
+                             'back to hardlinks), or stack them as overlayfs '
+                             'layers (falling back to clones)',
+                             group=group_build)
+        self.settings.choice(['chunk-source-mode'],
+                             ['clone', 'export'],
+                             'how to get the sources of a chunk into its '
+                             'build directory: clone the whole repository, '
+                             'or export just the files of the commit being '
+                             'built, which is much faster for big '
+                             'repositories but breaks builds that need git '
+                             'history, such as ones running `git describe`; '
+                             'exported chunks get different cache keys',
+                             group=group_build)
 
         group_storage = 'Storage Options'
         self.settings.string(['tempdir'],
@@ -211,6 +263,39 @@ class Morph(cliapp.Application):
                                metavar='SIZE',
                                group=group_storage,
                                default='4G')
+        self.settings.bytesize(['chunk-cache-size'],
+                               'keep up to SIZE bytes of unpacked chunks in '
+                               'tempdir, removing the least recently used '
+                               'ones first; 0 means no limit '
+                               '(default: %default)',
+                               metavar='SIZE',
+                               group=group_storage,
+                               default='0')
+        self.settings.bytesize(['artifact-cache-size'],
+                               'keep up to SIZE bytes of artifacts in '
+                               'cachedir, removing big ones that have not '
+                               'been used for a long time first, both '
+                               'during builds and in `morph gc`; 0 means '
+                               'no limit (default: %default)',
+                               metavar='SIZE',
+                               group=group_storage,
+                               default='0')
+        self.settings.string_list(['artifact-cache-keep'],
+                                  'never remove the artifacts of cache key '
+                                  'KEY from cachedir, or anything it was '
+                                  'built from',
+                                  metavar='KEY',
+                                  group=group_storage,
+                                  default=[])
+        self.settings.bytesize(['staging-base-cache-size'],
+                               'keep up to SIZE bytes of prepared staging '
+                               'areas in tempdir, to reuse for chunks that '
+                               'have the same build dependencies, counting '
+                               'files they share with unpacked chunks in '
+                               'full; 0 disables this (default: %default)',
+                               metavar='SIZE',
+                               group=group_storage,
+                               default='0')
 
     def check_time(self):
         # Check that the current time is not far in the past.
@@ -0,0 +1,234 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+def is_cache_file(basename):
+    '''Is this the name of a file that belongs to a cache key?
+
+    Cache files are named CACHEKEY.SOMETHING. This is just enough to
+    leave out temporary files, and the index itself.
+
+    '''
+
+    return '.' in basename and not basename.startswith(('.', 'tmp'))
+
+
+def cache_key_of(basename):
+    return basename.split('.', 1)[0]
+
+
+class ArtifactCacheIndex(object):
+
+    '''An SQLite index of the files in a local artifact cache directory.
+
+    It records which cache key each file belongs to, with its size, when
+    it was added and when it was last used, so that listing the cache
+    and removing a cache key's files do not need to look at every file
+    in the directory. Any number of processes can use the same index at
+    once. If the index file is missing, it is made again from the files
+    in the directory.
+
+    Each file's last-used time is written the first time it is used,
+    rather than every time.
+
+    It also records which cache keys each cache key's artifacts were
+    built from, so that everything a system needs can be found from the
+    system's cache key. These are only known for things that were built
+    or fetched by a build, and are lost if the index is made again.
+
+    '''
+
+    def __init__(self, filename, dirname):
+        self.filename = filename
+        self.dirname = dirname
+        if not os.path.exists(filename):
+            self._rebuild()
+        self._db = sqlite3.connect(filename, timeout=60,
+                                   check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS dependencies ('
+                'cachekey TEXT NOT NULL, dependency TEXT NOT NULL, '
+                'PRIMARY KEY (cachekey, dependency))')
+        # The cache keys to start from in reachable(). There can be more
+        # of them than SQLite lets a statement have parameters.
+        self._db.execute('CREATE TEMP TABLE roots (cachekey TEXT NOT NULL)')
+        self._lock = threading.Lock()
+        self._used = set()
+
+    def _rebuild(self):
+        '''Make the index from the files in the directory.
+
+        The index is made under a temporary name and renamed into place,
+        so that nobody sees half of it.
+
+        '''
+
+        logging.info('Making artifact cache index %s', self.filename)
+        fd, tempname = tempfile.mkstemp(
+            dir=os.path.dirname(self.filename), prefix='.tmp')
+        os.close(fd)
+        try:
+            db = sqlite3.connect(tempname)
+            with db:
+                db.execute(
+                    'CREATE TABLE files ('
+                    'filename TEXT NOT NULL PRIMARY KEY, '
+                    'cachekey TEXT NOT NULL, size INTEGER NOT NULL, '
+                    'created INTEGER NOT NULL, last_used INTEGER NOT NULL)')
+                db.execute('CREATE INDEX files_cachekey ON files (cachekey)')
+                db.executemany(
+                    'INSERT INTO files VALUES (?, ?, ?, ?, ?)',
+                    self._scan())
+            db.close()
+            os.rename(tempname, self.filename)
+        except BaseException:
+            os.remove(tempname)
+            raise
+
+    def _scan(self):
+        for basename in os.listdir(self.dirname):
+            if not is_cache_file(basename):
+                continue
+            try:
+                st = os.stat(os.path.join(self.dirname, basename))
+            except OSError:  # pragma: no cover
+                continue
+            yield (basename.decode('utf-8'), cache_key_of(basename),
+                   st.st_size, int(st.st_mtime), int(st.st_mtime))
+
+    def add(self, basename):
+        '''Record that a file has been put in the cache.'''
+
+        st = os.stat(os.path.join(self.dirname, basename))
+        now = int(time.time())
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                (basename.decode('utf-8'), cache_key_of(basename),
+                 st.st_size, now, now))
+            self._used.add(basename)
+
+    def use(self, basename):
+        '''Record that a file in the cache has been used.
+
+        A file that is not in the index, because it was put there by
+        something that does not know about the index, is added.
+
+        '''
+
+        if basename in self._used:
+            return
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                'UPDATE files SET last_used = ? WHERE filename = ?',
+                (int(time.time()), basename.decode('utf-8')))
+            self._used.add(basename)
+        if cursor.rowcount == 0:
+            self.add(basename)
+
+    def used_cache_keys(self):
+        '''Return the cache keys of the files this process has used.'''
+
+        with self._lock:
+            return set(cache_key_of(basename) for basename in self._used)
+
+    def contents(self):
+        '''Return [(cachekey, filename, size, last_used)] for every file.'''
+
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT cachekey, filename, size, last_used '
+                'FROM files').fetchall()
+        return [(cachekey.encode('utf-8'), filename.encode('utf-8'), size,
+                 last_used)
+                for cachekey, filename, size, last_used in rows]
+
+    def cache_keys(self):
+        '''Return [(cachekey, size, last_used)] for every cache key.
+
+        The size is the total of its files' sizes, and the last-used time
+        that of the file that was used most recently.
+
+        '''
+
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT cachekey, SUM(size), MAX(last_used) '
+                'FROM files GROUP BY cachekey').fetchall()
+        return [(cachekey.encode('utf-8'), size, last_used)
+                for cachekey, size, last_used in rows]
+
+    def add_dependencies(self, dependencies):
+        '''Record that cache keys were built from others.
+
+        dependencies is an iterable of (cachekey, dependency) pairs.
+
+        '''
+
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR IGNORE INTO dependencies VALUES (?, ?)',
+                dependencies)
+
+    def reachable(self, cachekeys):
+        '''Return the cache keys, and everything they were built from.'''
+
+        with self._lock, self._db:
+            self._db.executemany('INSERT INTO roots VALUES (?)',
+                                 ((cachekey,) for cachekey in cachekeys))
+            rows = self._db.execute(
+                'WITH RECURSIVE reachable(cachekey) AS ('
+                'SELECT cachekey FROM roots UNION '
+                'SELECT dependency FROM dependencies '
+                'JOIN reachable USING (cachekey)) '
+                'SELECT cachekey FROM reachable').fetchall()
+            self._db.execute('DELETE FROM roots')
+        return set(row[0].encode('utf-8') for row in rows)
+
+    def remove(self, cachekey):
+        '''Forget the files of a cache key, and return their names.'''
+
+        with self._lock, self._db:
+            rows = self._db.execute(
+                'SELECT filename FROM files WHERE cachekey = ?',
+                (cachekey,)).fetchall()
+            self._db.execute(
+                'DELETE FROM files WHERE cachekey = ?', (cachekey,))
+            self._db.execute(
+                'DELETE FROM dependencies WHERE cachekey = ?', (cachekey,))
+            filenames = [row[0].encode('utf-8') for row in rows]
+            self._used.difference_update(filenames)
+        return filenames
+
+    def clear(self):
+        '''Forget every file.'''
+
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM files')
+            self._db.execute('DELETE FROM dependencies')
+            self._used.clear()
+
+    def close(self):
+        self._db.close()
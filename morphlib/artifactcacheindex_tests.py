@@ -0,0 +1,176 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import morphlib
+
+
+class ArtifactCacheIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, '.index.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def make_file(self, basename, size=10, mtime=None):
+        path = os.path.join(self.tempdir, basename)
+        with open(path, 'w') as f:
+            f.write('x' * size)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def open_index(self):
+        return morphlib.artifactcacheindex.ArtifactCacheIndex(
+            self.filename, self.tempdir)
+
+    def test_makes_index_from_files_if_it_is_missing(self):
+        self.make_file('key1.chunk.foo', size=5, mtime=1000)
+        self.make_file('key1.chunk.foo.meta', size=2, mtime=2000)
+        self.make_file('key2.build-log', size=3, mtime=3000)
+        self.make_file('tmpABCDEF.x')
+        self.make_file('no-dot')
+        index = self.open_index()
+        self.assertEqual(sorted(index.contents()),
+                         [('key1', 'key1.chunk.foo', 5, 1000),
+                          ('key1', 'key1.chunk.foo.meta', 2, 2000),
+                          ('key2', 'key2.build-log', 3, 3000)])
+        self.assertEqual(
+            [f for f in os.listdir(self.tempdir) if f.startswith('.tmp')],
+            [])
+
+    def test_keeps_index_that_exists(self):
+        self.open_index().close()
+        self.make_file('key.chunk.foo')
+        self.assertEqual(self.open_index().contents(), [])
+
+    def test_leaves_no_temporary_file_if_making_index_fails(self):
+        self.assertRaises(
+            OSError, morphlib.artifactcacheindex.ArtifactCacheIndex,
+            self.filename, os.path.join(self.tempdir, 'missing'))
+        self.assertEqual(os.listdir(self.tempdir), [])
+
+    def test_adds_files(self):
+        index = self.open_index()
+        self.make_file('key.chunk.foo', size=7)
+        index.add('key.chunk.foo')
+        [(cachekey, filename, size, last_used)] = index.contents()
+        self.assertEqual((cachekey, filename, size),
+                         ('key', 'key.chunk.foo', 7))
+        self.assertTrue(last_used >= time.time() - 60)
+
+    def test_records_when_files_are_used(self):
+        self.make_file('key.chunk.foo', mtime=1000)
+        index = self.open_index()
+        index.use('key.chunk.foo')
+        [(cachekey, filename, size, last_used)] = index.contents()
+        self.assertTrue(last_used >= time.time() - 60)
+
+    def test_writes_last_used_time_once(self):
+        self.make_file('key.chunk.foo', mtime=1000)
+        index = self.open_index()
+        index.use('key.chunk.foo')
+        index._db.execute('UPDATE files SET last_used = 0')
+        index.use('key.chunk.foo')
+        self.assertEqual(index.contents()[0][3], 0)
+
+    def test_adds_files_it_did_not_know_about_when_they_are_used(self):
+        index = self.open_index()
+        self.make_file('key.chunk.foo')
+        index.use('key.chunk.foo')
+        self.assertEqual([row[1] for row in index.contents()],
+                         ['key.chunk.foo'])
+
+    def test_removes_files_of_cache_key(self):
+        for basename in ('key1.chunk.foo', 'key1.chunk.bar', 'key2.x'):
+            self.make_file(basename)
+        index = self.open_index()
+        index.use('key1.chunk.foo')
+        self.assertEqual(sorted(index.remove('key1')),
+                         ['key1.chunk.bar', 'key1.chunk.foo'])
+        self.assertEqual([row[1] for row in index.contents()], ['key2.x'])
+        self.assertEqual(index.remove('key1'), [])
+
+    def test_clears_index(self):
+        self.make_file('key.chunk.foo')
+        index = self.open_index()
+        index.clear()
+        self.assertEqual(index.contents(), [])
+
+    def test_changes_are_seen_by_other_users(self):
+        index = self.open_index()
+        other = self.open_index()
+        self.make_file('key.chunk.foo')
+        index.add('key.chunk.foo')
+        self.assertEqual(len(other.contents()), 1)
+        other.remove('key')
+        self.assertEqual(index.contents(), [])
+
+    def test_totals_cache_keys(self):
+        self.make_file('key1.chunk.foo', size=5, mtime=1000)
+        self.make_file('key1.chunk.foo.meta', size=2, mtime=2000)
+        self.make_file('key2.build-log', size=3, mtime=3000)
+        index = self.open_index()
+        self.assertEqual(sorted(index.cache_keys()),
+                         [('key1', 7, 2000), ('key2', 3, 3000)])
+
+    def test_knows_which_cache_keys_were_used(self):
+        for basename in ('key1.chunk.foo', 'key2.chunk.bar', 'key3.x'):
+            self.make_file(basename)
+        index = self.open_index()
+        index.use('key1.chunk.foo')
+        index.add('key2.chunk.bar')
+        self.assertEqual(index.used_cache_keys(), set(['key1', 'key2']))
+        index.remove('key1')
+        self.assertEqual(index.used_cache_keys(), set(['key2']))
+
+    def test_finds_everything_cache_keys_were_built_from(self):
+        index = self.open_index()
+        index.add_dependencies([('system', 'stratum1'),
+                                ('system', 'stratum2'),
+                                ('stratum1', 'chunk1'),
+                                ('stratum2', 'chunk1'),
+                                ('stratum2', 'chunk2'),
+                                ('other', 'chunk3')])
+        index.add_dependencies([('system', 'stratum1')])
+        self.assertEqual(index.reachable(['system']),
+                         set(['system', 'stratum1', 'stratum2',
+                              'chunk1', 'chunk2']))
+        self.assertEqual(index.reachable(['stratum1', 'other']),
+                         set(['stratum1', 'chunk1', 'other', 'chunk3']))
+        self.assertEqual(index.reachable(['unknown']), set(['unknown']))
+        self.assertEqual(index.reachable([]), set())
+
+    def test_finds_what_many_cache_keys_were_built_from(self):
+        index = self.open_index()
+        keys = ['key%d' % i for i in range(40000)]
+        index.add_dependencies((key, 'chunk') for key in keys)
+        self.assertEqual(index.reachable(keys), set(keys + ['chunk']))
+        self.assertEqual(index.reachable(['chunk']), set(['chunk']))
+
+    def test_forgets_dependencies_of_removed_cache_keys(self):
+        index = self.open_index()
+        index.add_dependencies([('system', 'stratum'), ('stratum', 'chunk')])
+        index.remove('stratum')
+        self.assertEqual(index.reachable(['system']),
+                         set(['system', 'stratum']))
+        index.clear()
+        self.assertEqual(index.reachable(['system']), set(['system']))
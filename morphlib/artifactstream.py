@@ -0,0 +1,177 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Send many files from an artifact cache in one stream.
+
+morph-cache-server answers a POST of a JSON list of filenames to
+/1.0/artifact-stream with a stream of those files, made by write_stream,
+so that fetching a whole system's artifacts is a single request. Each
+file in the stream is one of:
+
+    file SIZE FILENAME\\n
+    SIZE bytes of data
+    SHA1\\n
+
+where SHA1 is the hex SHA-1 of the data, or, if the cache does not have
+the file:
+
+    missing FILENAME\\n
+
+and the stream ends with "end\\n", so that a stream that was cut short
+can be told from a finished one.
+
+'''
+
+
+import hashlib
+import os
+
+import morphlib
+
+
+BLOCK_SIZE = 1024 * 1024
+
+
+class StreamError(morphlib.Error):
+
+    def __init__(self, msg):
+        self.msg = 'Broken artifact stream: %s' % msg
+
+
+def is_plain_filename(filename):
+    '''Is this the name of a file in the cache directory itself?
+
+    Names that could lead out of the directory, or that would break the
+    lines of the stream, are not, and neither is anything but a string.
+
+    '''
+
+    return (isinstance(filename, basestring) and
+            filename not in ('', '.', '..') and
+            os.path.basename(filename) == filename and
+            '\n' not in filename)
+
+
+def write_stream(filenames, open_file, block_size=BLOCK_SIZE):
+    '''Yield the parts of a stream of files.
+
+    open_file(filename) must return the file opened for reading, or raise
+    IOError or OSError if there is no such file. Filenames decoded from
+    JSON are unicode, and are sent encoded as UTF-8. Every filename must
+    be a plain filename, or StreamError is raised before anything is
+    sent; callers should check them first with is_plain_filename.
+
+    '''
+
+    filenames = [filename.encode('utf-8') if isinstance(filename, unicode)
+                 else filename
+                 for filename in filenames]
+    for filename in filenames:
+        if not is_plain_filename(filename):
+            raise StreamError('bad filename %r' % filename)
+
+    for filename in filenames:
+        try:
+            f = open_file(filename)
+        except (IOError, OSError):
+            yield 'missing %s\n' % filename
+            continue
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            yield 'file %d %s\n' % (size, filename)
+            sha1 = hashlib.sha1()
+            left = size
+            while left > 0:
+                data = f.read(min(left, block_size))
+                if not data:
+                    # The file shrank while it was being sent. Fill up
+                    # the space, which the checksum will not match.
+                    data = '\0' * min(left, block_size)
+                else:
+                    sha1.update(data)
+                left -= len(data)
+                yield data
+            yield '%s\n' % sha1.hexdigest()
+    yield 'end\n'
+
+
+class _Buffer(object):
+
+    '''Read lines and exact amounts of data from a file-like object.'''
+
+    def __init__(self, f, block_size):
+        self._f = f
+        self._block_size = block_size
+        self._data = ''
+
+    def _fill(self):
+        data = self._f.read(self._block_size)
+        if not data:
+            raise StreamError('stream ended too soon')
+        self._data += data
+
+    def readline(self):
+        while '\n' not in self._data:
+            if len(self._data) > 4096:
+                raise StreamError('line is too long')
+            self._fill()
+        line, self._data = self._data.split('\n', 1)
+        return line
+
+    def read_upto(self, size):
+        '''Return up to size bytes, but at least one.'''
+
+        if not self._data:
+            self._fill()
+        data, self._data = self._data[:size], self._data[size:]
+        return data
+
+
+def read_stream(f, start, block_size=BLOCK_SIZE):
+    '''Unpack a stream of files made by write_stream.
+
+    For each file in the stream, start(filename) is called, and returns
+    an open file to write the data to. Yields (filename, ok) for each
+    file once it has been written, where ok is false if the stream says
+    the file is missing, in which case start was not called for it, or
+    if its checksum does not match. StreamError is raised if the stream
+    ends too soon or does not make sense.
+
+    '''
+
+    buf = _Buffer(f, block_size)
+    while True:
+        line = buf.readline()
+        if line == 'end':
+            return
+        if line.startswith('missing '):
+            yield line[len('missing '):], False
+            continue
+        if not line.startswith('file '):
+            raise StreamError('unexpected line %r' % line)
+        try:
+            size, filename = line[len('file '):].split(' ', 1)
+            size = int(size)
+        except ValueError:
+            raise StreamError('unexpected line %r' % line)
+
+        target = start(filename)
+        sha1 = hashlib.sha1()
+        while size > 0:
+            data = buf.read_upto(size)
+            sha1.update(data)
+            target.write(data)
+            size -= len(data)
+        yield filename, buf.readline() == sha1.hexdigest()
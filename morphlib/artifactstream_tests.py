@@ -0,0 +1,163 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+import morphlib
+
+
+class ArtifactStreamTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.files = {
+            'empty': '',
+            'small': 'hello\n',
+            'big': ''.join(chr(i % 251) for i in xrange(10000)),
+        }
+        for filename, data in self.files.iteritems():
+            with open(os.path.join(self.tempdir, filename), 'w') as f:
+                f.write(data)
+        self.written = {}
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def open_file(self, filename):
+        return open(os.path.join(self.tempdir, filename), 'rb')
+
+    def start(self, filename):
+        self.written[filename] = StringIO.StringIO()
+        return self.written[filename]
+
+    def stream(self, filenames):
+        return ''.join(morphlib.artifactstream.write_stream(
+            filenames, self.open_file, block_size=1000))
+
+    def unpack(self, stream):
+        return list(morphlib.artifactstream.read_stream(
+            StringIO.StringIO(stream), self.start, block_size=999))
+
+    def test_sends_files(self):
+        filenames = ['big', 'empty', 'small']
+        self.assertEqual(self.unpack(self.stream(filenames)),
+                         [(filename, True) for filename in filenames])
+        for filename in filenames:
+            self.assertEqual(self.written[filename].getvalue(),
+                             self.files[filename])
+
+    def test_sends_files_with_unicode_names(self):
+        self.assertEqual(self.unpack(self.stream([u'big'])), [('big', True)])
+
+    def test_says_which_files_are_missing(self):
+        self.assertEqual(self.unpack(self.stream(['small', 'nonexistent'])),
+                         [('small', True), ('nonexistent', False)])
+        self.assertEqual(self.written.keys(), ['small'])
+
+    def test_sends_files_with_spaces_in_their_names(self):
+        self.files['with space'] = 'x'
+        with open(os.path.join(self.tempdir, 'with space'), 'w') as f:
+            f.write('x')
+        self.assertEqual(self.unpack(self.stream(['with space'])),
+                         [('with space', True)])
+
+    def test_accepts_plain_filenames(self):
+        for filename in ('small', 'key.chunk.foo-runtime', 'with space',
+                         u'caf\xe9', '..foo', 'foo..'):
+            self.assertTrue(
+                morphlib.artifactstream.is_plain_filename(filename))
+
+    def test_rejects_absolute_filenames(self):
+        self.assertFalse(
+            morphlib.artifactstream.is_plain_filename('/etc/shadow'))
+
+    def test_rejects_filenames_that_leave_the_directory(self):
+        for filename in ('..', '../../etc/shadow', 'foo/../../bar',
+                         'subdir/file', '.', ''):
+            self.assertFalse(
+                morphlib.artifactstream.is_plain_filename(filename))
+
+    def test_rejects_filenames_with_newlines(self):
+        self.assertFalse(
+            morphlib.artifactstream.is_plain_filename('small\nfile 1 x'))
+
+    def test_rejects_things_that_are_not_strings(self):
+        for filename in (None, 1, ['file'], {'file': 1}):
+            self.assertFalse(
+                morphlib.artifactstream.is_plain_filename(filename))
+
+    def test_refuses_to_send_bad_filenames(self):
+        opened = []
+
+        def open_file(filename):
+            opened.append(filename)
+            return self.open_file(filename)
+
+        for filename in ('../../etc/shadow', '/etc/shadow', u'..',
+                         'small\nend'):
+            stream = morphlib.artifactstream.write_stream(
+                ['small', filename], open_file)
+            self.assertRaises(morphlib.artifactstream.StreamError,
+                              list, stream)
+        self.assertEqual(opened, [])
+
+    def test_fills_up_file_that_shrinks_while_being_sent(self):
+        stream = ''.join(morphlib.artifactstream.write_stream(
+            ['big'], lambda filename: Shrinking(self.open_file(filename))))
+        self.assertEqual(self.unpack(stream), [('big', False)])
+        self.assertEqual(len(self.written['big'].getvalue()), 10000)
+
+    def test_notices_bad_checksum(self):
+        stream = self.stream(['small']).replace('hello', 'HELLO')
+        self.assertEqual(self.unpack(stream), [('small', False)])
+
+    def test_fails_if_stream_is_cut_short(self):
+        stream = self.stream(['big', 'small'])
+        for length in (0, 5, 3000, len(stream) - 1):
+            self.assertRaises(morphlib.artifactstream.StreamError,
+                              self.unpack, stream[:length])
+
+    def test_fails_on_nonsense(self):
+        for stream in ('nonsense\n', 'file x small\n', 'file 1\n',
+                       'x' * 5000):
+            self.assertRaises(morphlib.artifactstream.StreamError,
+                              self.unpack, stream)
+
+
+class Shrinking(object):
+
+    '''A file that has lost everything after its first 10 bytes.'''
+
+    def __init__(self, f):
+        self._f = f
+        self._left = 10
+
+    def fileno(self):
+        return self._f.fileno()
+
+    def read(self, size):
+        data = self._f.read(min(size, self._left))
+        self._left -= len(data)
+        return data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._f.close()
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-# Copyright (C) 2011-2015  Codethink Limited
+# Copyright (C) 2011-2015,2026  Codethink Limited
 # Copyright © 2015  Richard Ipsum
 #
 # This program is free software; you can redistribute it and/or modify
@@ -20,6 +20,7 @@ import os
 import shutil
 import logging
 import tempfile
+import threading
 import datetime
 
 import morphlib
@@ -49,6 +50,16 @@ class BuildCommand(object):
         self.lac, self.rac = self.new_artifact_caches()
         self.lrc, self.rrc = self.new_repo_caches()
 
+        # Held while updating the repository cache and fetching artifacts,
+        # neither of which are safe to do from several builds at once.
+        self.cache_lock = threading.RLock()
+
+        # Artifacts that the remote cache was found not to have, so there
+        # is no point trying to fetch them.
+        self.remote_missing = set()
+
+        self.staging_base_cache = self.new_staging_base_cache()
+
     def build(self, repo_name, ref, filename, original_ref=None):
         '''Build a given system morphology.'''
 
@@ -76,6 +87,14 @@ class BuildCommand(object):
         '''
         return morphlib.util.new_artifact_caches(self.app.settings)
 
+    def new_staging_base_cache(self):
+        max_size = self.app.settings['staging-base-cache-size']
+        if max_size <= 0:
+            return None
+        return morphlib.stagingbasecache.StagingBaseCache(
+            os.path.join(self.app.settings['tempdir'], 'staging-bases'),
+            max_size)
+
     def new_repo_caches(self):
         return morphlib.util.new_repo_caches(self.app)
 
@@ -99,7 +118,9 @@ class BuildCommand(object):
             cachedir=self.app.settings['cachedir'],
             original_ref=original_ref,
             update_repos=not self.app.settings['no-git-update'],
-            status_cb=self.app.status)
+            status_cb=self.app.status,
+            concurrent_git_updates=self.app.settings[
+                'concurrent-git-updates'])
         return srcpool
 
     def validate_sources(self, srcpool):
@@ -168,29 +189,34 @@ class BuildCommand(object):
                    for spec in src.morphology['chunks']):
             raise morphlib.Error('No non-bootstrap chunks found.')
 
-    def _compute_cache_keys(self, root_artifact):
+    def _compute_cache_keys(self, root_artifact, srcpool=None):
         arch = root_artifact.source.morphology['arch']
         self.app.status(msg='Creating build environment for %(arch)s',
                         arch=arch, chatty=True)
         build_env = self.new_build_env(arch)
 
-        self.app.status(msg='Computing cache keys', chatty=True)
-        ckc = morphlib.cachekeycomputer.CacheKeyComputer(build_env)
-
-        for source in set(a.source for a in root_artifact.walk()):
-            source.cache_key = ckc.compute_key(source)
-            source.cache_id = ckc.get_cache_id(source)
+        ckc = morphlib.cachekeycomputer.CacheKeyComputer(
+            build_env, self.app.settings['chunk-source-mode'])
+        if srcpool is not None and ckc.has_saved_keys(srcpool):
+            self.app.status(msg='Using saved cache keys', chatty=True)
+        else:
+            self.app.status(msg='Computing cache keys', chatty=True)
+            ckc.compute_keys(set(a.source for a in root_artifact.walk()),
+                             srcpool)
 
         root_artifact.build_env = build_env
 
     def resolve_artifacts(self, srcpool):
         '''Resolve the artifacts that will be built for a set of sources'''
 
-        self.app.status(msg='Creating artifact resolver', chatty=True)
-        ar = morphlib.artifactresolver.ArtifactResolver()
+        root_artifacts = srcpool.root_artifacts
+        if root_artifacts is None:
+            self.app.status(msg='Creating artifact resolver', chatty=True)
+            ar = morphlib.artifactresolver.ArtifactResolver()
 
-        self.app.status(msg='Resolving artifacts', chatty=True)
-        root_artifacts = ar.resolve_root_artifacts(srcpool)
+            self.app.status(msg='Resolving artifacts', chatty=True)
+            root_artifacts = ar.resolve_root_artifacts(srcpool)
+            srcpool.root_artifacts = root_artifacts
 
         if len(root_artifacts) > 1:
             # Validate root artifacts to give a more useful error message
@@ -202,7 +228,7 @@ class BuildCommand(object):
         self.app.status(msg='Validating root artifact', chatty=True)
         self._validate_root_artifact(root_artifact)
 
-        self._compute_cache_keys(root_artifact)
+        self._compute_cache_keys(root_artifact, srcpool)
 
         return root_artifact
 
@@ -279,26 +305,94 @@ class BuildCommand(object):
                 yield artifact.source
 
     def build_in_order(self, root_artifact):
-        '''Build everything specified in a build order.'''
+        '''Build everything specified in a build order.
+
+        Sources which do not depend on each other are built at the same
+        time, up to the 'concurrent-builds' setting, each in its own
+        staging area.
+
+        '''
 
         self.app.status(msg='Starting build of %(name)s',
                         name=root_artifact.source.name)
         build_env = root_artifact.build_env
         ordered_sources = list(self.get_ordered_sources(root_artifact.walk()))
         old_prefix = self.app.status_prefix
-        for i, s in enumerate(ordered_sources):
+
+        self.record_dependencies(ordered_sources)
+        evictor = self.new_artifact_evictor(
+            [source.cache_key for source in ordered_sources])
+
+        if self.rac is not None:
+            present = self.query_remote_cache(root_artifact.walk())
+            if present:
+                # Fetch everything at once, rather than each source's
+                # artifacts as the build gets to them.
+                try:
+                    self.cache_artifacts_locally(
+                        [a for a in root_artifact.walk() if a in present])
+                except morphlib.remoteartifactcache.GetError:
+                    # Error is logged by the RemoteArtifactCache object.
+                    pass
+
+        def build_one(source, index, max_jobs):
             self.app.status_prefix = (
                 old_prefix + '[Build %(index)d/%(total)d] [%(name)s] ' % {
-                    'index': (i+1),
+                    'index': index,
                     'total': len(ordered_sources),
-                    'name': s.name,
+                    'name': source.name,
                 })
+            try:
+                self.cache_or_build_source(source, build_env, max_jobs)
+            finally:
+                self.app.status_prefix = old_prefix
+            if evictor is not None:
+                evictor.poke()
+
+        scheduler = morphlib.buildscheduler.BuildScheduler(
+            ordered_sources, self.app.settings['concurrent-builds'],
+            self.app.settings['max-jobs'])
+        try:
+            scheduler.run(build_one)
+        finally:
+            if evictor is not None:
+                evictor.close()
+            if self.rac is not None:
+                self.rac.close()
+
+    def new_artifact_evictor(self, cache_keys):
+        '''Return a BackgroundEvictor that keeps the artifact cache small.
+
+        Nothing that is part of the build, which is cache_keys, or that
+        is pinned with the 'artifact-cache-keep' setting is removed.
+        Returns None if the size of the cache is not limited.
+
+        '''
 
-            self.cache_or_build_source(s, build_env)
+        max_size = self.app.settings['artifact-cache-size']
+        if max_size <= 0:
+            return None
+        keep = set(cache_keys)
+        keep.update(self.app.settings['artifact-cache-keep'])
+        return morphlib.localartifactcache.BackgroundEvictor(
+            self.lac, max_size, keep=keep,
+            keep_younger_than=self.app.settings[
+                'cachedir-artifact-keep-younger-than'])
 
-        self.app.status_prefix = old_prefix
+    def record_dependencies(self, sources):
+        '''Record what the sources are built from in the artifact cache.
 
-    def cache_or_build_source(self, source, build_env):
+        This lets the whole of a system pinned with 'artifact-cache-keep'
+        be kept when the cache is cleaned up.
+
+        '''
+
+        self.lac.index.add_dependencies(
+            (source.cache_key, dependency.source.cache_key)
+            for source in sources
+            for dependency in source.dependencies)
+
+    def cache_or_build_source(self, source, build_env, max_jobs=None):
         '''Make artifacts of the built source available in the local cache.
 
         This can be done by retrieving from a remote artifact cache, or if
@@ -306,15 +400,17 @@ class BuildCommand(object):
 
         '''
         artifacts = source.artifacts.values()
-        if self.rac is not None:
-            try:
-                self.cache_artifacts_locally(artifacts)
-            except morphlib.remoteartifactcache.GetError:
-                # Error is logged by the RemoteArtifactCache object.
-                pass
-
-        if any(not self.lac.has(artifact) for artifact in artifacts):
-            self.build_source(source, build_env)
+        with self.cache_lock:
+            if self.rac is not None:
+                try:
+                    self.cache_artifacts_locally(artifacts)
+                except morphlib.remoteartifactcache.GetError:
+                    # Error is logged by the RemoteArtifactCache object.
+                    pass
+            cached = all(self.lac.has(artifact) for artifact in artifacts)
+
+        if not cached:
+            self.build_source(source, build_env, max_jobs)
 
         for a in artifacts:
             self.app.status(msg='%(kind)s %(name)s is cached at %(cachepath)s',
@@ -322,25 +418,28 @@ class BuildCommand(object):
                             cachepath=self.lac.artifact_filename(a),
                             chatty=(source.morphology['kind'] != "system"))
 
-    def build_source(self, source, build_env):
+    def build_source(self, source, build_env, max_jobs=None):
         '''Build all artifacts for one source.
 
         All the dependencies are assumed to be built and available
         in either the local or remote cache already.
 
+        If ``max_jobs`` is not given, the 'max-jobs' setting is used.
+
         '''
         starttime = datetime.datetime.now()
         self.app.status(msg='Building %(kind)s %(name)s',
                         name=source.name,
                         kind=source.morphology['kind'])
 
-        self.fetch_sources(source)
         # TODO: Make an artifact.walk() that takes multiple root artifacts.
         # as this does a walk for every artifact. This was the status
         # quo before build logic was made to work per-source, but we can
         # now do better.
         deps = self.get_recursive_deps(source.artifacts.values())
-        self.cache_artifacts_locally(deps)
+        with self.cache_lock:
+            self.fetch_sources(source)
+            self.cache_artifacts_locally(deps)
 
         use_chroot = False
         setup_mounts = False
@@ -371,7 +470,7 @@ class BuildCommand(object):
         else:
             staging_area = self.create_staging_area(source, build_env, False)
 
-        self.build_and_cache(staging_area, source, setup_mounts)
+        self.build_and_cache(staging_area, source, setup_mounts, max_jobs)
         self.remove_staging_area(staging_area)
 
         td = datetime.datetime.now() - starttime
@@ -397,75 +496,52 @@ class BuildCommand(object):
         source.repo = self.lrc.get_updated_repo(repo_name, ref=source.sha1)
         self.lrc.ensure_submodules(source.repo, source.sha1)
 
-    def cache_artifacts_locally(self, artifacts):
-        '''Get artifacts missing from local cache from remote cache.'''
+    @staticmethod
+    def _metadata_to_cache(artifact):
+        if artifact.source.morphology.needs_artifact_metadata_cached:
+            return ['meta']
+        return []
 
-        def do_fetch(name, remote, local):
-            meta = remote.info()
-            content_len = int(meta.getheaders('Content-Length')[0])
-            logging.debug('Artifact content length: %s', content_len)
-
-            if content_len < 1024:
-                report_progress = lambda count: bar.show(count)
-                expected_size = content_len
-                unit = 'bytes'
-            elif content_len >= 1024 and content_len < 1024 ** 2:
-                report_progress = lambda count: bar.show(count / float(1024))
-                expected_size = content_len / float(1024)
-                unit = 'KB'
-            else:
-                report_progress = lambda count: bar.show(count
-                                                          / float((1024 ** 2)))
-                expected_size = content_len / float((1024 ** 2))
-                unit = 'MB'
+    def query_remote_cache(self, artifacts):
+        '''Find out which artifacts the remote cache has, all at once.
 
-            bar = morphlib.util.ProgressBar(name,
-                                            expected_size, unit)
+        This saves asking about each artifact in turn as it is reached in
+        the build. Returns the set of artifacts that the remote cache has
+        and the local one does not. If the remote cache cannot be asked,
+        returns None, and every artifact is tried as it is reached instead.
 
-            morphlib.util.copyfileobj(remote, local,
-                                      callback=report_progress)
+        '''
 
-        def fetch_files(name, to_fetch):
-            '''Fetch a set of files atomically.
+        wanted = [(artifact, self._metadata_to_cache(artifact))
+                  for artifact in artifacts if not self.lac.has(artifact)]
+        try:
+            present = self.rac.has_many(wanted)
+        except morphlib.remoteartifactcache.QueryError as e:
+            logging.warning(str(e))
+            return None
+        self.remote_missing = set(
+            artifact for artifact, names in wanted if artifact not in present)
+        self.app.status(
+            msg='Remote cache has %(count)d of %(total)d artifacts that '
+                'are not cached locally',
+            count=len(present), total=len(wanted), chatty=True)
+        return present
 
-            If an error occurs during the transfer of any files, all downloaded
-            data is deleted, to ensure integrity of the local cache.
+    def cache_artifacts_locally(self, artifacts):
+        '''Get artifacts missing from local cache from remote cache.'''
 
-            '''
+        if self.rac is None:
+            return
 
-            try:
-                for remote, local in to_fetch:
-                    do_fetch(name, remote, local)
-            except BaseException:
-                for remote, local in to_fetch:
-                    local.abort()
-                raise
-            else:
-                for remote, local in to_fetch:
-                    remote.close()
-                    local.close()
+        def status(artifact):
+            self.app.status(
+                msg='Fetching to local cache: artifact %(name)s',
+                name=artifact.name)
 
-        for artifact in artifacts:
-            # This block should fetch all artifact files in one go, using the
-            # 1.0/artifacts method of morph-cache-server. The code to do that
-            # needs bringing in from the distbuild.worker_build_connection
-            # module into morphlib.remoteartififactcache first.
-            to_fetch = []
-            if not self.lac.has(artifact):
-                to_fetch.append((self.rac.get(artifact),
-                                 self.lac.put(artifact)))
-
-            if artifact.source.morphology.needs_artifact_metadata_cached:
-                if not self.lac.has_artifact_metadata(artifact, 'meta'):
-                    to_fetch.append((
-                        self.rac.get_artifact_metadata(artifact, 'meta'),
-                        self.lac.put_artifact_metadata(artifact, 'meta')))
-
-            if len(to_fetch) > 0:
-                self.app.status(
-                    msg='Fetching to local cache: artifact %(name)s',
-                    name=artifact.name)
-                fetch_files(artifact.name, to_fetch)
+        wanted = [(artifact, self._metadata_to_cache(artifact))
+                  for artifact in artifacts
+                  if artifact not in self.remote_missing]
+        self.rac.fetch(self.lac, wanted, status=status)
 
     def create_staging_area(self, source, build_env, use_chroot=True,
                             extra_env={}, extra_path=[]):
@@ -476,7 +552,7 @@ class BuildCommand(object):
             dir=os.path.join(self.app.settings['tempdir'], 'staging'))
         staging_area = morphlib.stagingarea.StagingArea(
             self.app, source, staging_dir, build_env, use_chroot, extra_env,
-            extra_path)
+            extra_path, mode=self.app.settings['staging-area-mode'])
         return staging_area
 
     def remove_staging_area(self, staging_area):
@@ -516,32 +592,73 @@ class BuildCommand(object):
 
         '''
 
-        for artifact in artifacts:
-            if artifact.source.morphology['kind'] != 'chunk':
-                continue
-            if artifact.source.build_mode == 'bootstrap':
-               if not self.in_same_stratum(artifact.source, target_source):
-                    continue
-            self.app.status(
-                msg='Installing chunk %(chunk_name)s from cache %(cache)s',
-                chunk_name=artifact.name,
-                cache=artifact.source.cache_key[:7],
-                chatty=True)
-            handle = self.lac.get(artifact)
-            staging_area.install_artifact(handle)
+        artifacts = [a for a in artifacts
+                     if self._installable_dependency(a, target_source)]
+
+        if self.staging_base_cache is None:
+            for artifact in artifacts:
+                self.install_artifact(staging_area, artifact)
+            staging_area.mount_layers()
+            if target_source.build_mode == 'staging':
+                morphlib.builder.ldconfig(self.app, staging_area.dirname)
+            return
 
-        if target_source.build_mode == 'staging':
-            morphlib.builder.ldconfig(self.app, staging_area.dirname)
+        cache = self.staging_base_cache
+        key = cache.key(artifacts, target_source.build_mode)
 
-    def build_and_cache(self, staging_area, source, setup_mounts):
+        def populate(root):
+            self.app.status(msg='Preparing staging area base %(key)s',
+                            key=key[:7], chatty=True)
+            for artifact in artifacts:
+                self.app.status(
+                    msg='Installing chunk %(chunk_name)s from cache '
+                        '%(cache)s',
+                    chunk_name=artifact.name,
+                    cache=artifact.source.cache_key[:7],
+                    chatty=True)
+                unpacked = morphlib.stagingarea.unpack_artifact(
+                    self.app, self.lac.get(artifact))
+                # Always hardlinked; see StagingBaseCache for why.
+                try:
+                    morphlib.stagingarea.hardlink_all_files(unpacked.root,
+                                                            root)
+                finally:
+                    unpacked.release()
+            if target_source.build_mode == 'staging':
+                morphlib.builder.ldconfig(self.app, root)
+
+        base = cache.get(key, populate)
+        staging_area.install_base(base)
+        staging_area.mount_layers()
+
+    def _installable_dependency(self, artifact, target_source):
+        if artifact.source.morphology['kind'] != 'chunk':
+            return False
+        if artifact.source.build_mode == 'bootstrap':
+            return self.in_same_stratum(artifact.source, target_source)
+        return True
+
+    def install_artifact(self, staging_area, artifact):
+        self.app.status(
+            msg='Installing chunk %(chunk_name)s from cache %(cache)s',
+            chunk_name=artifact.name,
+            cache=artifact.source.cache_key[:7],
+            chatty=True)
+        handle = self.lac.get(artifact)
+        staging_area.install_artifact(handle)
+
+    def build_and_cache(self, staging_area, source, setup_mounts,
+                        max_jobs=None):
         '''Build a source and put its artifacts into the local cache.'''
 
         self.app.status(msg='Starting actual build: %(name)s '
                             '%(sha1)s',
                         name=source.name, sha1=source.sha1[:7])
+        if max_jobs is None:
+            max_jobs = self.app.settings['max-jobs']
         builder = morphlib.builder.Builder(
             self.app, staging_area, self.lac, self.rac, self.lrc,
-            self.app.settings['max-jobs'], setup_mounts)
+            max_jobs, setup_mounts)
         return builder.build_and_cache(source)
 
 class InitiatorBuildCommand(BuildCommand):
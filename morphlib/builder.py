@@ -1,4 +1,4 @@
-# Copyright (C) 2012-2015  Codethink Limited
+# Copyright (C) 2012-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -36,15 +36,34 @@ import morphlib.gitversion
 SYSTEM_INTEGRATION_PATH = os.path.join('baserock', 'system-integration')
 
 def extract_sources(app, repo_cache, repo, sha1, srcdir): #pragma: no cover
-    '''Get sources from git to a source directory, including submodules'''
+    '''Get sources from git to a source directory, including submodules
+
+    By default the source directory is a full clone, since some builds
+    need the git history. With ``--chunk-source-mode=export`` only the
+    files of the commit are exported, which is much cheaper than copying
+    the whole repository for big ones like linux.
+
+    '''
+
+    clone = app.settings['chunk-source-mode'] == 'clone'
+
+    def clone_repo(repo, sha1, destdir):
+        repo.checkout(sha1, destdir)
+        morphlib.git.reset_workdir(app.runcmd, destdir)
 
     def extract_repo(repo, sha1, destdir):
         app.status(msg='Extracting %(source)s into %(target)s',
                    source=repo.original_name,
                    target=destdir)
 
-        repo.checkout(sha1, destdir)
-        morphlib.git.reset_workdir(app.runcmd, destdir)
+        if clone:
+            clone_repo(repo, sha1, destdir)
+        else:
+            repo.extract_commit(sha1, destdir)
+            # git-fat can only fetch the large files into a clone.
+            if os.path.exists(os.path.join(destdir, '.gitfat')):
+                shutil.rmtree(destdir)
+                clone_repo(repo, sha1, destdir)
         submodules = morphlib.git.Submodules(app, repo.path, sha1)
         try:
             submodules.load()
@@ -0,0 +1,177 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import logging
+import Queue
+import sys
+import threading
+
+
+class BuildScheduler(object):
+
+    '''Build the sources of a build graph, several at a time.
+
+    The sources must be given in a build order: every source must come
+    after all the sources it depends on. A source is started as soon as
+    all of its dependencies have finished building, up to
+    ``max_concurrent`` sources at the same time. When there is a choice,
+    sources are started in the order they were given, so with one build
+    at a time the order is exactly the given one.
+
+    ``max_jobs`` is the total number of parallel make jobs to share out
+    between the running builds. Each build gets a share of what is left of
+    the budget when it starts, and gives it back when it finishes.
+
+    The callback is called as ``build_cb(source, index, max_jobs)``, where
+    ``index`` counts the builds in the order they were started. When
+    building more than one source at a time, the callback runs in a thread
+    of its own.
+
+    If a build fails, no more builds are started, the ones that are
+    already running are waited for, and the first error is raised again.
+
+    '''
+
+    # Seconds between checks for Ctrl+C while waiting for builds.
+    poll_interval = 1
+
+    def __init__(self, sources, max_concurrent=1, max_jobs=1):
+        self.sources = list(sources)
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_jobs = max(1, max_jobs)
+
+        self._position = dict((s, i) for i, s in enumerate(self.sources))
+        self._waiting_for = {}
+        self._dependents = dict((s, []) for s in self.sources)
+        for source in self.sources:
+            deps = set(a.source for a in source.dependencies
+                       if a.source in self._position)
+            self._waiting_for[source] = len(deps)
+            for dep in deps:
+                self._dependents[dep].append(source)
+
+        self._ready = [s for s in self.sources if self._waiting_for[s] == 0]
+        self._running = {}
+        self._started = 0
+        self._finished = 0
+
+    def jobs_for_next_build(self):
+        '''Return the make jobs to give the next build that is started.'''
+
+        free_jobs = self.max_jobs - sum(self._running.itervalues())
+        free_slots = self.max_concurrent - len(self._running)
+        sharers = max(1, min(free_slots, len(self._ready)))
+        return max(1, free_jobs // sharers)
+
+    def start_next(self):
+        '''Mark the next ready source as running and return it.
+
+        Returns ``(source, index, max_jobs)``, or None if there is no
+        ready source or no free slot to build it in.
+
+        '''
+
+        if not self._ready or len(self._running) >= self.max_concurrent:
+            return None
+        max_jobs = self.jobs_for_next_build()
+        source = self._ready.pop(0)
+        self._running[source] = max_jobs
+        self._started += 1
+        return source, self._started, max_jobs
+
+    def finish(self, source):
+        '''Mark a running source as built, making its dependents ready.'''
+
+        del self._running[source]
+        self._finished += 1
+        newly_ready = []
+        for dependent in self._dependents[source]:
+            self._waiting_for[dependent] -= 1
+            if self._waiting_for[dependent] == 0:
+                newly_ready.append(dependent)
+        self._ready.extend(newly_ready)
+        self._ready.sort(key=lambda s: self._position[s])
+
+    def running(self):
+        return self._running.keys()
+
+    def done(self):
+        return self._finished == len(self.sources)
+
+    def run(self, build_cb):
+        '''Build every source, calling ``build_cb`` for each of them.'''
+
+        if self.max_concurrent == 1:
+            self._run_serially(build_cb)
+        else:
+            self._run_in_threads(build_cb)
+
+    def _run_serially(self, build_cb):
+        while not self.done():
+            source, index, max_jobs = self.start_next()
+            build_cb(source, index, max_jobs)
+            self.finish(source)
+
+    def _run_in_threads(self, build_cb):
+        results = Queue.Queue()
+
+        def build_in_thread(source, index, max_jobs):
+            try:
+                build_cb(source, index, max_jobs)
+            except BaseException:
+                results.put((source, sys.exc_info()))
+            else:
+                results.put((source, None))
+
+        error = None
+        while not self.done():
+            while error is None:
+                started = self.start_next()
+                if started is None:
+                    break
+                logging.debug('Starting build of %s with %d jobs, '
+                              '%d builds running',
+                              started[0].name, started[2],
+                              len(self._running))
+                thread = threading.Thread(target=build_in_thread,
+                                          args=started)
+                thread.daemon = True
+                thread.start()
+
+            if not self._running:
+                break
+
+            # Queue.get() without a timeout cannot be interrupted by
+            # Ctrl+C in Python 2, so wake up regularly.
+            while True:
+                try:
+                    source, exc_info = results.get(
+                        timeout=self.poll_interval)
+                    break
+                except Queue.Empty:
+                    pass
+
+            if exc_info is None:
+                self.finish(source)
+            else:
+                del self._running[source]
+                if error is None:
+                    error = exc_info
+                else:
+                    logging.error('Build of %s also failed: %s',
+                                  source.name, exc_info[1])
+
+        if error is not None:
+            raise error[0], error[1], error[2]
@@ -0,0 +1,201 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import threading
+import time
+import unittest
+
+import morphlib
+
+
+class FakeArtifact(object):
+
+    def __init__(self, source):
+        self.source = source
+
+
+class FakeSource(object):
+
+    def __init__(self, name, *deps):
+        self.name = name
+        self.dependencies = [FakeArtifact(d) for d in deps]
+
+    def __repr__(self):
+        return 'FakeSource(%s)' % self.name
+
+
+class BuildSchedulerTests(unittest.TestCase):
+
+    def setUp(self):
+        # a and b are independent, c needs both, d needs only a.
+        self.a = FakeSource('a')
+        self.b = FakeSource('b')
+        self.c = FakeSource('c', self.a, self.b)
+        self.d = FakeSource('d', self.a)
+        self.order = [self.a, self.b, self.c, self.d]
+
+    def test_serial_run_keeps_given_order(self):
+        built = []
+        scheduler = morphlib.buildscheduler.BuildScheduler(self.order)
+        scheduler.run(lambda s, i, j: built.append((s, i, j)))
+        self.assertEqual(built, [(self.a, 1, 1), (self.b, 2, 1),
+                                 (self.c, 3, 1), (self.d, 4, 1)])
+
+    def test_starts_independent_sources_together(self):
+        scheduler = morphlib.buildscheduler.BuildScheduler(
+            self.order, max_concurrent=4, max_jobs=8)
+        first = scheduler.start_next()
+        second = scheduler.start_next()
+        self.assertEqual(first[0], self.a)
+        self.assertEqual(second[0], self.b)
+        self.assertEqual(scheduler.start_next(), None)
+        self.assertEqual(set(scheduler.running()), set([self.a, self.b]))
+
+    def test_dependents_become_ready_when_dependencies_finish(self):
+        scheduler = morphlib.buildscheduler.BuildScheduler(
+            self.order, max_concurrent=4, max_jobs=8)
+        scheduler.start_next()
+        scheduler.start_next()
+        scheduler.finish(self.b)
+        self.assertEqual(scheduler.start_next(), None)
+        scheduler.finish(self.a)
+        self.assertEqual(scheduler.start_next()[0], self.c)
+        self.assertEqual(scheduler.start_next()[0], self.d)
+        self.assertFalse(scheduler.done())
+        scheduler.finish(self.c)
+        scheduler.finish(self.d)
+        self.assertTrue(scheduler.done())
+
+    def test_respects_concurrency_limit(self):
+        scheduler = morphlib.buildscheduler.BuildScheduler(
+            self.order, max_concurrent=1, max_jobs=8)
+        scheduler.start_next()
+        self.assertEqual(scheduler.start_next(), None)
+
+    def test_shares_out_make_jobs(self):
+        scheduler = morphlib.buildscheduler.BuildScheduler(
+            self.order, max_concurrent=4, max_jobs=8)
+        self.assertEqual(scheduler.start_next()[2], 4)
+        self.assertEqual(scheduler.start_next()[2], 4)
+        scheduler.finish(self.a)
+        scheduler.finish(self.b)
+        self.assertEqual(scheduler.start_next()[2], 4)
+        self.assertEqual(scheduler.start_next()[2], 4)
+
+    def test_lone_ready_source_gets_whole_budget(self):
+        scheduler = morphlib.buildscheduler.BuildScheduler(
+            [self.a, self.d], max_concurrent=4, max_jobs=8)
+        self.assertEqual(scheduler.start_next()[2], 8)
+
+    def test_always_gives_at_least_one_job(self):
+        scheduler = morphlib.buildscheduler.BuildScheduler(
+            self.order, max_concurrent=4, max_jobs=1)
+        self.assertEqual(scheduler.start_next()[2], 1)
+        self.assertEqual(scheduler.start_next()[2], 1)
+
+    def test_ignores_dependencies_outside_build_order(self):
+        scheduler = morphlib.buildscheduler.BuildScheduler(
+            [self.c], max_concurrent=2)
+        self.assertEqual(scheduler.start_next()[0], self.c)
+
+
+class ConcurrentBuildTests(unittest.TestCase):
+
+    def setUp(self):
+        self.a = FakeSource('a')
+        self.b = FakeSource('b')
+        self.c = FakeSource('c', self.a, self.b)
+        self.d = FakeSource('d', self.a)
+        self.order = [self.a, self.b, self.c, self.d]
+        self.lock = threading.Lock()
+        self.log = []
+        self.started = dict((s, threading.Event()) for s in self.order)
+
+    def scheduler(self):
+        scheduler = morphlib.buildscheduler.BuildScheduler(
+            self.order, max_concurrent=4, max_jobs=8)
+        scheduler.poll_interval = 0.01
+        return scheduler
+
+    def record(self, what, source):
+        with self.lock:
+            self.log.append((what, source))
+
+    def position(self, what, source):
+        return self.log.index((what, source))
+
+    def test_builds_independent_sources_at_the_same_time(self):
+        overlapped = []
+
+        def build(source, index, max_jobs):
+            self.record('start', source)
+            self.started[source].set()
+            if source in (self.a, self.b):
+                other = self.b if source is self.a else self.a
+                overlapped.append(self.started[other].wait(5))
+                time.sleep(0.05)
+            self.record('end', source)
+
+        self.scheduler().run(build)
+        self.assertEqual(overlapped, [True, True])
+        self.assertEqual(len(self.log), 8)
+
+    def test_waits_for_dependencies_to_finish(self):
+        def build(source, index, max_jobs):
+            self.record('start', source)
+            if source is self.b:
+                time.sleep(0.05)
+            self.record('end', source)
+
+        self.scheduler().run(build)
+        self.assertTrue(self.position('end', self.a) <
+                        self.position('start', self.c))
+        self.assertTrue(self.position('end', self.b) <
+                        self.position('start', self.c))
+        self.assertTrue(self.position('end', self.a) <
+                        self.position('start', self.d))
+
+    def test_raises_first_error_once_running_builds_finish(self):
+        def build(source, index, max_jobs):
+            self.record('start', source)
+            if source is self.a:
+                self.started[self.b].wait(5)
+                raise RuntimeError('a failed')
+            self.started[source].set()
+            time.sleep(0.05)
+            self.record('end', source)
+
+        try:
+            self.scheduler().run(build)
+        except RuntimeError as e:
+            self.record('raised', e)
+        self.assertEqual(self.log[-1][0], 'raised')
+        self.assertEqual(str(self.log[-1][1]), 'a failed')
+        self.assertTrue(('end', self.b) in self.log)
+        self.assertFalse(('start', self.c) in self.log)
+        self.assertFalse(('start', self.d) in self.log)
+
+    def test_raises_first_of_several_errors(self):
+        def build(source, index, max_jobs):
+            self.started[source].set()
+            if source is self.a:
+                self.started[self.b].wait(5)
+                raise RuntimeError('a failed')
+            self.started[self.a].wait(5)
+            time.sleep(0.05)
+            raise RuntimeError('b failed')
+
+        self.assertRaisesRegexp(RuntimeError, 'a failed',
+                                self.scheduler().run, build)
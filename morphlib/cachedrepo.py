@@ -1,4 +1,4 @@
-# Copyright (C) 2012-2015  Codethink Limited
+# Copyright (C) 2012-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -123,6 +123,16 @@ class CachedRepo(object):
         '''
         return self.gitdir.read_file(filename, ref)
 
+    def read_files(self, filenames, ref):  # pragma: no cover
+        '''Read several files from a given ref at once.
+
+        Returns a list with the contents of each file, or None for files
+        that are not found in the ref. Raises a gitdir.InvalidRefError if
+        the ref is not found in the repository.
+
+        '''
+        return self.gitdir.read_files(filenames, ref)
+
     def tags_containing_sha1(self, ref):  # pragma: no cover
         '''Check whether given sha1 is contained in any tags
 
@@ -1,4 +1,4 @@
-# Copyright (C) 2012-2015  Codethink Limited
+# Copyright (C) 2012-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -21,8 +21,9 @@ import morphlib
 
 class CacheKeyComputer(object):
 
-    def __init__(self, build_env):
+    def __init__(self, build_env, chunk_source_mode='clone'):
         self._build_env = build_env
+        self._chunk_source_mode = chunk_source_mode
         self._calculated = {}
         self._hashed = {}
 
@@ -31,6 +32,30 @@ class CacheKeyComputer(object):
                 "USER", "USERNAME"]
         return dict([(k, env[k]) for k in keys])
 
+    def get_env_id(self):
+        '''Return the parts of the build environment that keys depend on.'''
+        return self._filterenv(self._build_env.env)
+
+    def get_settings_id(self):
+        '''Return everything besides the sources that keys depend on.'''
+        return {
+            'env': self.get_env_id(),
+            'chunk-source-mode': self._chunk_source_mode,
+        }
+
+    def has_saved_keys(self, srcpool):
+        '''Are the keys saved with srcpool the ones this would compute?'''
+        return srcpool.cache_key_env == self.get_settings_id()
+
+    def compute_keys(self, sources, srcpool=None):
+        '''Set the cache keys of sources, and save them with srcpool.'''
+        for source in sources:
+            source.cache_key = self.compute_key(source)
+            source.cache_id = self.get_cache_id(source)
+        if srcpool is not None:
+            srcpool.cache_key_env = self.get_settings_id()
+            srcpool.save_snapshot()
+
     def compute_key(self, source):
         try:
             return self._hashed[source]
@@ -80,7 +105,7 @@ class CacheKeyComputer(object):
 
     def _calculate(self, source):
         keys = {
-            'env': self._filterenv(self._build_env.env),
+            'env': self.get_env_id(),
             'kids': [{'artifact': a.name,
                       'cache-key': self.compute_key(a.source)}
                      for a in source.dependencies],
@@ -93,6 +118,11 @@ class CacheKeyComputer(object):
             keys['build-mode'] = source.build_mode
             keys['prefix'] = source.prefix
             keys['tree'] = source.tree
+            # Exported sources have no git history, which changes what
+            # some builds produce, e.g. ones that run `git describe`.
+            # Clones keep the keys they had before the mode existed.
+            if self._chunk_source_mode != 'clone':
+                keys['chunk-source-mode'] = self._chunk_source_mode
             keys['split-rules'] = [(a, [rgx.pattern for rgx in r._regexes])
                                    for (a, r) in source.split_rules]
 
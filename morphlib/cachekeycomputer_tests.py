@@ -1,4 +1,4 @@
-# Copyright (C) 2012-2015  Codethink Limited
+# Copyright (C) 2012-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -158,6 +158,32 @@ class CacheKeyComputerTests(unittest.TestCase):
         self.assertTrue(self._valid_sha256(
                         self.ckc.compute_key(artifact.source)))
 
+    def test_exported_chunk_sources_give_different_keys(self):
+        artifact = self._find_artifact('system-rootfs')
+        oldsha = self.ckc.compute_key(artifact.source)
+        ckc = morphlib.cachekeycomputer.CacheKeyComputer(
+            self.build_env, 'clone')
+        self.assertEqual(oldsha, ckc.compute_key(artifact.source))
+        ckc = morphlib.cachekeycomputer.CacheKeyComputer(
+            self.build_env, 'export')
+        self.assertNotEqual(oldsha, ckc.compute_key(artifact.source))
+
+    def test_changing_chunk_source_mode_computes_keys_again(self):
+        clone = morphlib.cachekeycomputer.CacheKeyComputer(
+            self.build_env, 'clone')
+        export = morphlib.cachekeycomputer.CacheKeyComputer(
+            self.build_env, 'export')
+        clone.compute_keys(self.source_pool, self.source_pool)
+        self.assertTrue(clone.has_saved_keys(self.source_pool))
+        self.assertFalse(export.has_saved_keys(self.source_pool))
+        clone_keys = [s.cache_key for s in self.source_pool]
+
+        export.compute_keys(self.source_pool, self.source_pool)
+        self.assertTrue(export.has_saved_keys(self.source_pool))
+        self.assertFalse(clone.has_saved_keys(self.source_pool))
+        self.assertNotEqual([s.cache_key for s in self.source_pool],
+                            clone_keys)
+
     def test_different_env_gives_different_key(self):
         artifact = self._find_artifact('system-rootfs')
         oldsha = self.ckc.compute_key(artifact.source)
@@ -1,4 +1,4 @@
-# Copyright (C) 2015  Codethink Limited
+# Copyright (C) 2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -104,7 +104,8 @@ class DefinitionsRepo(gitdir.GitDirectory):
     def source_pool(self, lrc, rrc, cachedir, ref, system_filename,
                     include_local_changes=False, push_local_changes=False,
                     update_repos=True, status_cb=None, build_ref_prefix=None,
-                    git_user_name=None, git_user_email=None):
+                    git_user_name=None, git_user_email=None,
+                    concurrent_git_updates=1):
         '''Load the system defined in 'morph' and all the sources it contains.
 
         This is a context manager, because depending on the settings given it
@@ -144,7 +145,9 @@ class DefinitionsRepo(gitdir.GitDirectory):
         The 'update_repos' flag allows you to disable updating Git repos, to
         honour app.settings['no-git-update']. If one of the refs in the build
         graph is not available locally and update_repos is False, you will see
-        a morphlib.gitdir.InvalidRefError exception.
+        a morphlib.gitdir.InvalidRefError exception. Up to
+        'concurrent_git_updates' repos are updated or cloned at once, to
+        honour app.settings['concurrent-git-updates'].
 
         The 'status_cb' function will be called if set to output progress and
         status messages to the user.
@@ -176,7 +179,8 @@ class DefinitionsRepo(gitdir.GitDirectory):
                 yield morphlib.sourceresolver.create_source_pool(
                     lrc, rrc, repo_url, commit, [system_filename],
                     cachedir=cachedir, original_ref=original_ref,
-                    update_repos=update_repos, status_cb=status_cb)
+                    update_repos=update_repos, status_cb=status_cb,
+                    concurrent_git_updates=concurrent_git_updates)
         else:
             repo_url = self.remote_url
             commit = self.resolve_ref_to_commit(ref)
@@ -188,7 +192,8 @@ class DefinitionsRepo(gitdir.GitDirectory):
                 yield morphlib.sourceresolver.create_source_pool(
                     lrc, rrc, repo_url, commit, [system_filename],
                     cachedir=cachedir, original_ref=ref,
-                    update_repos=update_repos, status_cb=status_cb)
+                    update_repos=update_repos, status_cb=status_cb,
+                    concurrent_git_updates=concurrent_git_updates)
             except morphlib.sourceresolver.InvalidDefinitionsRefError as e:
                 raise cliapp.AppException(
                     'Commit %s wasn\'t found in the "origin" remote %s. '
@@ -332,7 +337,9 @@ class DefinitionsRepoWithApp(DefinitionsRepo):
             git_user_name=self._git_user_name,
             git_user_email=self._git_user_email,
             status_cb=self.app.status,
-            update_repos=(not self.app.settings['no-git-update']))
+            update_repos=(not self.app.settings['no-git-update']),
+            concurrent_git_updates=self.app.settings[
+                'concurrent-git-updates'])
 
 def _local_definitions_repo(path, search_for_root, app=None):
     '''Open a local Git repo containing Baserock definitions, at 'path'.
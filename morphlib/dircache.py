@@ -0,0 +1,244 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import tempfile
+
+
+def disk_usage(root):
+    '''Return the bytes of disk used by the files in ``root``.
+
+    A file with several hardlinks in ``root`` is counted once. Files
+    that are also linked from elsewhere, such as the unpacked chunks a
+    staging area base is made from, are counted in full: removing the
+    other links leaves ``root`` holding them alone, so counting them
+    any other way would make the size go stale.
+
+    '''
+
+    total = 0
+    seen = set()
+    for dirname, subdirs, basenames in os.walk(root):
+        total += os.lstat(dirname).st_blocks * 512
+        for basename in basenames:
+            st = os.lstat(os.path.join(dirname, basename))
+            if st.st_nlink > 1:
+                if (st.st_dev, st.st_ino) in seen:
+                    continue
+                seen.add((st.st_dev, st.st_ino))
+            total += st.st_blocks * 512
+    return total
+
+
+class CachedDirectory(object):
+
+    '''A directory in a DirectoryCache, held open for use.
+
+    The directory will not be evicted from the cache until it is released.
+
+    '''
+
+    def __init__(self, key, root, fd):
+        self.key = key
+        self.root = root
+        self._fd = fd
+
+    def release(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class DirectoryCache(object):
+
+    '''A size-bounded store of directory trees, shared between processes.
+
+    Each entry lives in ``dirname/KEY/root``, with its size in
+    ``dirname/KEY/size``. An entry is filled in under a temporary name
+    and renamed into place when it is complete, so it is never seen half
+    made. While an entry is being made, ``dirname/KEY.lock`` is locked,
+    so that other processes wanting the same entry wait for it instead
+    of making it again.
+
+    Users hold a shared flock on an entry's directory while they use it,
+    which acts as a reference count that the kernel drops if the user
+    dies. Entries are evicted least recently used first, to keep the
+    total size under ``max_size`` bytes, but an entry that is held is
+    never evicted. A ``max_size`` of None means there is no bound.
+
+    The size of an entry is the disk used by everything in it, measured
+    once when it is made; entries are never changed afterwards. A file
+    shared by several entries, or with another cache, is counted in
+    each, so the total overestimates the disk used, and the bound is an
+    upper limit on what the cache can be keeping alive.
+
+    '''
+
+    def __init__(self, dirname, max_size=None):
+        self.dirname = dirname
+        self.max_size = max_size
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+    def _keydir(self, key):
+        return os.path.join(self.dirname, key)
+
+    def _lockfile(self, key):
+        return os.path.join(self.dirname, key + '.lock')
+
+    def open(self, key):
+        '''Return a CachedDirectory for ``key``, or None if not cached.'''
+
+        keydir = self._keydir(key)
+        try:
+            fd = os.open(keydir, os.O_RDONLY)
+        except OSError:
+            return None
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        # It may have been evicted while we waited for the lock.
+        try:
+            same = os.stat(keydir).st_ino == os.fstat(fd).st_ino
+        except OSError:  # pragma: no cover
+            same = False
+        if not same:  # pragma: no cover
+            os.close(fd)
+            return None
+        os.utime(keydir, None)
+        return CachedDirectory(key, os.path.join(keydir, 'root'), fd)
+
+    def get(self, key, populate):
+        '''Return the entry for ``key``, held open, making it if needed.
+
+        If the entry is being made by someone else, wait for them to
+        finish rather than making it again.
+
+        '''
+
+        entry = self.open(key)
+        if entry is not None:
+            return entry
+        lock_fd = os.open(self._lockfile(key), os.O_WRONLY | os.O_CREAT,
+                          0o644)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            entry = self.open(key)
+            if entry is None:
+                entry = self.create(key, populate)
+        finally:
+            os.close(lock_fd)
+        return entry
+
+    def create(self, key, populate):
+        '''Make a new entry for ``key`` and return it, held open.
+
+        ``populate`` is called with the path of an empty directory, which
+        it should fill in. If another process creates the same entry at
+        the same time, one of the two copies is thrown away.
+
+        '''
+
+        tempdir = tempfile.mkdtemp(dir=self.dirname, prefix='tmp')
+        try:
+            root = os.path.join(tempdir, 'root')
+            os.mkdir(root)
+            populate(root)
+            with open(os.path.join(tempdir, 'size'), 'w') as f:
+                f.write('%d\n' % disk_usage(root))
+        except BaseException:
+            shutil.rmtree(tempdir, ignore_errors=True)
+            raise
+
+        try:
+            os.rename(tempdir, self._keydir(key))
+        except OSError as e:  # pragma: no cover
+            logging.debug('Cache entry %s was created elsewhere: %s', key, e)
+            shutil.rmtree(tempdir, ignore_errors=True)
+
+        entry = self.open(key)
+        if self.max_size is not None:
+            self.evict(self.max_size)
+        return entry
+
+    def list_contents(self):
+        '''Return [(key, size, last_used)] for every entry in the cache.'''
+
+        contents = []
+        for key in os.listdir(self.dirname):
+            keydir = self._keydir(key)
+            if key.startswith('tmp') or not os.path.isdir(keydir):
+                continue
+            try:
+                last_used = os.stat(keydir).st_mtime
+                with open(os.path.join(keydir, 'size')) as f:
+                    size = int(f.read())
+            except (IOError, ValueError):
+                # Left behind by an older version of Morph.
+                size = disk_usage(keydir)
+            except OSError:  # pragma: no cover
+                continue
+            contents.append((key, size, last_used))
+        return contents
+
+    def remove(self, key):
+        '''Remove the entry for ``key``, unless it is in use.
+
+        Returns True if it was removed.
+
+        '''
+
+        keydir = self._keydir(key)
+        try:
+            fd = os.open(keydir, os.O_RDONLY)
+        except OSError:  # pragma: no cover
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            os.close(fd)
+            return False
+        # Move it out of the way first, so nobody opens it while it is
+        # being deleted.
+        doomed = tempfile.mkdtemp(dir=self.dirname, prefix='tmp')
+        os.rename(keydir, os.path.join(doomed, key))
+        os.close(fd)
+        shutil.rmtree(doomed)
+        try:
+            os.remove(self._lockfile(key))
+        except OSError as e:  # pragma: no cover
+            if e.errno != errno.ENOENT:
+                raise
+        return True
+
+    def evict(self, max_size):
+        '''Remove least recently used entries until under ``max_size`` bytes.
+
+        Returns the number of bytes freed.
+
+        '''
+
+        contents = sorted(self.list_contents(), key=lambda x: x[2])
+        total = sum(size for key, size, last_used in contents)
+        freed = 0
+        for key, size, last_used in contents:
+            if total - freed <= max_size:
+                break
+            if self.remove(key):
+                logging.debug('Evicted %s from %s', key, self.dirname)
+                freed += size
+        return freed
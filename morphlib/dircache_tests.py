@@ -0,0 +1,165 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import morphlib
+
+
+class DirectoryCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.dirname = os.path.join(self.tempdir, 'cache')
+        self.cache = morphlib.dircache.DirectoryCache(self.dirname)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def populate_with(self, contents):
+        def populate(root):
+            with open(os.path.join(root, 'file'), 'w') as f:
+                f.write(contents)
+        return populate
+
+    def test_creates_directory(self):
+        self.assertTrue(os.path.isdir(self.dirname))
+
+    def test_open_returns_none_when_not_cached(self):
+        self.assertEqual(self.cache.open('missing'), None)
+
+    def test_create_populates_entry(self):
+        entry = self.cache.create('key', self.populate_with('foo'))
+        with open(os.path.join(entry.root, 'file')) as f:
+            self.assertEqual(f.read(), 'foo')
+        entry.release()
+
+    def test_open_finds_created_entry(self):
+        self.cache.create('key', self.populate_with('foo')).release()
+        entry = self.cache.open('key')
+        self.assertNotEqual(entry, None)
+        self.assertTrue(os.path.exists(os.path.join(entry.root, 'file')))
+        entry.release()
+
+    def test_failed_populate_leaves_nothing_behind(self):
+        def populate(root):
+            raise RuntimeError('failed')
+        self.assertRaises(RuntimeError, self.cache.create, 'key', populate)
+        self.assertEqual(os.listdir(self.dirname), [])
+
+    def test_get_makes_missing_entry(self):
+        entry = self.cache.get('key', self.populate_with('foo'))
+        with open(os.path.join(entry.root, 'file')) as f:
+            self.assertEqual(f.read(), 'foo')
+        entry.release()
+
+    def test_get_reuses_existing_entry(self):
+        self.cache.create('key', self.populate_with('foo')).release()
+        entry = self.cache.get('key', self.populate_with('bar'))
+        with open(os.path.join(entry.root, 'file')) as f:
+            self.assertEqual(f.read(), 'foo')
+        entry.release()
+
+    def test_concurrent_gets_populate_once(self):
+        calls = []
+
+        def populate(root):
+            calls.append(root)
+            time.sleep(0.1)
+
+        def get():
+            # Each thread needs its own lock file descriptor, as flock
+            # is per open file description.
+            cache = morphlib.dircache.DirectoryCache(self.dirname)
+            cache.get('key', populate).release()
+
+        threads = [threading.Thread(target=get) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+
+    def test_lists_contents(self):
+        self.cache.create('key', self.populate_with('foo')).release()
+        contents = self.cache.list_contents()
+        self.assertEqual([key for key, size, last_used in contents], ['key'])
+        self.assertTrue(contents[0][1] > 0)
+
+    def test_lists_only_finished_entries(self):
+        self.cache.get('key', self.populate_with('foo')).release()
+        os.mkdir(os.path.join(self.dirname, 'tmpunfinished'))
+        contents = self.cache.list_contents()
+        self.assertEqual([key for key, size, last_used in contents], ['key'])
+
+    def test_lists_entries_without_size(self):
+        os.makedirs(os.path.join(self.dirname, 'old.d', 'usr'))
+        contents = self.cache.list_contents()
+        self.assertEqual([key for key, size, last_used in contents],
+                         ['old.d'])
+
+    def test_removes_unused_entry(self):
+        self.cache.get('key', self.populate_with('foo')).release()
+        self.assertTrue(self.cache.remove('key'))
+        self.assertEqual(self.cache.open('key'), None)
+        self.assertEqual(os.listdir(self.dirname), [])
+
+    def test_does_not_remove_entry_in_use(self):
+        entry = self.cache.create('key', self.populate_with('foo'))
+        self.assertFalse(self.cache.remove('key'))
+        entry.release()
+        self.assertTrue(self.cache.remove('key'))
+
+    def test_evicts_least_recently_used_first(self):
+        self.cache.create('old', self.populate_with('foo')).release()
+        self.cache.create('new', self.populate_with('bar')).release()
+        os.utime(os.path.join(self.dirname, 'old'), (1, 1))
+        size = dict((key, size)
+                    for key, size, last_used in self.cache.list_contents())
+        freed = self.cache.evict(size['new'])
+        self.assertEqual(freed, size['old'])
+        self.assertEqual(self.cache.open('old'), None)
+        self.cache.open('new').release()
+
+    def test_eviction_skips_entries_in_use(self):
+        entry = self.cache.create('key', self.populate_with('foo'))
+        self.assertEqual(self.cache.evict(0), 0)
+        entry.release()
+
+    def test_create_keeps_cache_within_max_size(self):
+        self.cache.max_size = 0
+        self.cache.create('old', self.populate_with('foo')).release()
+        entry = self.cache.create('new', self.populate_with('bar'))
+        self.assertEqual(self.cache.open('old'), None)
+        entry.release()
+
+    def test_disk_usage_counts_hardlinked_files_once(self):
+        src = os.path.join(self.tempdir, 'src')
+        with open(src, 'w') as f:
+            f.write('x' * 65536)
+
+        def populate(root):
+            os.link(src, os.path.join(root, 'linked'))
+            os.link(src, os.path.join(root, 'linked-again'))
+
+        entry = self.cache.create('key', populate)
+        size = morphlib.dircache.disk_usage(entry.root)
+        self.assertTrue(65536 <= size < 2 * 65536)
+        entry.release()
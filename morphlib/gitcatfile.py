@@ -0,0 +1,264 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import cliapp
+import collections
+import logging
+import os
+import subprocess
+import threading
+import weakref
+
+
+# How many CatFile objects may have git processes running at once. Each
+# has up to two, with two pipes each. Repositories stay open for as long
+# as Morph runs, so without a limit, resolving definitions that use
+# hundreds of repositories would leave hundreds of processes running.
+MAX_RUNNING = 16
+
+# CatFile objects with processes running, least recently used first.
+_running = collections.OrderedDict()
+_running_lock = threading.Lock()
+
+
+def _used(cat_file):
+    '''Record that cat_file was used, and stop the least recently used.'''
+
+    with _running_lock:
+        _running.pop(id(cat_file), None)
+        _running[id(cat_file)] = weakref.ref(cat_file)
+        victims = []
+        while len(_running) > MAX_RUNNING:
+            key, ref = _running.popitem(last=False)
+            victims.append(ref())
+    # Stop them without holding the lock, as they may be in the middle of
+    # a lookup, and will want the lock when it finishes.
+    for victim in victims:
+        if victim is not None:
+            victim.close()
+
+
+def _stopped(cat_file):
+    with _running_lock:
+        _running.pop(id(cat_file), None)
+
+
+class CatFileError(cliapp.AppException):
+
+    def __init__(self, dirname, msg):
+        cliapp.AppException.__init__(
+            self, 'Reading objects from git repository %s failed: %s' %
+                  (dirname, msg))
+
+
+class CatFile(object):
+
+    '''Read objects from a git repository without a fork per lookup.
+
+    This keeps a `git cat-file --batch` process, and a `--batch-check`
+    process for lookups that don't need the contents, running for as long
+    as the object is in use. Objects can be named by anything that
+    `git rev-parse` understands, such as `master^{tree}` or
+    `SHA1:path/to/file`. Several lookups can be sent down the pipe at
+    once with the `*_many` methods.
+
+    It is safe to use from several threads. The processes are restarted
+    by the next lookup after close(). Only MAX_RUNNING CatFile objects
+    have processes running at once: the one that was used least recently
+    is closed when another one starts.
+
+    '''
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self._lock = threading.Lock()
+        self._processes = {}
+
+    def __del__(self):
+        # The list of running CatFile objects only has a weak reference
+        # to this one, which is dropped by itself.
+        self._stop_all()
+
+    def close(self):
+        '''Stop the git processes, if they are running.'''
+
+        self._stop_all()
+        _stopped(self)
+
+    def _stop_all(self):
+        with self._lock:
+            for option, process in self._processes.items():
+                self._stop(process)
+            self._processes = {}
+
+    @staticmethod
+    def _stop(process):
+        try:
+            process.stdin.close()
+        except IOError:  # pragma: no cover
+            pass
+        process.wait()
+        process.stdout.close()
+
+    def _process(self, option):
+        process = self._processes.get(option)
+        if process is None:
+            logging.debug('Starting git cat-file %s in %s',
+                          option, self.dirname)
+            with open(os.devnull, 'w') as devnull:
+                process = subprocess.Popen(
+                    ['git', 'cat-file', option], cwd=self.dirname,
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                    stderr=devnull, close_fds=True)
+            self._processes[option] = process
+        return process
+
+    def _lookup_many(self, option, names):
+        try:
+            with self._lock:
+                process = self._process(option)
+                try:
+                    return self._send_and_receive(process, option, names)
+                except (IOError, OSError, ValueError) as e:
+                    # Leave the broken process for the next lookup to
+                    # replace.
+                    del self._processes[option]
+                    self._stop(process)
+                    raise CatFileError(self.dirname, e)
+        finally:
+            _used(self)
+
+    @staticmethod
+    def _kill(process):
+        try:
+            process.kill()
+        except OSError:  # pragma: no cover
+            # It has already exited.
+            pass
+
+    def _send_and_receive(self, process, option, names):
+        # Names with line breaks would break the protocol, and can't name
+        # an object anyway, so don't send them.
+        sendable = [name for name in names if '\n' not in name]
+
+        def send():
+            try:
+                process.stdin.write(''.join('%s\n' % n for n in sendable))
+                process.stdin.flush()
+            except IOError:
+                # git has gone away, so reading its answers will fail.
+                pass
+
+        # Answers come back while the names are still being written, so
+        # write them from another thread if the pipes could fill up.
+        if len(sendable) > 1:
+            writer = threading.Thread(target=send)
+            writer.start()
+        else:
+            writer = None
+            send()
+
+        answers = {}
+        try:
+            for name in sendable:
+                answers[name] = self._receive(process, option)
+        except BaseException:
+            # The writer may be stuck on a full pipe, with git stuck on
+            # a full pipe of answers that will now never be read, so kill
+            # git to let the writer finish.
+            self._kill(process)
+            raise
+        finally:
+            if writer is not None:
+                writer.join()
+        return [answers.get(name) for name in names]
+
+    def _receive(self, process, option):
+        header = process.stdout.readline()
+        if not header.endswith('\n'):
+            raise IOError('git cat-file exited unexpectedly')
+        fields = header.split()
+        if len(fields) != 3:
+            # '<name> missing' or '<name> ambiguous'
+            return None
+        sha1, kind, size = fields[0], fields[1], int(fields[2])
+        if option == '--batch-check':
+            return sha1, kind, size
+        contents = process.stdout.read(size)
+        if len(contents) != size or process.stdout.read(1) != '\n':
+            raise IOError('git cat-file exited unexpectedly')
+        return sha1, kind, contents
+
+    def info_many(self, names):
+        '''Look up objects by name, without reading their contents.
+
+        Returns a list with a `(sha1, kind, size)` tuple for every name,
+        or None for names that don't name an object.
+
+        '''
+
+        return self._lookup_many('--batch-check', names)
+
+    def info(self, name):
+        return self.info_many([name])[0]
+
+    def read_many(self, names):
+        '''Read objects by name.
+
+        Returns a list with a `(sha1, kind, contents)` tuple for every
+        name, or None for names that don't name an object.
+
+        '''
+
+        return self._lookup_many('--batch', names)
+
+    def read(self, name):
+        return self.read_many([name])[0]
+
+    @staticmethod
+    def parse_tree(contents):
+        '''Return the `(mode, name, sha1)` entries of a tree object.'''
+
+        entries = []
+        pos = 0
+        while pos < len(contents):
+            space = contents.index(' ', pos)
+            nul = contents.index('\0', space)
+            sha1 = contents[nul + 1:nul + 21].encode('hex')
+            entries.append((contents[pos:space].rjust(6, '0'),
+                            contents[space + 1:nul], sha1))
+            pos = nul + 21
+        return entries
+
+    def tree_entry(self, treeish, path):
+        '''Return the `(mode, name, sha1)` entry for path in a tree.
+
+        Returns None if there is no such path.
+
+        '''
+
+        dirname, basename = os.path.split(path.strip('/'))
+        if not basename:
+            return None
+        if dirname:
+            parent = self.read('%s:%s' % (treeish, dirname))
+        else:
+            parent = self.read('%s^{tree}' % treeish)
+        if parent is None or parent[1] != 'tree':
+            return None
+        for entry in self.parse_tree(parent[2]):
+            if entry[1] == basename:
+                return entry
+        return None
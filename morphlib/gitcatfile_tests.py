@@ -0,0 +1,177 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import StringIO
+import tempfile
+import threading
+import time
+import unittest
+
+import morphlib
+
+
+class CatFileTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.dirname = os.path.join(self.tempdir, 'foo')
+        os.mkdir(self.dirname)
+        gd = morphlib.gitdir.init(self.dirname)
+        os.mkdir(os.path.join(self.dirname, 'dir'))
+        with open(os.path.join(self.dirname, 'dir', 'file'), 'w') as f:
+            f.write('file contents')
+        os.symlink('dir/file', os.path.join(self.dirname, 'link'))
+        morphlib.git.gitcmd(gd._runcmd, 'add', '.')
+        morphlib.git.gitcmd(gd._runcmd, 'commit', '-m', 'Initial commit')
+        self.commit = morphlib.git.gitcmd(
+            gd._runcmd, 'rev-parse', 'HEAD').strip()
+        self.cat_file = morphlib.gitcatfile.CatFile(self.dirname)
+
+    def tearDown(self):
+        self.cat_file.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_resolves_ref(self):
+        sha1, kind, size = self.cat_file.info('master^{commit}')
+        self.assertEqual(sha1, self.commit)
+        self.assertEqual(kind, 'commit')
+
+    def test_returns_none_for_missing_object(self):
+        self.assertEqual(self.cat_file.info('no-such-ref'), None)
+        self.assertEqual(self.cat_file.read('master:no-such-file'), None)
+
+    def test_reads_blob(self):
+        sha1, kind, contents = self.cat_file.read('master:dir/file')
+        self.assertEqual(kind, 'blob')
+        self.assertEqual(contents, 'file contents')
+
+    def test_looks_up_many_objects_at_once(self):
+        names = ['master:dir/file', 'missing', 'master^{tree}'] * 1000
+        results = self.cat_file.read_many(names)
+        self.assertEqual(len(results), len(names))
+        self.assertEqual(results[0][2], 'file contents')
+        self.assertEqual(results[1], None)
+        self.assertEqual(results[-1][1], 'tree')
+
+    def test_does_not_send_names_with_line_breaks(self):
+        self.assertEqual(self.cat_file.info_many(['master\nmaster']), [None])
+        self.assertNotEqual(self.cat_file.info('master'), None)
+
+    def test_restarts_after_close(self):
+        self.cat_file.info('master')
+        self.cat_file.close()
+        self.assertNotEqual(self.cat_file.info('master'), None)
+
+    def test_finds_tree_entries(self):
+        mode, name, sha1 = self.cat_file.tree_entry('master', 'link')
+        self.assertEqual(mode, '120000')
+        mode, name, sha1 = self.cat_file.tree_entry('master', 'dir')
+        self.assertEqual(mode, '040000')
+        mode, name, sha1 = self.cat_file.tree_entry('master', 'dir/file')
+        self.assertEqual((mode, name), ('100644', 'file'))
+        self.assertEqual(self.cat_file.tree_entry('master', 'missing'), None)
+        self.assertEqual(self.cat_file.tree_entry('master', 'link/x'), None)
+        self.assertEqual(self.cat_file.tree_entry('master', '/'), None)
+
+    def test_stops_processes_when_deleted(self):
+        cat_file = morphlib.gitcatfile.CatFile(self.dirname)
+        cat_file.info('master')
+        process = cat_file._processes['--batch-check']
+        del cat_file
+        self.assertNotEqual(process.returncode, None)
+
+    def test_reports_failure_to_read_repository(self):
+        cat_file = morphlib.gitcatfile.CatFile(self.tempdir)
+        self.assertRaises(morphlib.gitcatfile.CatFileError,
+                          cat_file.info, 'master')
+        cat_file.close()
+
+    def test_reports_truncated_objects(self):
+        class FakeProcess(object):
+            stdout = StringIO.StringIO('%s blob 100\nshort\n' % self.commit)
+
+        self.assertRaises(IOError, self.cat_file._receive,
+                          FakeProcess(), '--batch')
+
+    def test_reports_process_exiting_without_answer(self):
+        class FakeProcess(object):
+            stdout = StringIO.StringIO('')
+
+        self.assertRaises(IOError, self.cat_file._receive,
+                          FakeProcess(), '--batch-check')
+
+    def test_does_not_hang_when_reading_answers_fails(self):
+        # Enough names that git blocks writing answers nobody reads, and
+        # so the writer blocks writing names git does not read.
+        names = ['master^{tree}'] * 100000
+
+        def fail(process, option):
+            # Give both pipes time to fill up.
+            time.sleep(1)
+            raise IOError('failed to read answer')
+
+        self.cat_file._receive = fail
+        errors = []
+
+        def lookup():
+            try:
+                self.cat_file.read_many(names)
+            except morphlib.gitcatfile.CatFileError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=lookup)
+        thread.daemon = True
+        thread.start()
+        thread.join(60)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(self.cat_file._processes, {})
+
+    def test_limits_how_many_have_processes_running(self):
+        old_max = morphlib.gitcatfile.MAX_RUNNING
+        morphlib.gitcatfile.MAX_RUNNING = 2
+        try:
+            cat_files = [morphlib.gitcatfile.CatFile(self.dirname)
+                         for i in range(3)]
+            for cat_file in cat_files:
+                cat_file.info('master')
+            self.assertEqual(cat_files[0]._processes, {})
+            self.assertNotEqual(cat_files[1]._processes, {})
+            self.assertNotEqual(cat_files[2]._processes, {})
+
+            # Using one makes it the most recently used.
+            cat_files[1].info('master')
+            cat_files[0].info('master')
+            self.assertEqual(cat_files[2]._processes, {})
+            self.assertNotEqual(cat_files[1]._processes, {})
+            self.assertNotEqual(cat_files[0].info('master'), None)
+        finally:
+            morphlib.gitcatfile.MAX_RUNNING = old_max
+            for cat_file in cat_files:
+                cat_file.close()
+
+    def test_forgets_cat_files_that_are_deleted(self):
+        old_max = morphlib.gitcatfile.MAX_RUNNING
+        morphlib.gitcatfile.MAX_RUNNING = 1
+        try:
+            cat_file = morphlib.gitcatfile.CatFile(self.dirname)
+            cat_file.info('master')
+            del cat_file
+            self.cat_file.info('master')
+            self.assertNotEqual(self.cat_file._processes, {})
+        finally:
+            morphlib.gitcatfile.MAX_RUNNING = old_max
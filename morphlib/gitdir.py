@@ -1,4 +1,4 @@
-# Copyright (C) 2013-2015  Codethink Limited
+# Copyright (C) 2013-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -439,6 +439,7 @@ class GitDirectory(object):
 
         self.dirname = dirname
         self.config = Config(config_file=None, runcmd=self._runcmd)
+        self.cat_file = morphlib.gitcatfile.CatFile(dirname)
 
         if not allow_missing:
             self._ensure_is_git_repo()
@@ -518,12 +519,18 @@ class GitDirectory(object):
 
     def get_blob_contents(self, blob_id): # pragma: no cover
         '''Get file contents from git by ID'''
-        return morphlib.git.gitcmd(self._runcmd, 'cat-file', 'blob', blob_id)
+        return self._read_object(blob_id, 'blob')
 
     def get_commit_contents(self, commit_id): # pragma: no cover
         '''Get commit contents from git by ID'''
-        return morphlib.git.gitcmd(self._runcmd, 'cat-file', 'commit',
-                                   commit_id)
+        return self._read_object('%s^{commit}' % commit_id, 'commit')
+
+    def _read_object(self, name, kind):
+        obj = self.cat_file.read(name)
+        if obj is None or obj[1] != kind:
+            raise morphlib.gitcatfile.CatFileError(
+                self.dirname, '%s is not a %s' % (name, kind))
+        return obj[2]
 
     def update_submodules(self, app): # pragma: no cover
         '''Change .gitmodules URLs, and checkout submodules.'''
@@ -560,6 +567,8 @@ class GitDirectory(object):
         '''Run "git remote update --prune".'''
         morphlib.git.gitcmd(self._runcmd, 'remote', 'update', '--prune',
                             echo_stderr=echo_stderr)
+        # Start afresh with the new packs.
+        self.cat_file.close()
 
     def is_bare(self):
         '''Determine whether the repository has no work tree (is bare)'''
@@ -583,11 +592,10 @@ class GitDirectory(object):
             return self._list_files_in_ref(ref, recurse)
 
     def _rev_parse(self, ref):
-        try:
-            return morphlib.git.gitcmd(self._runcmd, 'rev-parse',
-                                       '--verify', ref).strip()
-        except cliapp.AppException as e:
+        info = self.cat_file.info(ref)
+        if info is None:
             raise InvalidRefError(self, ref)
+        return info[0]
 
     def get_upstream_of_branch(self, branch): # pragma: no cover
         try:
@@ -632,18 +640,27 @@ class GitDirectory(object):
                 yield os.path.relpath(filepath, start=self.dirname)
 
     def _list_files_in_ref(self, ref, recurse=True):
-        tree = self.resolve_ref_to_tree(ref)
-
-        command = ['ls-tree', '--name-only', '-z']
-        if recurse:
-            command.append('-r')
-        command.append(tree)
-
-        output = morphlib.git.gitcmd(self._runcmd, *command)
-        # ls-tree appends \0 instead of interspersing, so we need to
-        # strip the trailing \0 before splitting
-        paths = output.strip('\0').split('\0')
-        return paths
+        # Read the trees a level at a time, with all the trees of a level
+        # sent down the cat-file pipe at once.
+        trees = [('', self.resolve_ref_to_tree(ref))]
+        paths = []
+        while trees:
+            objects = self.cat_file.read_many(
+                [sha1 for prefix, sha1 in trees])
+            subtrees = []
+            for (prefix, sha1), obj in zip(trees, objects):
+                if obj is None or obj[1] != 'tree':  # pragma: no cover
+                    raise morphlib.gitcatfile.CatFileError(
+                        self.dirname, '%s is not a tree' % sha1)
+                for mode, name, entry_sha1 in self.cat_file.parse_tree(
+                        obj[2]):
+                    path = prefix + name
+                    if recurse and mode == '040000':
+                        subtrees.append((path + '/', entry_sha1))
+                    else:
+                        paths.append(path)
+            trees = subtrees
+        return sorted(paths)
 
     def read_file(self, filename, ref=None):
         '''Attempts to read a file, from the working tree or a given ref.
@@ -665,16 +682,40 @@ class GitDirectory(object):
             raise IOError('File %s does not exist in ref %s of repo %s' %
                           (filename, ref, self))
 
+    def read_files(self, filenames, ref=None):
+        '''Read several files, from the working tree or a given ref.
+
+        Returns a list with the contents of each file, or None for files
+        that do not exist. Files in a ref are all read with one request
+        to git. Raises an InvalidRefError if the ref is not found in the
+        repository.
+
+        '''
+
+        if ref is None and self.is_bare():
+            raise NoWorkingTreeError(self)
+        if ref is None:
+            contents = []
+            for filename in filenames:
+                try:
+                    contents.append(self.read_file(filename))
+                except IOError:
+                    contents.append(None)
+            return contents
+        tree = self.resolve_ref_to_tree(ref)
+        objects = self.cat_file.read_many(
+            ['%s:%s' % (tree, filename) for filename in filenames])
+        return [obj[2] if obj is not None and obj[1] == 'blob' else None
+                for obj in objects]
+
     def is_symlink(self, filename, ref=None):
         if ref is None and self.is_bare():
             raise NoWorkingTreeError(self)
         if ref is None:
             filepath = os.path.join(self.dirname, filename.lstrip('/'))
             return os.path.islink(filepath)
-        tree_entry = morphlib.git.gitcmd(self._runcmd, 'ls-tree', ref,
-                                         filename)
-        file_mode = tree_entry.split(' ', 1)[0]
-        return file_mode == '120000'
+        tree_entry = self.cat_file.tree_entry(ref, filename)
+        return tree_entry is not None and tree_entry[0] == '120000'
 
     @property
     def HEAD(self):
@@ -1,4 +1,4 @@
-# Copyright (C) 2013-2015  Codethink Limited
+# Copyright (C) 2013-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -204,6 +204,42 @@ class GitDirectoryContentsTests(unittest.TestCase):
             self.assertEqual(gd.read_file('bar.morph', 'master'),
                              'dummy morphology text')
 
+    def test_lists_files_in_subdirectories_of_ref(self):
+        gd = morphlib.gitdir.GitDirectory(self.dirname)
+        os.makedirs(os.path.join(self.dirname, 'a', 'b'))
+        for path in ('a/one', 'a/b/two'):
+            with open(os.path.join(self.dirname, path), 'w') as f:
+                f.write(path)
+        morphlib.git.gitcmd(gd._runcmd, 'add', 'a')
+        morphlib.git.gitcmd(gd._runcmd, 'commit', '-m', 'Add a')
+        self.assertEqual(gd.list_files('HEAD'),
+                         ['a/b/two', 'a/one', 'bar.morph', 'baz.morph',
+                          'foo', 'quux'])
+        self.assertEqual(gd.list_files('HEAD', recurse=False),
+                         ['a', 'bar.morph', 'baz.morph', 'foo', 'quux'])
+
+    def test_reads_many_files_in_ref(self):
+        for gitdir in (self.dirname, self.mirror):
+            gd = morphlib.gitdir.GitDirectory(gitdir)
+            self.assertEqual(
+                gd.read_files(['bar.morph', 'missing', 'quux'], 'HEAD'),
+                ['dummy morphology text', None, 'dummy morphology text'])
+
+    def test_reads_many_files_in_work_tree(self):
+        gd = morphlib.gitdir.GitDirectory(self.dirname)
+        self.assertEqual(gd.read_files(['foo.morph', 'foo']),
+                         ['dummy morphology text', None])
+
+    def test_read_many_raises_no_ref_no_work_tree(self):
+        gd = morphlib.gitdir.GitDirectory(self.mirror)
+        self.assertRaises(morphlib.gitdir.NoWorkingTreeError,
+                          gd.read_files, ['bar.morph'])
+
+    def test_read_many_raises_invalid_ref(self):
+        gd = morphlib.gitdir.GitDirectory(self.dirname)
+        self.assertRaises(morphlib.gitdir.InvalidRefError,
+                          gd.read_files, ['bar'], 'no-such-ref')
+
     def test_list_raises_invalid_ref(self):
         gd = morphlib.gitdir.GitDirectory(self.dirname)
         self.assertRaises(morphlib.gitdir.InvalidRefError,
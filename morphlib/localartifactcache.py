@@ -1,4 +1,4 @@
-# Copyright (C) 2012, 2013, 2014-2015  Codethink Limited
+# Copyright (C) 2012, 2013, 2014-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -14,10 +14,32 @@
 
 
 import collections
+import logging
 import os
+import threading
 import time
 
 import morphlib
+from morphlib.savefile import SaveFile
+
+
+# The index of the files in the cache lives in the cache directory. Its
+# name starts with a dot so that it is not taken for a cache file.
+INDEX_FILENAME = '.index.sqlite'
+
+
+class IndexedSaveFile(SaveFile):
+
+    '''A SaveFile that is added to the cache index when it is saved.'''
+
+    def __init__(self, filename, index, *args, **kwargs):
+        SaveFile.__init__(self, filename, *args, **kwargs)
+        self._index = index
+
+    def close(self):
+        ret = SaveFile.close(self)
+        self._index.add(os.path.basename(self.real_filename))
+        return ret
 
 
 class LocalArtifactCache(object):
@@ -26,11 +48,11 @@ class LocalArtifactCache(object):
        It provides methods for getting a file handle to cached artifacts
        so that the layout of the cache need not be known.
 
-       It also updates modification times of artifacts so that it can track
-       when they were last used, so it can be requested to clean up if
-       disk space is low.
+       It also keeps an index of the files in the cache, with their sizes
+       and when they were last used, so it can be requested to clean up if
+       disk space is low without looking at every file.
 
-       Modification time is updated in both the get and has methods.
+       The last-used time is updated in both the get and has methods.
 
        NOTE: Parts of the build assume that every artifact of a source is
        available, so all the artifacts of a source need to be removed together.
@@ -46,25 +68,35 @@ class LocalArtifactCache(object):
 
     def __init__(self, cachefs):
         self.cachefs = cachefs
+        self.index = morphlib.artifactcacheindex.ArtifactCacheIndex(
+            self._join(INDEX_FILENAME), self._join('/'))
+
+    def _put(self, filename):
+        return IndexedSaveFile(filename, self.index, mode='w')
 
     def put(self, artifact):
         filename = self.artifact_filename(artifact)
-        return morphlib.savefile.SaveFile(filename, mode='w')
+        return self._put(filename)
 
     def put_artifact_metadata(self, artifact, name):
         filename = self._artifact_metadata_filename(artifact, name)
-        return morphlib.savefile.SaveFile(filename, mode='w')
+        return self._put(filename)
 
     def put_source_metadata(self, source, cachekey, name):
         filename = self._source_metadata_filename(source, cachekey, name)
-        return morphlib.savefile.SaveFile(filename, mode='w')
+        return self._put(filename)
 
     def _has_file(self, filename):
         if os.path.exists(filename):
-            os.utime(filename, None)
+            self.index.use(os.path.basename(filename))
             return True
         return False
 
+    def _open(self, filename):
+        f = open(filename)
+        self.index.use(os.path.basename(filename))
+        return f
+
     def has(self, artifact):
         filename = self.artifact_filename(artifact)
         return self._has_file(filename)
@@ -79,21 +111,18 @@ class LocalArtifactCache(object):
 
     def get(self, artifact):
         filename = self.artifact_filename(artifact)
-        os.utime(filename, None)
-        return open(filename)
+        return self._open(filename)
 
     def get_artifact_metadata(self, artifact, name):
         filename = self._artifact_metadata_filename(artifact, name)
-        os.utime(filename, None)
-        return open(filename)
+        return self._open(filename)
 
     def get_source_metadata_filename(self, source, cachekey, name):
         return self._source_metadata_filename(source, cachekey, name)
 
     def get_source_metadata(self, source, cachekey, name):
         filename = self._source_metadata_filename(source, cachekey, name)
-        os.utime(filename, None)
-        return open(filename)
+        return self._open(filename)
 
     def _join(self, basename):
         '''Wrapper for pyfilesystem's getsyspath.
@@ -121,7 +150,9 @@ class LocalArtifactCache(object):
 
          '''
         for filename in self.cachefs.walkfiles():
-            self.cachefs.remove(filename)
+            if not os.path.basename(filename).startswith(INDEX_FILENAME):
+                self.cachefs.remove(filename)
+        self.index.clear()
 
     def list_contents(self):
         '''Return the set of sources cached and related information.
@@ -129,33 +160,100 @@ class LocalArtifactCache(object):
            returns a [(cache_key, set(artifacts), last_used)]
 
         '''
-        def is_artifact(filename):
-            # This is just enough to avoid crashes from random unpacked
-            # directory trees and temporary files in the cachedir. A
-            # better mechanism is needed. It's not simple to tell
-            # OSFS.walkfiles() to do a non-recursive walk, sadly.
-            return '.' in filename and '/' not in filename
-
         CacheInfo = collections.namedtuple('CacheInfo', ('artifacts', 'mtime'))
         contents = collections.defaultdict(lambda: CacheInfo(set(), 0))
-        for filename in self.cachefs.walkfiles():
-            # filenames are returned with a preceeding /.
-            filename = filename[1:]
-            if not is_artifact(filename):  # pragma: no cover
-                continue
-            cachekey = filename[:63]
-            artifact = filename[65:]
+        for cachekey, filename, size, last_used in self.index.contents():
             artifacts, max_mtime = contents[cachekey]
-            artifacts.add(artifact)
-            art_info = self.cachefs.getinfo(filename)
-            time_t = art_info['modified_time'].timetuple()
+            artifacts.add(filename[len(cachekey) + 1:])
             contents[cachekey] = CacheInfo(artifacts,
-                                           max(max_mtime, time.mktime(time_t)))
+                                           max(max_mtime, last_used))
         return ((cache_key, info.artifacts, info.mtime)
                 for cache_key, info in contents.iteritems())
 
     def remove(self, cachekey):
         '''Remove all artifacts associated with the given cachekey.'''
-        for filename in (x for x in self.cachefs.walkfiles()
-                         if x[1:].startswith(cachekey)):
-            self.cachefs.remove(filename)
+        for filename in self.index.remove(cachekey):
+            if self.cachefs.exists(filename):
+                self.cachefs.remove(filename)
+
+    def evict(self, max_size, keep=(), keep_younger_than=0):
+        '''Remove cache keys until the cache is under max_size bytes.
+
+        Cache keys are removed in order of their size multiplied by how
+        long it is since they were last used, so that a big artifact that
+        has not been used for a while goes before a small one that has
+        not been used for a bit longer.
+
+        Nothing is removed that was used less than keep_younger_than
+        seconds ago, or that this process has used, or that can be
+        reached from the cache keys in keep by the dependencies recorded
+        in the index. Returns the number of bytes freed.
+
+        '''
+
+        now = time.time()
+        keep = self.index.reachable(keep) | self.index.used_cache_keys()
+        contents = self.index.cache_keys()
+        total = sum(size for cachekey, size, last_used in contents)
+        candidates = sorted(
+            ((cachekey, size, last_used)
+             for cachekey, size, last_used in contents
+             if cachekey not in keep and
+                last_used < now - keep_younger_than),
+            key=lambda x: (now - x[2]) * x[1], reverse=True)
+        freed = 0
+        for cachekey, size, last_used in candidates:
+            if total - freed <= max_size:
+                break
+            logging.debug('Evicting %s from the artifact cache', cachekey)
+            self.remove(cachekey)
+            freed += size
+        return freed
+
+
+class BackgroundEvictor(object):
+
+    '''Keep a local artifact cache under a size in a background thread.
+
+    Every time poke() is called, LocalArtifactCache.evict() is run
+    again in the thread, with the arguments given here, unless it is
+    already running, in which case it is run once more when it finishes.
+    Errors are logged and otherwise ignored, as the build can carry on
+    without the cache being smaller.
+
+    '''
+
+    def __init__(self, lac, max_size, keep=(), keep_younger_than=0):
+        self._lac = lac
+        self._args = (max_size, keep, keep_younger_than)
+        self._wakeup = threading.Event()
+        self._wanted = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def poke(self):
+        self._wanted = True
+        self._wakeup.set()
+
+    def close(self):
+        '''Stop, after finishing any eviction that was asked for.'''
+
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            if self._wanted:
+                self._wanted = False
+                try:
+                    self._lac.evict(*self._args)
+                except Exception as e:
+                    logging.warning('Failed to make space in the artifact '
+                                    'cache: %s', e)
+            if self._closed:
+                break
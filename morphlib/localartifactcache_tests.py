@@ -1,4 +1,4 @@
-# Copyright (C) 2012,2014-2015  Codethink Limited
+# Copyright (C) 2012,2014-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -13,8 +13,9 @@
 # with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import unittest
 import os
+import time
+import unittest
 
 import fs.tempfs
 
@@ -189,3 +190,125 @@ class LocalArtifactCacheTests(unittest.TestCase):
         cache.remove(key)
 
         self.assertEqual(len(list(cache.list_contents())), 0)
+
+    def test_remakes_index_if_it_is_deleted(self):
+        cache = morphlib.localartifactcache.LocalArtifactCache(self.tempfs)
+
+        handle = cache.put(self.runtime_artifact)
+        handle.write('runtime')
+        handle.close()
+        cache.index.close()
+
+        self.tempfs.remove(morphlib.localartifactcache.INDEX_FILENAME)
+        cache = morphlib.localartifactcache.LocalArtifactCache(self.tempfs)
+
+        keys = [key for key, artifacts, mtime in cache.list_contents()]
+        self.assertEqual(keys, [self.source.cache_key])
+        self.assertTrue(cache.has(self.runtime_artifact))
+
+    def test_remove_does_not_mind_files_that_are_already_gone(self):
+        cache = morphlib.localartifactcache.LocalArtifactCache(self.tempfs)
+
+        handle = cache.put(self.runtime_artifact)
+        handle.write('runtime')
+        handle.close()
+
+        self.tempfs.remove(self.runtime_artifact.basename())
+        cache.remove(self.source.cache_key)
+
+        self.assertEqual(list(cache.list_contents()), [])
+
+
+class EvictionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempfs = fs.tempfs.TempFS()
+        self.cache = morphlib.localartifactcache.LocalArtifactCache(
+            self.tempfs)
+        self.now = time.time()
+
+    def tearDown(self):
+        self.cache.index.close()
+        self.tempfs.close()
+
+    def put(self, cachekey, size, age):
+        basename = '%s.chunk.foo' % cachekey
+        with self.tempfs.open(basename, 'wb') as f:
+            f.write('x' * size)
+        self.cache.index.add(basename)
+        self.cache.index._db.execute(
+            'UPDATE files SET last_used = ? WHERE cachekey = ?',
+            (int(self.now - age), cachekey))
+        self.cache.index._db.commit()
+
+    def cached(self):
+        return sorted(cachekey for cachekey, artifacts, last_used
+                      in self.cache.list_contents())
+
+    def fresh_cache(self):
+        '''Forget which files were used, as another process would.'''
+        self.cache.index.close()
+        self.cache = morphlib.localartifactcache.LocalArtifactCache(
+            self.tempfs)
+
+    def test_removes_big_unused_artifacts_first(self):
+        self.put('small-old', 10, 1000)
+        self.put('big-old', 100, 500)
+        self.put('big-new', 100, 10)
+        self.fresh_cache()
+        self.assertEqual(self.cache.evict(150), 100)
+        self.assertEqual(self.cached(), ['big-new', 'small-old'])
+        self.assertFalse(self.tempfs.exists('big-old.chunk.foo'))
+        self.assertEqual(self.cache.evict(150), 0)
+        self.assertEqual(self.cache.evict(0), 110)
+        self.assertEqual(self.cached(), [])
+
+    def test_keeps_what_pinned_cache_keys_were_built_from(self):
+        self.put('system', 10, 1000)
+        self.put('chunk', 10, 1000)
+        self.put('other', 10, 1000)
+        self.cache.index.add_dependencies([('system', 'chunk')])
+        self.fresh_cache()
+        self.assertEqual(self.cache.evict(0, keep=['system']), 10)
+        self.assertEqual(self.cached(), ['chunk', 'system'])
+
+    def test_keeps_recently_used_artifacts(self):
+        self.put('old', 10, 1000)
+        self.put('new', 10, 10)
+        self.fresh_cache()
+        self.cache.evict(0, keep_younger_than=100)
+        self.assertEqual(self.cached(), ['new'])
+
+    def test_keeps_artifacts_used_by_this_process(self):
+        self.put('used', 10, 1000)
+        self.put('unused', 10, 1000)
+        self.fresh_cache()
+        self.cache.index.use('used.chunk.foo')
+        self.cache.evict(0)
+        self.assertEqual(self.cached(), ['used'])
+
+    def test_evicts_in_background(self):
+        self.put('old', 10, 1000)
+        self.fresh_cache()
+        evictor = morphlib.localartifactcache.BackgroundEvictor(
+            self.cache, 0)
+        evictor.poke()
+        evictor.close()
+        self.assertEqual(self.cached(), [])
+
+    def test_background_eviction_carries_on_after_errors(self):
+        calls = []
+
+        def evict(*args):
+            calls.append(args)
+            raise OSError('disk on fire')
+
+        self.cache.evict = evict
+        evictor = morphlib.localartifactcache.BackgroundEvictor(
+            self.cache, 5, keep=['x'], keep_younger_than=7)
+        evictor.poke()
+        while not calls:
+            time.sleep(0.01)
+        evictor.poke()
+        evictor.close()
+        self.assertEqual(calls, [(5, ['x'], 7)] * 2)
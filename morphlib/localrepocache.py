@@ -1,4 +1,4 @@
-# Copyright (C) 2012-2015  Codethink Limited
+# Copyright (C) 2012-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -189,7 +189,8 @@ class LocalRepoCache(object):
         '''
         errors = []
         if not self.fs.exists(self._cachedir):
-            self.fs.makedir(self._cachedir, recursive=True)
+            self.fs.makedir(self._cachedir, recursive=True,
+                            allow_recreate=True)
 
         try:
             return self.get_repo(reponame)
@@ -1,4 +1,4 @@
-# Copyright (C) 2013-2015  Codethink Limited
+# Copyright (C) 2013-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -22,6 +22,14 @@ import yaml
 import morphlib
 
 
+# The LibYAML parser is much faster than the pure Python one, but it is
+# not always installed.
+try:
+    SafeLoader = yaml.CSafeLoader
+except AttributeError:  # pragma: no cover
+    SafeLoader = yaml.SafeLoader
+
+
 class MorphologyObsoleteFieldWarning(UserWarning):
 
     def __init__(self, morphology, spec, field):
@@ -411,8 +419,9 @@ class MorphologyLoader(object):
     }
 
     def __init__(self,
-                 predefined_build_systems={}):
+                 predefined_build_systems={}, cache=None):
         self._predefined_build_systems = predefined_build_systems.copy()
+        self._cache = cache
 
         if 'manual' not in self._predefined_build_systems:
             self._predefined_build_systems['manual'] = \
@@ -432,7 +441,7 @@ class MorphologyLoader(object):
         '''
 
         try:
-            obj = yaml.safe_load(text)
+            obj = yaml.load(text, Loader=SafeLoader)
         except yaml.error.YAMLError as e:
             raise MorphologyNotYamlError(morph_filename, e)
 
@@ -447,17 +456,27 @@ class MorphologyLoader(object):
                          filename='string'):  # pragma: no cover
         '''Load a morphology from a string.
 
-        Return the Morphology object.
+        Return the Morphology object. If the loader has a
+        MorphologyCache, the result is looked up there first, and saved
+        there if it was not found.
 
         '''
 
         if string is None:
             return None
 
+        if self._cache is not None:
+            m = self._cache.get(string, filename)
+            if m is not None:
+                return m
+
         m = self.parse_morphology_text(string, filename)
         self.validate(m)
         self.set_commands(m)
         self.set_defaults(m)
+
+        if self._cache is not None:
+            self._cache.put(string, filename, m)
         return m
 
     def load_from_file(self, filename):
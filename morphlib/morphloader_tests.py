@@ -1,4 +1,4 @@
-# Copyright (C) 2013-2015  Codethink Limited
+# Copyright (C) 2013-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -514,6 +514,21 @@ build-system: manual
         self.assertEqual(morph['name'], 'foo')
         self.assertEqual(morph['build-system'], 'manual')
 
+    def test_loads_through_cache(self):
+        string = '''\
+name: foo
+kind: chunk
+build-system: manual
+'''
+        cache = morphlib.morphologycache.MorphologyCache(
+            os.path.join(self.tempdir, 'cache'))
+        loader = morphlib.morphloader.MorphologyLoader(cache=cache)
+        first = loader.load_from_string(string, 'foo.morph')
+        self.assertNotEqual(cache.get(string, 'foo.morph'), None)
+        second = loader.load_from_string(string, 'foo.morph')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(second.filename, 'foo.morph')
+
     def test_loads_from_file(self):
         with open(self.filename, 'w') as f:
             f.write('''\
@@ -0,0 +1,93 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import cPickle
+import hashlib
+import logging
+import os
+
+import morphlib
+import morphlib.gitversion
+
+
+def blob_sha1(text):
+    '''Return the SHA1 that git would give a blob containing ``text``.'''
+
+    return hashlib.sha1('blob %d\0%s' % (len(text), text)).hexdigest()
+
+
+class MorphologyCache(object):
+
+    '''On-disk cache of loaded morphologies.
+
+    Loading a morphology means parsing its YAML, validating it and filling
+    in defaults, which Morph does for hundreds of identical files on every
+    run. This cache keeps the result, keyed by the git blob SHA1 of the
+    text and its filename, so that it is only done once.
+
+    The result also depends on the version of Morph doing the loading and
+    on the definitions' DEFAULTS file and format version, which the
+    caller passes as ``context``. Entries for a different context are
+    never looked at.
+
+    '''
+
+    # Change this to throw away every cached morphology, for example if
+    # the format of Morphology objects changes.
+    format_version = 1
+
+    def __init__(self, dirname, context=''):
+        self.dirname = dirname
+        salt = hashlib.sha1()
+        salt.update('format=%d\n' % self.format_version)
+        salt.update('morph=%s %s\n' % (morphlib.gitversion.version,
+                                       morphlib.gitversion.tree))
+        salt.update(context)
+        self._salt = salt.hexdigest()
+
+    def _path(self, text, filename):
+        key = hashlib.sha1('%s\n%s\n%s\n' % (self._salt, blob_sha1(text),
+                                             filename)).hexdigest()
+        return os.path.join(self.dirname, key[:2], key)
+
+    def get(self, text, filename):
+        '''Return the cached morphology for ``text``, or None.'''
+
+        path = self._path(text, filename)
+        try:
+            with open(path, 'rb') as f:
+                data = cPickle.load(f)
+        except IOError:
+            return None
+        except Exception as e:
+            # Unpickling garbage can raise almost anything.
+            logging.warning('Ignoring broken cached morphology %s: %s',
+                            path, e)
+            return None
+        m = morphlib.morphology.Morphology(data)
+        m.filename = filename
+        return m
+
+    def put(self, text, filename, morphology):
+        '''Save the loaded ``morphology`` for ``text``.'''
+
+        path = self._path(text, filename)
+        try:
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with morphlib.savefile.SaveFile(path, 'wb') as f:
+                cPickle.dump(morphology.data, f, cPickle.HIGHEST_PROTOCOL)
+        except (IOError, OSError, cPickle.PicklingError) as e:
+            logging.warning('Failed to cache morphology %s: %s', filename, e)
@@ -0,0 +1,75 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import morphlib
+
+
+class MorphologyCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache = morphlib.morphologycache.MorphologyCache(
+            self.tempdir, 'context')
+        self.text = 'name: foo\nkind: chunk\n'
+        self.morph = morphlib.morphology.Morphology(
+            {'name': 'foo', 'kind': 'chunk'})
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_blob_sha1_matches_git(self):
+        # echo 'hello world' | git hash-object --stdin
+        self.assertEqual(morphlib.morphologycache.blob_sha1('hello world\n'),
+                         '3b18e512dba79e4c8300dd08aeb37f8e728b8dad')
+
+    def test_returns_none_when_not_cached(self):
+        self.assertEqual(self.cache.get(self.text, 'foo.morph'), None)
+
+    def test_returns_cached_morphology(self):
+        self.cache.put(self.text, 'foo.morph', self.morph)
+        morph = self.cache.get(self.text, 'foo.morph')
+        self.assertEqual(morph.data, self.morph.data)
+        self.assertEqual(morph.filename, 'foo.morph')
+
+    def test_key_includes_filename(self):
+        self.cache.put(self.text, 'foo.morph', self.morph)
+        self.assertEqual(self.cache.get(self.text, 'bar.morph'), None)
+
+    def test_key_includes_context(self):
+        self.cache.put(self.text, 'foo.morph', self.morph)
+        other = morphlib.morphologycache.MorphologyCache(
+            self.tempdir, 'other context')
+        self.assertEqual(other.get(self.text, 'foo.morph'), None)
+
+    def test_ignores_broken_entries(self):
+        self.cache.put(self.text, 'foo.morph', self.morph)
+        for dirname, subdirs, basenames in os.walk(self.tempdir):
+            for basename in basenames:
+                with open(os.path.join(dirname, basename), 'w') as f:
+                    f.write('garbage')
+        self.assertEqual(self.cache.get(self.text, 'foo.morph'), None)
+
+    def test_ignores_failure_to_save(self):
+        filename = os.path.join(self.tempdir, 'file')
+        with open(filename, 'w'):
+            pass
+        cache = morphlib.morphologycache.MorphologyCache(filename, 'context')
+        cache.put(self.text, 'foo.morph', self.morph)
+        self.assertEqual(cache.get(self.text, 'foo.morph'), None)
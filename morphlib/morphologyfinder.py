@@ -1,4 +1,4 @@
-# Copyright (C) 2013-2015  Codethink Limited
+# Copyright (C) 2013-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -41,6 +41,22 @@ class MorphologyFinder(object):
             else:
                 raise
 
+    def read_files(self, filenames):
+        '''Return the text of several files inside the Git repo.
+
+        Raises IOError if any of them is missing.
+
+        '''
+
+        filenames = list(filenames)
+        texts = self.gitdir.read_files(filenames, self.ref)
+        for filename, text in zip(filenames, texts):
+            if text is None:
+                raise IOError(errno.ENOENT,
+                              'File %s does not exist in ref %s of repo %s' %
+                              (filename, self.ref, self.gitdir))
+        return texts
+
     def list_morphologies(self):
         '''Return the filenames of all morphologies in the (repo, ref).
 
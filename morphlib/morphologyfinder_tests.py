@@ -1,4 +1,4 @@
-# Copyright (C) 2013-2015  Codethink Limited
+# Copyright (C) 2013-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -68,6 +68,17 @@ class MorphologyFinderTests(unittest.TestCase):
         self.assertRaises(morphlib.gitdir.InvalidRefError,
                           mf.list_morphologies)
 
+    def test_reads_many_files_in_ref(self):
+        gd = morphlib.gitdir.GitDirectory(self.dirname)
+        mf = morphlib.morphologyfinder.MorphologyFinder(gd, 'HEAD')
+        self.assertEqual(mf.read_files(['bar.morph', 'foo']),
+                         ['dummy morphology text'] * 2)
+
+    def test_reading_many_files_raises_if_one_is_missing(self):
+        gd = morphlib.gitdir.GitDirectory(self.dirname)
+        mf = morphlib.morphologyfinder.MorphologyFinder(gd, 'HEAD')
+        self.assertRaises(IOError, mf.read_files, ['bar.morph', 'foo.morph'])
+
     def test_list_morphs_in_work_tree(self):
         gd = morphlib.gitdir.GitDirectory(self.dirname)
         mf = morphlib.morphologyfinder.MorphologyFinder(gd)
@@ -1,4 +1,4 @@
-# Copyright (C) 2012-2015 Codethink Limited
+# Copyright (C) 2012-2015,2026 Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -47,8 +47,13 @@ class ProjectVersionGuesser(object):
         if filenames:
             if self.lrc.has_repo(repo):
                 repository = self.lrc.get_repo(repo)
-                for filename in filenames:
-                    yield filename, repository.read_file(filename, ref)
+                texts = repository.read_files(filenames, ref)
+                for filename, text in zip(filenames, texts):
+                    if text is None:
+                        raise IOError(
+                            'File %s does not exist in ref %s of repo %s' %
+                            (filename, ref, repository))
+                    yield filename, text
             elif self.rrc:
                 for filename in filenames:
                     yield filename, self.rrc.cat_file(repo, ref, filename)
@@ -1,4 +1,4 @@
-# Copyright (C) 2014-2015  Codethink Limited
+# Copyright (C) 2014-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -72,7 +72,9 @@ class CertifyPlugin(cliapp.Plugin):
             self.lrc, self.rrc, repo, ref, [system_filename],
             cachedir=self.app.settings['cachedir'],
             update_repos = not self.app.settings['no-git-update'],
-            status_cb=self.app.status)
+            status_cb=self.app.status,
+            concurrent_git_updates=self.app.settings[
+                'concurrent-git-updates'])
 
         self.app.status(
             msg='Resolving artifacts for %s' % system_filename, chatty=True)
@@ -91,7 +93,8 @@ class CertifyPlugin(cliapp.Plugin):
             msg='Computing cache keys for %s' % system_filename, chatty=True)
         build_env = morphlib.buildenvironment.BuildEnvironment(
             self.app.settings, system_artifact.source.morphology['arch'])
-        ckc = morphlib.cachekeycomputer.CacheKeyComputer(build_env)
+        ckc = morphlib.cachekeycomputer.CacheKeyComputer(
+            build_env, self.app.settings['chunk-source-mode'])
 
         aliases = self.app.settings['repo-alias']
         resolver = morphlib.repoaliasresolver.RepoAliasResolver(aliases)
@@ -106,10 +106,11 @@ class DiffPlugin(cliapp.Plugin):
             # which case we instead use every we find.
             if not definitions:
                 definitions = mf.list_morphologies()
+            definitions = list(definitions)
             system_paths = set()
-            for definition in definitions:
-                m = ml.parse_morphology_text(mf.read_file(definition),
-                                             definition)
+            for definition, text in zip(definitions,
+                                        mf.read_files(definitions)):
+                m = ml.parse_morphology_text(text, definition)
                 if m.get('kind') == 'system' or 'strata' in m:
                     system_paths.add(definition)
             return reponame, ref, system_paths
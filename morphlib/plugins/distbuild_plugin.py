@@ -1,6 +1,6 @@
 # distbuild_plugin.py -- Morph distributed build plugin
 #
-# Copyright (C) 2014-2015  Codethink Limited
+# Copyright (C) 2014-2015,2026  Codethink Limited
 # 
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -240,6 +240,13 @@ class WorkerBuild(cliapp.Plugin):
         
         distbuild.add_crash_conditions(self.app.settings['crash-condition'])
 
+        # The worker runs this many builds at the same time, so each of
+        # them gets its share of the worker's make jobs.
+        build_slots = self.app.settings['worker-build-slots']
+        if build_slots > 1:
+            self.app.settings['max-jobs'] = max(
+                1, self.app.settings['max-jobs'] // build_slots)
+
         text = sys.stdin.readline()
         artifact_reference = distbuild.decode_artifact_reference(text)
 
@@ -249,11 +256,16 @@ class WorkerBuild(cliapp.Plugin):
                                             [artifact_reference.root_filename])
 
         root = bc.resolve_artifacts(source_pool)
+        bc.record_dependencies(bc.get_ordered_sources(root.walk()))
 
         # Now, before we start the build, we garbage collect the caches
         # to ensure we have room.  First we remove all system artifacts
-        # since we never need to recover those from workers post-hoc
+        # since we never need to recover those from workers post-hoc,
+        # unless they have been pinned.
+        keep = bc.lac.index.reachable(self.app.settings['artifact-cache-keep'])
         for cachekey, artifacts, last_used in bc.lac.list_contents():
+            if cachekey in keep:
+                continue
             if any(self.is_system_artifact(f) for f in artifacts):
                 logging.debug("Removing all artifacts for system %s" %
                         cachekey)
@@ -298,6 +310,14 @@ class WorkerDaemon(cliapp.Plugin):
             'write port used by worker-daemon to FILE',
             default='',
             group=group_distbuild)
+        self.app.settings.integer(
+            ['worker-build-slots'],
+            'run up to N builds on this worker at the same time, sharing '
+                'out max-jobs between them; the worker\'s distbuild-helper '
+                'needs to have at least as many slots (default: %default)',
+            metavar='N',
+            default=1,
+            group=group_distbuild)
         self.app.add_subcommand(
             'worker-daemon',
             self.worker_daemon,
@@ -314,7 +334,9 @@ class WorkerDaemon(cliapp.Plugin):
         address = self.app.settings['worker-daemon-address']
         port = self.app.settings['worker-daemon-port']
         port_file = self.app.settings['worker-daemon-port-file']
+        build_slots = self.app.settings['worker-build-slots']
         router = distbuild.ListenServer(address, port, distbuild.JsonRouter,
+                                        extra_args=[build_slots],
                                         port_file=port_file)
         loop = distbuild.MainLoop()
         loop.add_state_machine(router)
@@ -344,6 +366,11 @@ class ControllerDaemon(cliapp.Plugin):
             ['initiator-step-output-dir'],
             'write build output to files in DIR',
             group=group_distbuild)
+        self.app.settings.boolean(
+            ['initiator-summary-output'],
+            'only be told which build steps start, finish and fail, '
+                'without their output',
+            group=group_distbuild)
 
         self.app.settings.string(
             ['controller-helper-address'],
@@ -374,6 +401,13 @@ class ControllerDaemon(cliapp.Plugin):
             metavar='PORT',
             default=8080,
             group=group_distbuild)
+        self.app.settings.boolean(
+            ['ask-worker-info'],
+            'ask each worker how many builds it runs at once and which '
+                'artifact formats it understands; workers that are older '
+                'than this question drop the connection when asked, so '
+                'only set this once every worker has been upgraded',
+            group=group_distbuild)
         self.app.settings.string(
             ['writeable-cache-server'],
             'specify the shared cache server writeable instance '
@@ -412,6 +446,8 @@ class ControllerDaemon(cliapp.Plugin):
         worker_cache_server_port = \
             self.app.settings['worker-cache-server-port']
         morph_instance = self.app.settings['morph-instance']
+        ask_worker_info = self.app.settings['ask-worker-info']
+        build_times = distbuild.BuildTimes()
 
         listener_specs = [
             # address, port, class to initiate on connection, class init args
@@ -421,12 +457,12 @@ class ControllerDaemon(cliapp.Plugin):
             ('controller-initiator-address', 'controller-initiator-port',
              'controller-initiator-port-file',
              distbuild.InitiatorConnection, 
-             [artifact_cache_server, morph_instance]),
+             [artifact_cache_server, morph_instance, build_times]),
         ]
 
         loop = distbuild.MainLoop()
         
-        queuer = distbuild.WorkerBuildQueuer()
+        queuer = distbuild.WorkerBuildQueuer(build_times)
         loop.add_state_machine(queuer)
 
         for addr, port, port_file, sm, extra_args in listener_specs:
@@ -447,7 +483,7 @@ class ControllerDaemon(cliapp.Plugin):
             cm = distbuild.ConnectionMachine(
                 addr, port, distbuild.WorkerConnection, 
                 [writeable_cache_server, worker_cache_server_port,
-                 morph_instance])
+                 morph_instance, ask_worker_info])
             loop.add_state_machine(cm)
 
         loop.run()
@@ -468,11 +504,13 @@ class GraphStateMachines(cliapp.Plugin):
         cm._start_connect = lambda *args: None
         self.graph_one(cm)
 
-        self.graph_one(distbuild.BuildController(None, None, None))
+        self.graph_one(distbuild.BuildController(None, None, None, None,
+                                                 None))
         self.graph_one(distbuild.HelperRouter(None))
-        self.graph_one(distbuild.InitiatorConnection(None, None, None))
+        self.graph_one(distbuild.InitiatorConnection(None, None, None,
+                                                     None))
         self.graph_one(distbuild.JsonMachine(None))
-        self.graph_one(distbuild.WorkerBuildQueuer())
+        self.graph_one(distbuild.WorkerBuildQueuer(distbuild.BuildTimes()))
 
         # FIXME: These need more mocking to work.
         # self.graph_one(distbuild.Initiator(None, None,
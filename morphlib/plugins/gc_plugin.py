@@ -1,4 +1,4 @@
-# Copyright (C) 2013-2015  Codethink Limited
+# Copyright (C) 2013-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -58,6 +58,15 @@ class GCPlugin(cliapp.Plugin):
            --cachedir-artifact-keep-younger-than if it still needs to make
            space.
 
+           If --artifact-cache-size is set, it first removes artifacts
+           that were not used in the last
+           --cachedir-artifact-keep-younger-than seconds until the
+           artifacts take up no more than that, biggest and least
+           recently used first.
+
+           Artifacts of the cache keys given with --artifact-cache-keep,
+           and of everything they were built from, are never removed.
+
            It also removes any left over temporary chunks and staging areas
            from failed builds.
 
@@ -86,8 +95,12 @@ class GCPlugin(cliapp.Plugin):
 
         self.app.status(msg='Removing temp subdirectory: staging')
         staging_dir = os.path.join(temp_path, 'staging')
+        def is_overlay_of_staging_area(f):
+            return (f.endswith('.overlay') and
+                    os.path.isdir(os.path.join(staging_dir, f[:-8])))
         subdirs = (f for f in os.listdir(staging_dir)
-                   if os.path.isdir(os.path.join(staging_dir, f)))
+                   if os.path.isdir(os.path.join(staging_dir, f))
+                   and not is_overlay_of_staging_area(f))
         for subdir in subdirs:
             fd = None
             prefix_dir = os.path.join(staging_dir, subdir)
@@ -100,6 +113,13 @@ class GCPlugin(cliapp.Plugin):
                 log_file = os.path.join('%s.log' % prefix_dir)
                 if os.path.exists(log_file):
                     os.remove(log_file)
+                # Staging areas in overlayfs mode that were left behind
+                # by a morph that died are still mounted.
+                if os.path.ismount(prefix_dir):
+                    self.app.runcmd(['umount', prefix_dir])
+                overlay_dir = '%s.overlay' % prefix_dir
+                if os.path.exists(overlay_dir):
+                    shutil.rmtree(overlay_dir)
                 if os.path.exists(prefix_dir):
                     shutil.rmtree(prefix_dir)
             except IOError:
@@ -108,19 +128,33 @@ class GCPlugin(cliapp.Plugin):
                 if fd is not None:
                     os.close(fd)
 
-        for subdir in ('deployments', 'chunks'):
+        def enough_space(what):
             if morphlib.util.get_bytes_free_in_path(temp_path) >= min_space:
-                self.app.status(msg='Not Removing subdirectory '
-                                    '%(subdir)s, enough space already cleared',
-                                subdir=os.path.join(temp_path, subdir),
-                                chatty=True)
-                break
-            self.app.status(msg='Removing temp subdirectory: %(subdir)s',
-                            subdir=subdir)
-            path = os.path.join(temp_path, subdir)
-            if os.path.exists(path):
-                shutil.rmtree(path)
-            os.mkdir(path)
+                self.app.status(msg='Not removing %(what)s, enough space '
+                                    'already cleared',
+                                what=what, chatty=True)
+                return True
+            return False
+
+        deployments_dir = os.path.join(temp_path, 'deployments')
+        if not enough_space(deployments_dir):
+            self.app.status(msg='Removing temp subdirectory: deployments')
+            if os.path.exists(deployments_dir):
+                shutil.rmtree(deployments_dir)
+            os.mkdir(deployments_dir)
+
+        # Staging area bases share files with the unpacked chunks, so
+        # they must go before removing the chunks can free anything.
+        # Anything still in use by a build is kept.
+        bases_dir = os.path.join(temp_path, 'staging-bases')
+        if os.path.exists(bases_dir) and not enough_space(bases_dir):
+            self.app.status(msg='Removing unused staging area bases')
+            morphlib.stagingbasecache.StagingBaseCache(bases_dir).evict(0)
+
+        chunks_dir = os.path.join(temp_path, 'chunks')
+        if not enough_space(chunks_dir):
+            self.app.status(msg='Removing unused unpacked chunks')
+            morphlib.dircache.DirectoryCache(chunks_dir).evict(0)
 
     def calculate_delete_range(self):
         now = time.time()
@@ -130,9 +164,12 @@ class GCPlugin(cliapp.Plugin):
             now - self.app.settings['cachedir-artifact-keep-younger-than']
         return always_delete_age, may_delete_age
 
-    def find_deletable_artifacts(self, lac, max_age, min_age):
+    def find_deletable_artifacts(self, lac, max_age, min_age, keep=()):
         '''Get a list of cache keys in order of how old they are.'''
-        contents = list(lac.list_contents())
+        keep = lac.index.reachable(keep)
+        contents = [(cachekey, artifacts, mtime)
+                    for cachekey, artifacts, mtime in lac.list_contents()
+                    if cachekey not in keep]
         always = set(cachekey
                      for cachekey, artifacts, mtime in contents
                      if mtime < max_age)
@@ -146,18 +183,28 @@ class GCPlugin(cliapp.Plugin):
         def sufficient_free():
             free = morphlib.util.get_bytes_free_in_path(cache_path)
             return (free >= min_space)
+        lac = morphlib.localartifactcache.LocalArtifactCache(
+            fs.osfs.OSFS(os.path.join(cache_path, 'artifacts')))
+        keep = self.app.settings['artifact-cache-keep']
+        max_size = self.app.settings['artifact-cache-size']
+        if max_size > 0:
+            freed = lac.evict(
+                max_size, keep=keep,
+                keep_younger_than=self.app.settings[
+                    'cachedir-artifact-keep-younger-than'])
+            self.app.status(msg='Removed %(freed)d bytes of artifacts to '
+                                'keep the cache under %(max_size)d bytes',
+                            freed=freed, max_size=max_size, chatty=True)
         if sufficient_free():
             self.app.status(msg='Not cleaning up cachedir, '
                                 'sufficient space already cleared',
                             chatty=True)
             return
-        lac = morphlib.localartifactcache.LocalArtifactCache(
-            fs.osfs.OSFS(os.path.join(cache_path, 'artifacts')))
         max_age, min_age = self.calculate_delete_range()
         logging.debug('Must remove artifacts older than timestamp %d'
                       % max_age)
         always_delete, may_delete = \
-            self.find_deletable_artifacts(lac, max_age, min_age)
+            self.find_deletable_artifacts(lac, max_age, min_age, keep)
         removed = 0
         source_count = len(always_delete) + len(may_delete)
         logging.debug('Must remove artifacts %s' % repr(always_delete))
@@ -1,4 +1,4 @@
-# Copyright (C) 2015 Codethink Limited
+# Copyright (C) 2015,2026 Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -69,7 +69,8 @@ class ShowBuildLog(cliapp.Plugin):
             arch = root.source.morphology['arch']
             build_env = build_command.new_build_env(arch)
 
-            ckc = morphlib.cachekeycomputer.CacheKeyComputer(build_env)
+            ckc = morphlib.cachekeycomputer.CacheKeyComputer(
+                build_env, self.app.settings['chunk-source-mode'])
 
             cache_key = None
             for source in set(a.source for a in root.walk()):
@@ -1,4 +1,4 @@
-# Copyright (C) 2015  Codethink Limited
+# Copyright (C) 2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -107,7 +107,9 @@ class SystemManifestsPlugin(cliapp.Plugin):
             self.lrc, self.rrc, repo, ref, [system_filename],
             cachedir=self.app.settings['cachedir'],
             update_repos = not self.app.settings['no-git-update'],
-            status_cb=self.app.status)
+            status_cb=self.app.status,
+            concurrent_git_updates=self.app.settings[
+                'concurrent-git-updates'])
 
         self.app.status(
             msg='Resolving artifacts for %(system)s',
@@ -122,7 +124,8 @@ class SystemManifestsPlugin(cliapp.Plugin):
             system=system_filename, chatty=True)
         build_env = morphlib.buildenvironment.BuildEnvironment(
             self.app.settings, system_artifact.source.morphology['arch'])
-        ckc = morphlib.cachekeycomputer.CacheKeyComputer(build_env)
+        ckc = morphlib.cachekeycomputer.CacheKeyComputer(
+            build_env, self.app.settings['chunk-source-mode'])
 
         # FIXME: This should be fixed in morphloader.
         morphlib.util.fix_chunk_build_mode(system_artifact)
@@ -1,4 +1,4 @@
-# Copyright (C) 2012-2015  Codethink Limited
+# Copyright (C) 2012-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -14,16 +14,24 @@
 
 
 import cliapp
+import httplib
+import json
 import logging
+import socket
+import threading
 import urllib
 import urllib2
 import urlparse
 
+import morphlib
 
-class HeadRequest(urllib2.Request):  # pragma: no cover
 
-    def get_method(self):
-        return 'HEAD'
+# How many times a download that stops part of the way through is
+# carried on from where it stopped, before giving up.
+MAX_RESUMES = 3
+
+# How many files to ask the cache server about in each request.
+MAX_QUERY_SIZE = 500
 
 
 class GetError(cliapp.AppException):
@@ -53,10 +61,128 @@ class GetSourceMetadataError(GetError):
                   (name, source, cache_key, cache))
 
 
+class QueryError(cliapp.AppException):
+
+    def __init__(self, cache, error):
+        cliapp.AppException.__init__(
+            self, 'Failed to ask the artifact cache %s which artifacts '
+                  'it has: %s' % (cache, error))
+
+
+class ConnectionPool(object):
+
+    '''Keep HTTP/1.1 connections to a server open for later requests.
+
+    Setting up a new connection for every request takes a round trip or
+    more, which adds up when fetching hundreds of artifacts from a cache
+    far away. Connections are given back with put() once the response
+    has been read, and up to max_idle of them are kept for reuse.
+
+    '''
+
+    def __init__(self, server_url, max_idle=8, timeout=600):
+        scheme, netloc = urlparse.urlsplit(server_url)[:2]
+        if scheme == 'https':  # pragma: no cover
+            self._connection_class = httplib.HTTPSConnection
+        else:
+            self._connection_class = httplib.HTTPConnection
+        self.netloc = netloc
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def request(self, method, path, headers=None, body=None):
+        '''Send a request, and return the connection and its response.
+
+        The server may have closed a connection while it was kept open,
+        so a request that fails on one is tried again on a new one.
+        Errors on a new connection are raised as socket.error or
+        httplib.HTTPException.
+
+        '''
+
+        while True:
+            with self._lock:
+                reused = bool(self._idle)
+                if reused:
+                    conn = self._idle.pop()
+            if not reused:
+                conn = self._connection_class(
+                    self.netloc, timeout=self.timeout)
+            try:
+                conn.request(method, path, body, headers or {})
+                return conn, conn.getresponse()
+            except (socket.error, httplib.HTTPException) as e:
+                conn.close()
+                if not reused:
+                    raise
+                logging.debug('Connection to %s was closed, trying a new '
+                              'one: %s' % (self.netloc, e))
+
+    def put(self, conn, response):
+        '''Give back a connection, keeping it open if it can be reused.'''
+
+        if response.isclosed() and not response.will_close:
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(conn)
+                    return
+        conn.close()
+
+    def close(self):
+        '''Close all the connections that are kept open.'''
+
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class PooledResponse(object):
+
+    '''A file-like response, whose connection goes back to the pool.
+
+    The connection is kept for reuse only if the whole response was read
+    before close() is called.
+
+    '''
+
+    def __init__(self, pool, conn, response):
+        self._pool = pool
+        self._conn = conn
+        self._response = response
+
+    def read(self, *args):
+        return self._response.read(*args)
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.put(self._conn, self._response)
+            self._conn = None
+
+
 class RemoteArtifactCache(object):
 
-    def __init__(self, server_url):
+    '''Fetch artifacts and their metadata from a morph-cache-server.
+
+    Requests share a pool of connections that are kept open, and fetch()
+    downloads up to max_downloads artifacts at once.
+
+    '''
+
+    def __init__(self, server_url, max_downloads=4, timeout=600):
         self.server_url = server_url
+        self.max_downloads = max_downloads
+        # Whether the server may be able to send artifacts in one stream.
+        self._streams = True
+        self._pool = ConnectionPool(
+            server_url, max_idle=max(max_downloads, 1), timeout=timeout)
+
+    def close(self):
+        '''Close the connections that are kept open for later requests.'''
+
+        self._pool.close()
 
     def has(self, artifact):
         return self._has_file(artifact.basename())
@@ -89,22 +215,293 @@ class RemoteArtifactCache(object):
         except urllib2.URLError:
             raise GetSourceMetadataError(self, source, cachekey, name)
 
-    def _has_file(self, filename):  # pragma: no cover
+    def has_many(self, artifacts):
+        '''Return the set of artifacts that the cache has.
+
+        artifacts is a list of (artifact, metadata names) pairs, as for
+        fetch(), and an artifact is in the set only if the cache has its
+        metadata too. Rather than asking about each file, the cache server
+        is sent lists of up to MAX_QUERY_SIZE files, several at once.
+
+        '''
+
+        artifacts = list(artifacts)
+        filenames = set()
+        for artifact, names in artifacts:
+            filenames.add(artifact.basename())
+            filenames.update(artifact.metadata_basename(n) for n in names)
+        filenames = sorted(filenames)
+        chunks = [filenames[i:i + MAX_QUERY_SIZE]
+                  for i in xrange(0, len(filenames), MAX_QUERY_SIZE)]
+
+        try:
+            results = morphlib.util.map_in_threads(
+                self._has_files, chunks, self.max_downloads)
+        except urllib2.URLError as e:
+            raise QueryError(self, e)
+        present = set()
+        for result in results:
+            present.update(result)
+
+        return set(artifact for artifact, names in artifacts
+                   if artifact.basename() in present and
+                      all(artifact.metadata_basename(n) in present
+                          for n in names))
+
+    def fetch(self, lac, artifacts, status=lambda artifact: None,
+              log=logging.error):
+        '''Copy artifacts and their metadata into a local artifact cache.
+
+        artifacts is a list of (artifact, metadata names) pairs. Files
+        that lac has already are skipped, and status is called with each
+        artifact that needs fetching. An artifact and its metadata are
+        saved only when they have all been fetched, so that lac never
+        has part of them.
+
+        Everything is asked for in a single stream first. Artifacts that
+        the stream does not bring, because it broke or the server is too
+        old to send streams, are then fetched a file at a time, up to
+        max_downloads artifacts at once. If some fail, the rest are still
+        fetched, and then the error for the first that failed is raised.
+
+        '''
+
+        def fetch_group(wanted):
+            files = []
+            try:
+                for filename, put, args, error in wanted:
+                    files.append(put(*args))
+                    try:
+                        self._download(filename, files[-1])
+                    except urllib2.URLError as e:
+                        log(str(e))
+                        raise error
+            except BaseException:
+                for f in files:
+                    f.abort()
+                raise
+            else:
+                for f in files:
+                    f.close()
+
+        groups = []
+        for artifact, names in artifacts:
+            wanted = []
+            if not lac.has(artifact):
+                wanted.append((artifact.basename(), lac.put, (artifact,),
+                               GetError(self, artifact)))
+            for name in names:
+                if not lac.has_artifact_metadata(artifact, name):
+                    wanted.append((
+                        artifact.metadata_basename(name),
+                        lac.put_artifact_metadata, (artifact, name),
+                        GetArtifactMetadataError(self, artifact, name)))
+            if wanted:
+                status(artifact)
+                groups.append(wanted)
+
+        if groups and self._streams:
+            groups = self._fetch_stream(groups)
+        morphlib.util.map_in_threads(fetch_group, groups, self.max_downloads)
+
+    def _fetch_stream(self, groups):
+        '''Fetch groups of files in one stream.
+
+        Each group is a list of files to save together. Returns the groups
+        that were not saved.
+
+        '''
+
+        url = urlparse.urljoin(self.server_url, '/1.0/artifact-stream')
+        filenames = [w[0] for group in groups for w in group]
+        logging.debug('RemoteArtifactCache._fetch_stream: url=%s, %d files' %
+                      (url, len(filenames)))
+        try:
+            conn, response = self._open(
+                url, {'Content-Type': 'application/json'}, method='POST',
+                body=json.dumps(filenames))
+        except urllib2.HTTPError as e:
+            if e.code in (httplib.NOT_FOUND, httplib.METHOD_NOT_ALLOWED):
+                logging.debug('%s cannot send streams' % self)
+                self._streams = False
+            else:
+                logging.warning('Cannot fetch stream from %s: %s' % (self, e))
+            return groups
+        except urllib2.URLError as e:
+            logging.warning('Cannot fetch stream from %s: %s' % (self, e))
+            return groups
+
+        # filename -> (group index, put, args)
+        wanted = {}
+        for i, group in enumerate(groups):
+            for filename, put, args, error in group:
+                wanted[filename] = (i, put, args)
+        files = {}
+        started = set()
+        received = set()
+        done = set()
+        failed = set()
+
+        def start(filename):
+            if filename not in wanted or filename in started:
+                raise morphlib.artifactstream.StreamError(
+                    'unexpected file %s' % filename)
+            started.add(filename)
+            i, put, args = wanted[filename]
+            files[filename] = put(*args)
+            return files[filename]
+
+        def finish(i, ok):
+            for w in groups[i]:
+                f = files.pop(w[0], None)
+                if f is None:
+                    continue
+                if ok:
+                    f.close()
+                else:
+                    f.abort()
+            if ok:
+                done.add(i)
+            else:
+                failed.add(i)
+
+        try:
+            for filename, ok in morphlib.artifactstream.read_stream(
+                    response, start):
+                if filename not in wanted:
+                    raise morphlib.artifactstream.StreamError(
+                        'unexpected file %s' % filename)
+                i = wanted[filename][0]
+                if not ok:
+                    logging.debug('%s is missing or damaged in stream '
+                                  'from %s' % (filename, self))
+                    finish(i, False)
+                elif i in failed:
+                    finish(i, False)
+                else:
+                    received.add(filename)
+                    if all(w[0] in received for w in groups[i]):
+                        finish(i, True)
+            response.read()
+        except (morphlib.artifactstream.StreamError,
+                socket.error, httplib.HTTPException) as e:
+            logging.warning('Stream from %s broke: %s' % (self, e))
+            conn.close()
+        else:
+            self._pool.put(conn, response)
+        finally:
+            for f in files.itervalues():
+                f.abort()
+
+        return [group for i, group in enumerate(groups) if i not in done]
+
+    def _has_file(self, filename):
         url = self._request_url(filename)
         logging.debug('RemoteArtifactCache._has_file: url=%s' % url)
-        request = HeadRequest(url)
         try:
-            urllib2.urlopen(request)
-            return True
-        except (urllib2.HTTPError, urllib2.URLError):
+            conn, response = self._pool.request('HEAD', self._path(url))
+        except (socket.error, httplib.HTTPException):
             return False
+        response.read()
+        self._pool.put(conn, response)
+        return response.status == httplib.OK
+
+    def _has_files(self, filenames):
+        '''Ask the cache server which of a list of files it has.'''
 
-    def _get_file(self, filename):  # pragma: no cover
+        url = urlparse.urljoin(self.server_url, '/1.0/artifacts')
+        logging.debug('RemoteArtifactCache._has_files: url=%s, %d files' %
+                      (url, len(filenames)))
+        conn, response = self._open(
+            url, {'Content-Type': 'application/json'}, method='POST',
+            body=json.dumps(filenames))
+        try:
+            body = response.read()
+        except (socket.error, httplib.HTTPException) as e:
+            conn.close()
+            raise urllib2.URLError(e)
+        self._pool.put(conn, response)
+        try:
+            results = json.loads(body)
+        except ValueError as e:
+            raise urllib2.URLError('Bad answer from %s: %s' % (url, e))
+        return [filename for filename in filenames if results.get(filename)]
+
+    def _get_file(self, filename):
         url = self._request_url(filename)
         logging.debug('RemoteArtifactCache._get_file: url=%s' % url)
-        return urllib2.urlopen(url)
+        return PooledResponse(self._pool, *self._open(url))
+
+    def _open(self, url, headers=None, method='GET', body=None):
+        '''Send a request, raising URLError unless it succeeds.'''
+
+        try:
+            conn, response = self._pool.request(
+                method, self._path(url), headers, body)
+        except (socket.error, httplib.HTTPException) as e:
+            raise urllib2.URLError(e)
+        if response.status not in (httplib.OK, httplib.PARTIAL_CONTENT):
+            response.read()
+            self._pool.put(conn, response)
+            raise urllib2.HTTPError(
+                url, response.status, response.reason, response.msg, None)
+        return conn, response
+
+    def _download(self, filename, f):
+        '''Write a file from the cache into the open file f.
+
+        If the connection breaks part of the way through, the download
+        is carried on from where it stopped with a Range request. A
+        server that ignores the range sends the whole file again.
+
+        '''
+
+        url = self._request_url(filename)
+        logging.debug('RemoteArtifactCache._download: url=%s' % url)
+        resumes = 0
+        while True:
+            offset = f.tell()
+            headers = {'Range': 'bytes=%d-' % offset} if offset else {}
+            conn, response = self._open(url, headers)
+            if response.status == httplib.OK and offset:
+                f.seek(0)
+                f.truncate()
+                offset = 0
+            elif (response.status == httplib.PARTIAL_CONTENT and
+                    not response.getheader('Content-Range', '').startswith(
+                        'bytes %d-' % offset)):
+                conn.close()
+                raise urllib2.URLError('Unexpected Content-Range for %s: %s'
+                                       % (url, response.getheader(
+                                           'Content-Range')))
+
+            expected = response.length
+            try:
+                while True:
+                    data = response.read(64 * 1024)
+                    if not data:
+                        break
+                    f.write(data)
+            except (socket.error, httplib.HTTPException) as e:
+                error = e
+            else:
+                if expected is None or f.tell() - offset == expected:
+                    self._pool.put(conn, response)
+                    return
+                error = 'got %d of %d bytes' % (f.tell() - offset, expected)
+            conn.close()
+            if resumes == MAX_RESUMES:
+                raise urllib2.URLError(
+                    'Download of %s failed: %s' % (url, error))
+            resumes += 1
+            logging.debug('Download of %s stopped, resuming: %s' %
+                          (url, error))
+
+    def _path(self, url):
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+        return '%s?%s' % (path, query) if query else path
 
-    def _request_url(self, filename):  # pragma: no cover
+    def _request_url(self, filename):
         server_url = self.server_url
         if not server_url.endswith('/'):
             server_url += '/'
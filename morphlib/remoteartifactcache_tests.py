@@ -1,4 +1,4 @@
-# Copyright (C) 2012-2015  Codethink Limited
+# Copyright (C) 2012-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -13,9 +13,20 @@
 # with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import BaseHTTPServer
+import json
+import SocketServer
 import StringIO
+import socket
+import struct
+import tempfile
+import threading
+import time
 import unittest
 import urllib2
+import urlparse
+
+import fs.tempfs
 
 import morphlib
 
@@ -161,3 +172,523 @@ class RemoteArtifactCacheTests(unittest.TestCase):
         returned_url = self.cache._request_url('gtk+')
         correct_url = '%s/1.0/artifacts?filename=gtk%%2B' % self.server_url
         self.assertEqual(returned_url, correct_url)
+
+
+class StubCacheHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    '''Serve files from the stub server's files dict.
+
+    Ranges are honoured if the server's ranges attribute is true. Files
+    named in the server's broken set have their connection closed half
+    way through the first time they are sent, reset if they are named
+    reset-*, and files named slow-*
+    are sent after half a second. Files named nolength-* are sent
+    without a Content-Length, and files named close-* are sent and
+    then the connection is closed without saying it will be.
+
+    POST requests with a list of files are answered with which of them
+    the server has, or with the server's post_answer if it is set. Those
+    to /1.0/artifact-stream get a stream of the files if the server's
+    stream_status is 200, with stream_filter applied to it, or just the
+    status otherwise.
+
+    '''
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self.send_file(send_body=False)
+
+    def do_GET(self):
+        self.send_file(send_body=True)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.getheader('Content-Length')))
+        filenames = json.loads(body)
+        self.server.requests.append(('POST', filenames, None))
+        if self.path == '/1.0/artifact-stream':
+            self.send_stream(filenames)
+            return
+        status, answer = self.server.post_answer or (
+            200, json.dumps(dict((filename, filename in self.server.files)
+                                 for filename in filenames)))
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(answer)))
+        self.end_headers()
+        if self.server.post_reset:
+            self.connection.setsockopt(
+                socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.close_connection = 1
+        else:
+            self.wfile.write(answer)
+
+    def send_stream(self, filenames):
+        if self.server.stream_status != 200:
+            self.send_response(self.server.stream_status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        def open_file(filename):
+            if filename not in self.server.files:
+                raise IOError('No such file')
+            f = tempfile.TemporaryFile()
+            f.write(self.server.files[filename])
+            f.seek(0)
+            return f
+
+        stream = ''.join(morphlib.artifactstream.write_stream(
+            self.server.stream_filenames or filenames, open_file))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(stream)))
+        self.end_headers()
+        self.wfile.write(self.server.stream_filter(stream))
+        self.close_connection = 1
+
+    def send_file(self, send_body):
+        query = urlparse.parse_qs(urlparse.urlsplit(self.path).query)
+        filename = query['filename'][0]
+        self.server.requests.append(
+            (self.command, filename, self.headers.getheader('Range')))
+        if filename not in self.server.files:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if filename.startswith('slow-'):
+            time.sleep(0.5)
+
+        data = self.server.files[filename]
+        offset = 0
+        byte_range = self.headers.getheader('Range')
+        if byte_range and self.server.ranges:
+            offset = int(byte_range[len('bytes='):-1])
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (
+                offset + self.server.range_skew, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        if not filename.startswith('nolength-'):
+            self.send_header('Content-Length', str(len(data) - offset))
+        self.end_headers()
+        if not send_body:
+            return
+
+        if filename in self.server.broken:
+            self.server.broken.remove(filename)
+            self.wfile.write(data[offset:offset + len(data) / 2])
+            self.close_connection = 1
+            if filename.startswith('reset-'):
+                self.connection.setsockopt(
+                    socket.SOL_SOCKET, socket.SO_LINGER,
+                    struct.pack('ii', 1, 0))
+        else:
+            self.wfile.write(data[offset:])
+        if filename.startswith(('nolength-', 'close-')):
+            self.close_connection = 1
+
+    def log_message(self, *args):
+        pass
+
+
+class StubCacheServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(
+            self, ('127.0.0.1', 0), StubCacheHandler)
+        self.files = {}
+        self.broken = set()
+        self.ranges = True
+        self.range_skew = 0
+        self.post_answer = None
+        self.post_reset = False
+        self.stream_status = 404
+        self.stream_filenames = None
+        self.stream_filter = lambda stream: stream
+        self.requests = []
+        self.connections = 0
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        SocketServer.ThreadingMixIn.process_request(
+            self, request, client_address)
+
+    def handle_error(self, request, client_address):
+        # Clients close connections without reading whole responses.
+        pass
+
+
+class RemoteArtifactCacheServerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubCacheServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.cache = morphlib.remoteartifactcache.RemoteArtifactCache(
+            'http://127.0.0.1:%d/' % self.server.server_address[1],
+            max_downloads=2, timeout=5)
+
+        self.tempfs = fs.tempfs.TempFS()
+        self.lac = morphlib.localartifactcache.LocalArtifactCache(
+            self.tempfs)
+
+        loader = morphlib.morphloader.MorphologyLoader()
+        morph = loader.load_from_string(
+            '''
+                name: chunk
+                kind: chunk
+                products:
+                    - artifact: chunk-runtime
+                      include: [usr/bin]
+                    - artifact: chunk-devel
+                      include: [usr/include]
+                    - artifact: chunk-doc
+                      include: [usr/share/doc]
+            ''')
+        self.source, = morphlib.source.make_sources(
+            'repo', 'original/ref', 'chunk.morph', 'sha1', 'tree', morph)
+        self.source.cache_key = 'CHUNK'
+        self.runtime_artifact = self.source.artifacts['chunk-runtime']
+        self.devel_artifact = self.source.artifacts['chunk-devel']
+
+    def tearDown(self):
+        self.cache.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.tempfs.close()
+
+    def add_file(self, filename, size=1000):
+        data = ''.join(chr(i % 251) for i in xrange(size))
+        self.server.files[filename] = data
+        return data
+
+    def gets(self):
+        return [r for r in self.server.requests if r[0] == 'GET']
+
+    def local_file(self, filename):
+        if not self.tempfs.exists(filename):
+            return None
+        with self.tempfs.open(filename, 'rb') as f:
+            return f.read()
+
+    def test_has_files_using_one_connection(self):
+        self.add_file('foo')
+        self.assertTrue(self.cache._has_file('foo'))
+        self.assertFalse(self.cache._has_file('bar'))
+        self.assertTrue(self.cache._has_file('foo'))
+        self.assertEqual(self.server.connections, 1)
+
+    def test_does_not_have_files_if_server_is_not_there(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.assertFalse(self.cache._has_file('foo'))
+
+    def test_gets_files_using_one_connection(self):
+        data = self.add_file('foo')
+        for i in range(2):
+            f = self.cache._get_file('foo')
+            self.assertEqual(f.read(), data)
+            f.close()
+            f.close()
+        self.assertEqual(self.server.connections, 1)
+
+    def test_does_not_reuse_connection_if_response_was_not_read(self):
+        data = self.add_file('foo')
+        self.cache._get_file('foo').close()
+        f = self.cache._get_file('foo')
+        self.assertEqual(f.read(), data)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_fails_to_get_missing_file(self):
+        self.assertRaises(urllib2.HTTPError, self.cache._get_file, 'foo')
+        self.assertRaises(morphlib.remoteartifactcache.GetError,
+                          self.cache.get, self.runtime_artifact,
+                          log=lambda *args: None)
+
+    def test_fails_to_get_file_if_server_is_not_there(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.assertRaises(urllib2.URLError, self.cache._get_file, 'foo')
+
+    def test_retries_on_new_connection_if_server_closed_it(self):
+        self.add_file('close-foo')
+        data = self.add_file('bar')
+        f = self.cache._get_file('close-foo')
+        f.read()
+        f.close()
+        self.assertEqual(self.cache._get_file('bar').read(), data)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_keeps_at_most_max_idle_connections(self):
+        self.add_file('foo')
+        files = [self.cache._get_file('foo') for i in range(3)]
+        for f in files:
+            f.read()
+            f.close()
+        self.assertEqual(len(self.cache._pool._idle), 2)
+
+    def test_asks_about_many_artifacts_at_once(self):
+        self.add_file(self.runtime_artifact.basename())
+        self.add_file(self.runtime_artifact.metadata_basename('meta'))
+        self.add_file(self.devel_artifact.basename())
+        doc_artifact = self.source.artifacts['chunk-doc']
+        self.add_file(doc_artifact.basename())
+        self.assertEqual(
+            self.cache.has_many([(self.runtime_artifact, ['meta']),
+                                 (self.devel_artifact, ['meta']),
+                                 (doc_artifact, [])]),
+            set([self.runtime_artifact, doc_artifact]))
+        self.assertEqual([r[0] for r in self.server.requests], ['POST'])
+
+    def test_asks_about_artifacts_in_chunks(self):
+        artifacts = self.source.artifacts.values()
+        for artifact in artifacts:
+            self.add_file(artifact.basename())
+        old_size = morphlib.remoteartifactcache.MAX_QUERY_SIZE
+        morphlib.remoteartifactcache.MAX_QUERY_SIZE = len(artifacts) - 1
+        try:
+            present = self.cache.has_many((a, []) for a in artifacts)
+        finally:
+            morphlib.remoteartifactcache.MAX_QUERY_SIZE = old_size
+        self.assertEqual(present, set(artifacts))
+        self.assertEqual(sorted(len(r[1]) for r in self.server.requests),
+                         [1, len(artifacts) - 1])
+
+    def test_does_not_ask_about_no_artifacts(self):
+        self.assertEqual(self.cache.has_many([]), set())
+        self.assertEqual(self.server.requests, [])
+
+    def test_fails_to_ask_about_artifacts_if_server_says_no(self):
+        self.server.post_answer = (404, 'Not found')
+        self.assertRaises(morphlib.remoteartifactcache.QueryError,
+                          self.cache.has_many, [(self.runtime_artifact, [])])
+
+    def test_fails_to_ask_about_artifacts_if_answer_is_not_json(self):
+        self.server.post_answer = (200, 'Not JSON')
+        self.assertRaises(morphlib.remoteartifactcache.QueryError,
+                          self.cache.has_many, [(self.runtime_artifact, [])])
+
+    def test_fails_to_ask_about_artifacts_if_connection_is_reset(self):
+        self.server.post_reset = True
+        self.assertRaises(morphlib.remoteartifactcache.QueryError,
+                          self.cache.has_many, [(self.runtime_artifact, [])])
+
+    def test_fetches_artifacts_and_metadata(self):
+        runtime = self.add_file(self.runtime_artifact.basename())
+        meta = self.add_file(self.runtime_artifact.metadata_basename('meta'))
+        devel = self.add_file(self.devel_artifact.basename())
+        fetched = []
+        self.cache.fetch(self.lac, [(self.runtime_artifact, ['meta']),
+                                    (self.devel_artifact, [])],
+                         status=fetched.append)
+        self.assertEqual(
+            self.local_file(self.runtime_artifact.basename()), runtime)
+        self.assertEqual(
+            self.local_file(self.runtime_artifact.metadata_basename('meta')),
+            meta)
+        self.assertEqual(
+            self.local_file(self.devel_artifact.basename()), devel)
+        self.assertEqual(sorted(fetched),
+                         sorted([self.runtime_artifact, self.devel_artifact]))
+
+    def test_fetches_artifacts_at_the_same_time(self):
+        self.source.cache_key = 'slow-CHUNK'
+        self.add_file(self.runtime_artifact.basename())
+        self.add_file(self.devel_artifact.basename())
+        started = time.time()
+        self.cache.fetch(self.lac, [(self.runtime_artifact, []),
+                                    (self.devel_artifact, [])])
+        self.assertTrue(time.time() - started < 0.9)
+        self.assertTrue(self.lac.has(self.runtime_artifact))
+        self.assertTrue(self.lac.has(self.devel_artifact))
+
+    def test_does_not_fetch_what_local_cache_has(self):
+        self.add_file(self.runtime_artifact.basename())
+        self.add_file(self.runtime_artifact.metadata_basename('meta'))
+        self.cache.fetch(self.lac, [(self.runtime_artifact, ['meta'])])
+        self.server.requests = []
+        fetched = []
+        self.cache.fetch(self.lac, [(self.runtime_artifact, ['meta'])],
+                         status=fetched.append)
+        self.assertEqual(fetched, [])
+        self.assertEqual(self.server.requests, [])
+
+    def test_resumes_broken_download(self):
+        filename = self.runtime_artifact.basename()
+        data = self.add_file(filename)
+        self.server.broken.add(filename)
+        self.cache.fetch(self.lac, [(self.runtime_artifact, [])])
+        self.assertEqual(self.local_file(filename), data)
+        self.assertEqual(self.gets(),
+                         [('GET', filename, None),
+                          ('GET', filename, 'bytes=500-')])
+
+    def test_starts_again_if_server_ignores_range(self):
+        filename = self.runtime_artifact.basename()
+        data = self.add_file(filename)
+        self.server.broken.add(filename)
+        self.server.ranges = False
+        self.cache.fetch(self.lac, [(self.runtime_artifact, [])])
+        self.assertEqual(self.local_file(filename), data)
+
+    def test_resumes_download_after_connection_is_reset(self):
+        self.source.cache_key = 'reset-CHUNK'
+        filename = self.runtime_artifact.basename()
+        data = self.add_file(filename, size=256 * 1024)
+        self.server.broken.add(filename)
+        self.cache.fetch(self.lac, [(self.runtime_artifact, [])])
+        self.assertEqual(self.local_file(filename), data)
+        self.assertEqual(len(self.gets()), 2)
+
+    def test_fetches_file_without_length(self):
+        self.source.cache_key = 'nolength-CHUNK'
+        filename = self.runtime_artifact.basename()
+        data = self.add_file(filename)
+        self.cache.fetch(self.lac, [(self.runtime_artifact, [])])
+        self.assertEqual(self.local_file(filename), data)
+
+    def test_fails_if_server_sends_wrong_range(self):
+        filename = self.runtime_artifact.basename()
+        self.add_file(filename)
+        self.server.broken.add(filename)
+        self.server.range_skew = 1
+        self.assertRaises(morphlib.remoteartifactcache.GetError,
+                          self.cache.fetch, self.lac,
+                          [(self.runtime_artifact, [])],
+                          log=lambda *args: None)
+        self.assertEqual(self.local_file(filename), None)
+
+    def test_gives_up_if_download_keeps_breaking(self):
+        filename = self.runtime_artifact.basename()
+        self.add_file(filename, size=64)
+        self.server.ranges = False
+        self.server.broken = BrokenForever()
+        self.assertRaises(morphlib.remoteartifactcache.GetError,
+                          self.cache.fetch, self.lac,
+                          [(self.runtime_artifact, [])],
+                          log=lambda *args: None)
+        self.assertEqual(len(self.gets()),
+                         morphlib.remoteartifactcache.MAX_RESUMES + 1)
+
+    def test_fetches_everything_in_one_stream(self):
+        self.server.stream_status = 200
+        files = [self.runtime_artifact.basename(),
+                 self.runtime_artifact.metadata_basename('meta'),
+                 self.devel_artifact.basename()]
+        data = [self.add_file(filename) for filename in files]
+        self.cache.fetch(self.lac, [(self.runtime_artifact, ['meta']),
+                                    (self.devel_artifact, [])])
+        self.assertEqual([self.local_file(f) for f in files], data)
+        self.assertEqual(self.server.requests, [('POST', files, None)])
+
+    def test_stops_asking_for_streams_if_server_cannot_send_them(self):
+        self.add_file(self.runtime_artifact.basename())
+        self.add_file(self.devel_artifact.basename())
+        self.cache.fetch(self.lac, [(self.runtime_artifact, [])])
+        self.cache.fetch(self.lac, [(self.devel_artifact, [])])
+        self.assertEqual([r[0] for r in self.server.requests],
+                         ['POST', 'GET', 'GET'])
+        self.assertTrue(self.lac.has(self.devel_artifact))
+
+    def test_fetches_files_one_at_a_time_if_stream_fails(self):
+        self.server.stream_status = 500
+        self.add_file(self.runtime_artifact.basename())
+        self.add_file(self.devel_artifact.basename())
+        self.cache.fetch(self.lac, [(self.runtime_artifact, [])])
+        self.cache.fetch(self.lac, [(self.devel_artifact, [])])
+        self.assertEqual([r[0] for r in self.server.requests],
+                         ['POST', 'GET', 'POST', 'GET'])
+
+    def test_fails_to_fetch_if_server_is_not_there(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.assertRaises(morphlib.remoteartifactcache.GetError,
+                          self.cache.fetch, self.lac,
+                          [(self.runtime_artifact, [])],
+                          log=lambda *args: None)
+
+    def test_fetches_rest_one_at_a_time_if_stream_breaks(self):
+        self.server.stream_status = 200
+        first = self.add_file(self.runtime_artifact.basename())
+        second = self.add_file(self.devel_artifact.basename())
+        self.server.stream_filter = lambda stream: stream[:1500]
+        self.cache.fetch(self.lac, [(self.runtime_artifact, []),
+                                    (self.devel_artifact, [])])
+        self.assertEqual(
+            self.local_file(self.runtime_artifact.basename()), first)
+        self.assertEqual(
+            self.local_file(self.devel_artifact.basename()), second)
+        self.assertEqual(self.gets(),
+                         [('GET', self.devel_artifact.basename(), None)])
+
+    def test_fetches_damaged_files_again(self):
+        self.server.stream_status = 200
+        data = self.add_file(self.runtime_artifact.basename())
+        self.server.stream_filter = (
+            lambda stream: stream.replace(data[:10], 'x' * 10))
+        self.cache.fetch(self.lac, [(self.runtime_artifact, [])])
+        self.assertEqual(
+            self.local_file(self.runtime_artifact.basename()), data)
+        self.assertEqual(len(self.gets()), 1)
+
+    def test_saves_nothing_for_artifact_missing_from_stream(self):
+        self.server.stream_status = 200
+        self.add_file(self.runtime_artifact.metadata_basename('meta'))
+        self.add_file(self.devel_artifact.basename())
+        doc_artifact = self.source.artifacts['chunk-doc']
+        self.add_file(doc_artifact.metadata_basename('meta'))
+        self.assertRaises(
+            morphlib.remoteartifactcache.GetError,
+            self.cache.fetch, self.lac,
+            [(self.runtime_artifact, ['meta']),
+             (self.devel_artifact, ['meta']),
+             (doc_artifact, ['meta'])],
+            log=lambda *args: None)
+        self.assertEqual(
+            [f for f in self.tempfs.listdir()
+             if morphlib.artifactcacheindex.is_cache_file(f)],
+            [])
+
+    def test_ignores_stream_with_files_not_asked_for(self):
+        self.server.stream_status = 200
+        data = self.add_file(self.runtime_artifact.basename())
+        self.add_file('other')
+        for filenames in (['other'], ['unknown'],
+                          [self.runtime_artifact.basename()] * 2):
+            self.server.stream_filenames = filenames
+            self.cache.fetch(self.lac, [(self.runtime_artifact, [])])
+            self.assertEqual(
+                self.local_file(self.runtime_artifact.basename()), data)
+            self.tempfs.remove(self.runtime_artifact.basename())
+        # The first copy of a file sent twice is good, so is kept.
+        self.assertEqual(len(self.gets()), 2)
+
+    def test_saves_nothing_for_artifact_with_missing_metadata(self):
+        self.add_file(self.runtime_artifact.basename())
+        devel = self.add_file(self.devel_artifact.basename())
+        self.assertRaises(
+            morphlib.remoteartifactcache.GetArtifactMetadataError,
+            self.cache.fetch, self.lac,
+            [(self.runtime_artifact, ['meta']), (self.devel_artifact, [])],
+            log=lambda *args: None)
+        self.assertEqual(
+            self.local_file(self.runtime_artifact.basename()), None)
+        self.assertEqual(
+            self.local_file(self.devel_artifact.basename()), devel)
+        self.assertEqual(
+            [f for f in self.tempfs.listdir() if f.startswith('tmp')], [])
+
+
+class BrokenForever(set):
+
+    '''A set of broken files that stay broken after being sent.'''
+
+    def __contains__(self, item):
+        return True
+
+    def remove(self, item):
+        pass
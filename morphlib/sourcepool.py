@@ -1,4 +1,4 @@
-# Copyright (C) 2012-2015  Codethink Limited
+# Copyright (C) 2012-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -24,6 +24,16 @@ class SourcePool(object):
         self._sources = collections.defaultdict(dict)
         self._order = []
 
+        # The artifacts resolved from the pool, and the environment and
+        # settings the cache keys of its sources were computed for, if it
+        # was saved with them by a SourcePoolCache.
+        self.root_artifacts = None
+        self.cache_key_env = None
+
+        # (SourcePoolCache, key, definitions commit) if the pool can be
+        # saved for later runs.
+        self.snapshot = None
+
     def _key(self, repo_name, original_ref, filename):
         return (repo_name, original_ref, filename)
 
@@ -36,6 +46,13 @@ class SourcePool(object):
             self._sources[key][source.name] = source
             self._order.append(source)
 
+    def save_snapshot(self):
+        '''Save the pool again, if it came from or went to a cache.'''
+
+        if self.snapshot is not None:
+            cache, key, definitions_commit = self.snapshot
+            cache.put(key, self, definitions_commit)
+
     def lookup(self, repo_name, original_ref, filename):
         '''Find a source in the pool.
 
@@ -1,4 +1,4 @@
-# Copyright (C) 2012-2015  Codethink Limited
+# Copyright (C) 2012-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -60,3 +60,18 @@ class SourcePoolTests(unittest.TestCase):
             self.pool.add(source)
             sources.append(source)
         self.assertEqual(list(self.pool), sources)
+
+    def test_save_snapshot_does_nothing_without_a_snapshot(self):
+        self.pool.save_snapshot()
+
+    def test_saves_snapshot_to_cache_it_came_from(self):
+        saved = []
+
+        class FakeCache(object):
+
+            def put(self, key, pool, definitions_commit):
+                saved.append((key, pool, definitions_commit))
+
+        self.pool.snapshot = (FakeCache(), 'key', 'commit')
+        self.pool.save_snapshot()
+        self.assertEqual(saved, [('key', self.pool, 'commit')])
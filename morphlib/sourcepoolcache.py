@@ -0,0 +1,196 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import cPickle
+import hashlib
+import logging
+import os
+
+import morphlib
+import morphlib.gitversion
+
+
+def is_petrified(pool, definitions_repo, definitions_commit):
+    '''Is every source in the pool at a fixed commit?
+
+    Sources from the definitions commit itself don't count, as the
+    snapshot is keyed by its tree.
+
+    '''
+
+    return all(morphlib.git.is_valid_sha1(source.original_ref)
+               for source in pool
+               if (source.repo_name, source.sha1) !=
+                  (definitions_repo, definitions_commit))
+
+
+class SourcePoolCache(object):
+
+    '''On-disk snapshots of resolved source pools.
+
+    When every chunk in some definitions is at a fixed commit, the source
+    pool, the artifacts resolved from it and their cache keys depend only
+    on the definitions tree, the systems asked for and the version of
+    Morph. This cache keeps them so that later runs against the same tree
+    don't need to look at any other repository.
+
+    The sources and artifacts are saved as flat lists rather than as the
+    object graph, which is too deep to pickle directly for large systems.
+
+    '''
+
+    # Change this to throw away every snapshot, for example if the
+    # attributes of Source objects change.
+    format_version = 1
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+
+    def key(self, repo_name, ref, tree, filenames):
+        '''Return the key for a pool of the given definitions.
+
+        ``ref`` is the ref that the sources from the definitions should
+        record, which is not necessarily a commit.
+
+        '''
+
+        sha = hashlib.sha1()
+        sha.update('format=%d\n' % self.format_version)
+        sha.update('morph=%s %s\n' % (morphlib.gitversion.version,
+                                      morphlib.gitversion.tree))
+        sha.update('%s\n%s\n%s\n' % (repo_name, ref, tree))
+        for filename in filenames:
+            sha.update('%s\n' % filename)
+        return sha.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.dirname, key)
+
+    def get(self, key, definitions_commit):
+        '''Return the cached pool for ``key``, or None.
+
+        The sources from the definitions are given ``definitions_commit``,
+        which may be a different commit with the same tree.
+
+        '''
+
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                snapshot = cPickle.load(f)
+            pool = self._restore(snapshot, definitions_commit)
+        except IOError:
+            return None
+        except Exception as e:
+            # Unpickling garbage can raise almost anything.
+            logging.warning('Ignoring broken cached source pool %s: %s',
+                            path, e)
+            return None
+        pool.snapshot = (self, key, definitions_commit)
+        return pool
+
+    def put(self, key, pool, definitions_commit):
+        '''Save ``pool``, with any artifacts and cache keys, for ``key``.'''
+
+        path = self._path(key)
+        try:
+            snapshot = self._snapshot(pool, definitions_commit)
+            if not os.path.exists(self.dirname):
+                os.makedirs(self.dirname)
+            with morphlib.savefile.SaveFile(path, 'wb') as f:
+                cPickle.dump(snapshot, f, cPickle.HIGHEST_PROTOCOL)
+        except (IOError, OSError, cPickle.PicklingError) as e:
+            logging.warning('Failed to cache source pool %s: %s', key, e)
+            return
+        pool.snapshot = (self, key, definitions_commit)
+
+    @staticmethod
+    def _snapshot(pool, definitions_commit):
+        sources = list(pool)
+        index = dict((source, i) for i, source in enumerate(sources))
+
+        def ref(artifact):
+            return index[artifact.source], artifact.name
+
+        saved = []
+        for source in sources:
+            saved.append({
+                'name': source.name,
+                'repo_name': source.repo_name,
+                'original_ref': source.original_ref,
+                'definitions': source.sha1 == definitions_commit,
+                'sha1': source.sha1,
+                'tree': source.tree,
+                'morphology': source.morphology,
+                'filename': source.filename,
+                'split_rules': source.split_rules,
+                'artifacts': dict(
+                    (name, [index[s] for s in artifact.dependents])
+                    for name, artifact in source.artifacts.iteritems()),
+                'dependencies': [ref(a) for a in source.dependencies],
+                'cache_id': source.cache_id,
+                'cache_key': source.cache_key,
+                # Set on chunks by the ArtifactResolver.
+                'build_mode': getattr(source, 'build_mode', None),
+                'prefix': getattr(source, 'prefix', None),
+            })
+        root_artifacts = pool.root_artifacts
+        if root_artifacts is not None:
+            root_artifacts = [ref(a) for a in root_artifacts]
+        return {
+            'sources': saved,
+            'root_artifacts': root_artifacts,
+            'cache_key_env': pool.cache_key_env,
+        }
+
+    @staticmethod
+    def _restore(snapshot, definitions_commit):
+        sources = []
+        for saved in snapshot['sources']:
+            if saved['definitions']:
+                sha1 = definitions_commit
+            else:
+                sha1 = saved['sha1']
+            source = morphlib.source.Source(
+                saved['name'], saved['repo_name'], saved['original_ref'],
+                sha1, saved['tree'], saved['morphology'], saved['filename'],
+                saved['split_rules'])
+            source.artifacts = dict(
+                (name, morphlib.artifact.Artifact(source, name))
+                for name in saved['artifacts'])
+            source.cache_id = saved['cache_id']
+            source.cache_key = saved['cache_key']
+            if saved['build_mode'] is not None:
+                source.build_mode = saved['build_mode']
+            if saved['prefix'] is not None:
+                source.prefix = saved['prefix']
+            sources.append(source)
+
+        def artifact((i, name)):
+            return sources[i].artifacts[name]
+
+        pool = morphlib.sourcepool.SourcePool()
+        for source, saved in zip(sources, snapshot['sources']):
+            source.dependencies = [artifact(a)
+                                   for a in saved['dependencies']]
+            for name, dependents in saved['artifacts'].iteritems():
+                source.artifacts[name].dependents = [sources[i]
+                                                     for i in dependents]
+            pool.add(source)
+        if snapshot['root_artifacts'] is not None:
+            pool.root_artifacts = [artifact(a)
+                                   for a in snapshot['root_artifacts']]
+        pool.cache_key_env = snapshot['cache_key_env']
+        return pool
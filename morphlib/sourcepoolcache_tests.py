@@ -0,0 +1,164 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import morphlib
+
+
+class DummyBuildEnvironment:
+
+    def __init__(self, env):
+        self.env = env
+
+
+default_split_rules = {
+    'chunk': morphlib.artifactsplitrule.DEFAULT_CHUNK_RULES,
+    'stratum': morphlib.artifactsplitrule.DEFAULT_STRATUM_RULES,
+}
+
+
+chunk_sha1 = 'a' * 40
+
+
+class SourcePoolCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache = morphlib.sourcepoolcache.SourcePoolCache(
+            os.path.join(self.tempdir, 'source-pools'))
+        self.key = self.cache.key('defs', 'master', 'tree', ['system.morph'])
+
+        loader = morphlib.morphloader.MorphologyLoader()
+        self.pool = morphlib.sourcepool.SourcePool()
+        for repo, ref, sha1, name, text in [
+            ('defs', 'master', 'commit', 'system.morph', '''
+                name: system
+                kind: system
+                arch: testarch
+                strata:
+                    - morph: stratum
+            '''),
+            ('defs', 'master', 'commit', 'stratum.morph', '''
+                name: stratum
+                kind: stratum
+                build-depends: []
+                chunks:
+                    - name: chunk
+                      morph: chunk.morph
+                      repo: chunks
+                      ref: %s
+                      build-depends: []
+                    - name: chunk2
+                      morph: chunk2.morph
+                      repo: chunks
+                      ref: %s
+                      build-depends: [chunk]
+            ''' % (chunk_sha1, chunk_sha1)),
+            ('chunks', chunk_sha1, chunk_sha1, 'chunk.morph', '''
+                name: chunk
+                kind: chunk
+            '''),
+            ('chunks', chunk_sha1, chunk_sha1, 'chunk2.morph', '''
+                name: chunk2
+                kind: chunk
+            '''),
+        ]:
+            morph = loader.load_from_string(text, name)
+            for source in morphlib.source.make_sources(
+                    repo, ref, name, sha1, 'tree', morph,
+                    default_split_rules=default_split_rules):
+                self.pool.add(source)
+
+        ar = morphlib.artifactresolver.ArtifactResolver()
+        self.pool.root_artifacts = ar.resolve_root_artifacts(self.pool)
+        ckc = morphlib.cachekeycomputer.CacheKeyComputer(
+            DummyBuildEnvironment(dict.fromkeys(
+                ['LOGNAME', 'MORPH_ARCH', 'TARGET', 'TARGET_STAGE1', 'USER',
+                 'USERNAME'], 'x')))
+        ckc.compute_keys(self.pool, self.pool)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def describe(self, pool):
+        return [(str(s), s.sha1, s.cache_key,
+                 sorted(str(a) for a in s.dependencies),
+                 sorted((name, sorted(str(d) for d in a.dependents))
+                        for name, a in s.artifacts.iteritems()))
+                for s in pool]
+
+    def test_returns_none_when_not_cached(self):
+        self.assertEqual(self.cache.get(self.key, 'commit'), None)
+
+    def test_keys_depend_on_definitions_tree_and_systems(self):
+        keys = set([
+            self.key,
+            self.cache.key('defs', 'master', 'tree2', ['system.morph']),
+            self.cache.key('defs', 'master', 'tree', ['other.morph']),
+            self.cache.key('defs', 'branch', 'tree', ['system.morph']),
+        ])
+        self.assertEqual(len(keys), 4)
+
+    def test_restores_sources_artifacts_and_cache_keys(self):
+        self.cache.put(self.key, self.pool, 'commit')
+        pool = self.cache.get(self.key, 'commit')
+        self.assertEqual(self.describe(pool), self.describe(self.pool))
+        self.assertEqual([str(a) for a in pool.root_artifacts],
+                         [str(a) for a in self.pool.root_artifacts])
+        self.assertEqual(pool.cache_key_env, self.pool.cache_key_env)
+        chunk = pool.lookup('chunks', chunk_sha1, 'chunk2.morph')[0]
+        self.assertEqual(chunk.build_mode, 'staging')
+
+    def test_restored_sources_use_new_definitions_commit(self):
+        self.cache.put(self.key, self.pool, 'commit')
+        pool = self.cache.get(self.key, 'other-commit')
+        self.assertEqual(sorted(set(s.sha1 for s in pool)),
+                         sorted([chunk_sha1, 'other-commit']))
+
+    def test_save_snapshot_updates_saved_pool(self):
+        self.pool.root_artifacts = None
+        self.cache.put(self.key, self.pool, 'commit')
+        pool = self.cache.get(self.key, 'commit')
+        self.assertEqual(pool.root_artifacts, None)
+        pool.root_artifacts = pool.lookup('defs', 'master', 'system.morph')[
+            0].artifacts.values()
+        pool.save_snapshot()
+        pool = self.cache.get(self.key, 'commit')
+        self.assertEqual([a.name for a in pool.root_artifacts],
+                         ['system-rootfs'])
+
+    def test_ignores_broken_snapshot(self):
+        os.makedirs(self.cache.dirname)
+        with open(os.path.join(self.cache.dirname, self.key), 'w') as f:
+            f.write('garbage')
+        self.assertEqual(self.cache.get(self.key, 'commit'), None)
+
+    def test_ignores_failure_to_save(self):
+        with open(self.cache.dirname, 'w'):
+            pass
+        self.cache.put(self.key, self.pool, 'commit')
+        self.assertEqual(self.pool.snapshot, None)
+
+    def test_only_petrified_pools_are_cacheable(self):
+        self.assertTrue(morphlib.sourcepoolcache.is_petrified(
+            self.pool, 'defs', 'commit'))
+        self.pool.lookup('chunks', chunk_sha1, 'chunk.morph')[
+            0].original_ref = 'master'
+        self.assertFalse(morphlib.sourcepoolcache.is_petrified(
+            self.pool, 'defs', 'commit'))
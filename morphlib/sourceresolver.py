@@ -1,4 +1,4 @@
-# Copyright (C) 2014-2015  Codethink Limited
+# Copyright (C) 2014-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -14,11 +14,9 @@
 
 
 import collections
-import contextlib
-import cPickle
 import logging
 import os
-import pylru
+import threading
 import warnings
 
 import cliapp
@@ -28,65 +26,9 @@ from morphlib.util import sanitise_morphology_path
 
 
 tree_cache_size = 10000
-tree_cache_filename = 'trees.cache.pickle'
-
-
-class PickleCacheManager(object):
-    '''Cache manager for PyLRU that reads and writes to Pickle files.
-
-    The 'pickle' format is less than ideal in many ways and is actually
-    slower than JSON in Python. However, the data we need to cache is keyed
-    by tuples and in JSON a dict can only be keyed with strings. For now,
-    using 'pickle' seems to be the least worst option.
-
-    '''
-
-    def __init__(self, filename, size):
-        self.filename = filename
-        self.size = size
-
-    def _populate_cache_from_file(self, filename, cache):
-        try:
-            with open(filename, 'r') as f:
-                data = cPickle.load(f)
-            for key, value in data.iteritems():
-                cache[key] = value
-        except (EOFError, IOError, cPickle.PickleError) as e:
-            logging.warning('Failed to load cache %s: %s', self.filename, e)
-
-    def load_cache(self):
-        '''Create a pylru.lrucache object prepopulated with saved data.'''
-        cache = pylru.lrucache(self.size)
-        # There should be a more efficient way to do this, by hooking into
-        # the json module directly.
-        self._populate_cache_from_file(self.filename, cache)
-        return cache
-
-    def save_cache(self, cache):
-        '''Save the data from a pylru.lrucache object to disk.
-
-        Any changes that have been made by other instances or processes since
-        load_cache() was called will be overwritten.
-
-        '''
-        data = {}
-        for key, value in cache.items():
-            data[key] = value
-        try:
-            with morphlib.savefile.SaveFile(self.filename, 'w') as f:
-                cPickle.dump(data, f)
-        except (IOError, cPickle.PickleError) as e:
-            logging.warning('Failed to save cache to %s: %s', self.filename, e)
-
-    @contextlib.contextmanager
-    def open(self):
-        cache = self.load_cache()
-        try:
-            yield cache
-        except BaseException as e:
-            raise
-        else:
-            self.save_cache(cache)
+tree_cache_filename = 'trees.cache.sqlite'
+morphology_cache_dirname = 'morphologies'
+source_pool_cache_dirname = 'source-pools'
 
 
 class SourceResolverError(cliapp.AppException):
@@ -162,13 +104,19 @@ class SourceResolver(object):
 
     def __init__(self, local_repo_cache, remote_repo_cache,
                  tree_cache_manager, update_repos,
-                 status_cb=None):
+                 status_cb=None, concurrent_git_updates=1,
+                 morphology_cache_dir=None):
         self.lrc = local_repo_cache
         self.rrc = remote_repo_cache
         self.tree_cache_manager = tree_cache_manager
+        self.morphology_cache_dir = morphology_cache_dir
 
         self.update = update_repos
         self.status = status_cb
+        self.concurrent_git_updates = concurrent_git_updates
+
+        # The tree cache is shared between the threads that resolve refs.
+        self._trees_lock = threading.Lock()
 
     def _resolve_ref(self, resolved_trees, reponame, ref):
         '''Resolves commit and tree sha1s of the ref in a repo and returns it.
@@ -183,10 +131,11 @@ class SourceResolver(object):
 
         # The Baserock reference definitions use absolute refs so, and, if the
         # absref is cached, we can short-circuit all this code.
-        if (reponame, ref) in resolved_trees:
-            logging.debug('Returning tree (%s, %s) from tree cache',
-                          reponame, ref)
-            return ref, resolved_trees[(reponame, ref)]
+        with self._trees_lock:
+            if (reponame, ref) in resolved_trees:
+                logging.debug('Returning tree (%s, %s) from tree cache',
+                              reponame, ref)
+                return ref, resolved_trees[(reponame, ref)]
 
         logging.debug('tree (%s, %s) not in cache', reponame, ref)
 
@@ -220,10 +169,38 @@ class SourceResolver(object):
 
         logging.debug('Writing tree to cache with ref (%s, %s)',
                       reponame, absref)
-        resolved_trees[(reponame, absref)] = tree
+        with self._trees_lock:
+            resolved_trees[(reponame, absref)] = tree
 
         return absref, tree
 
+    def _resolve_refs(self, resolved_trees, repo_refs):
+        '''Resolve many (reponame, ref) pairs, fetching repos in parallel.
+
+        Up to `concurrent_git_updates` repositories are updated or cloned
+        at once, and each repository is only handled by one thread, which
+        resolves all the refs wanted from it.
+
+        Returns a dict mapping each (reponame, ref) pair to (absref, tree).
+
+        '''
+
+        refs_by_repo = collections.OrderedDict()
+        for reponame, ref in sorted(set(repo_refs)):
+            refs_by_repo.setdefault(reponame, []).append(ref)
+
+        def resolve_repo_refs((reponame, refs)):
+            return [((reponame, ref),
+                     self._resolve_ref(resolved_trees, reponame, ref))
+                    for ref in refs]
+
+        resolved = {}
+        for results in morphlib.util.map_in_threads(
+                resolve_repo_refs, refs_by_repo.iteritems(),
+                self.concurrent_git_updates):
+            resolved.update(results)
+        return resolved
+
     def _get_file_contents_from_definitions(self, definitions_checkout_dir,
                                             filename):
         fp = os.path.join(definitions_checkout_dir, filename)
@@ -270,6 +247,20 @@ class SourceResolver(object):
 
         return defaults.build_systems(), defaults.split_rules()
 
+    def _morphology_cache(self, definitions_checkout_dir,
+                          definitions_version):
+        '''Return a MorphologyCache for these definitions, or None.'''
+
+        if self.morphology_cache_dir is None:
+            return None
+        # Loaded morphologies depend on the build systems in DEFAULTS.
+        defaults_text = self._get_file_contents_from_definitions(
+            definitions_checkout_dir, 'DEFAULTS')
+        context = 'definitions-version=%s\n%s' % (definitions_version,
+                                                   defaults_text or '')
+        return morphlib.morphologycache.MorphologyCache(
+            self.morphology_cache_dir, context)
+
     def _get_morphology(self, resolved_morphologies, definitions_checkout_dir,
                         morph_loader, filename):
         '''Read the morphology at the specified location.
@@ -363,8 +354,14 @@ class SourceResolver(object):
     def process_chunk(self, resolved_morphologies, resolved_trees,
                       definitions_checkout_dir, morph_loader, chunk_repo,
                       chunk_ref, filename, chunk_buildsystem, visit,
-                      predefined_split_rules):
-        absref, tree = self._resolve_ref(resolved_trees, chunk_repo, chunk_ref)
+                      predefined_split_rules, resolved_refs=None):
+        if resolved_refs is None:
+            resolved_refs = {}
+        if (chunk_repo, chunk_ref) in resolved_refs:
+            absref, tree = resolved_refs[(chunk_repo, chunk_ref)]
+        else:
+            absref, tree = self._resolve_ref(resolved_trees, chunk_repo,
+                                             chunk_ref)
 
         if chunk_buildsystem is None:
             # Build instructions defined in a chunk .morph file. An error is
@@ -386,6 +383,17 @@ class SourceResolver(object):
         visit(chunk_repo, chunk_ref, filename, absref, tree, morphology,
               predefined_split_rules)
 
+    def resolve_definitions_ref(self, definitions_repo, definitions_ref):
+        '''Return the commit and tree SHA1s of a ref in the definitions.'''
+
+        with self.tree_cache_manager.open() as resolved_trees:
+            try:
+                return self._resolve_ref(
+                    resolved_trees, definitions_repo, definitions_ref)
+            except morphlib.gitdir.InvalidRefError as e:
+                raise InvalidDefinitionsRefError(
+                    definitions_repo, definitions_ref)
+
     def traverse_morphs(self, definitions_repo, definitions_ref,
                         system_filenames,
                         visit=lambda rn, rf, fn, arf, m: None,
@@ -420,7 +428,9 @@ class SourceResolver(object):
                     definitions_checkout_dir, definitions_version)
 
             morph_loader = morphlib.morphloader.MorphologyLoader(
-                predefined_build_systems=predefined_build_systems)
+                predefined_build_systems=predefined_build_systems,
+                cache=self._morphology_cache(definitions_checkout_dir,
+                                             definitions_version))
 
             # First, process the system and its stratum morphologies. These
             # will all live in the same Git repository, and will point to
@@ -431,12 +441,18 @@ class SourceResolver(object):
                     definitions_tree, morph_loader, system_filenames, visit,
                     predefined_split_rules)
 
-            # Now process all the chunks involved in the build.
-            for repo, ref, filename, buildsystem in chunk_queue:
+            # Now process all the chunks involved in the build. Fetching
+            # their repositories is mostly waiting for the network, so do
+            # that for several at once, then visit them in a fixed order.
+            resolved_refs = self._resolve_refs(
+                resolved_trees,
+                ((repo, ref) for repo, ref, filename, buildsystem
+                 in chunk_queue))
+            for repo, ref, filename, buildsystem in sorted(chunk_queue):
                 self.process_chunk(resolved_morphologies, resolved_trees,
                                    definitions_checkout_dir, morph_loader,
                                    repo, ref, filename, buildsystem, visit,
-                                   predefined_split_rules)
+                                   predefined_split_rules, resolved_refs)
 
 class DuplicateChunkError(morphlib.Error):
 
@@ -467,7 +483,7 @@ def _find_duplicate_chunks(sourcepool): #pragma: no cover
 
 def create_source_pool(lrc, rrc, repo, ref, filenames, cachedir,
                        original_ref=None, update_repos=True,
-                       status_cb=None):
+                       status_cb=None, concurrent_git_updates=1):
     '''Find all the sources involved in building a given system.
 
     Given a system morphology, this function will traverse the tree of stratum
@@ -479,7 +495,12 @@ def create_source_pool(lrc, rrc, repo, ref, filenames, cachedir,
     implementation, and so they must be handled separately.
 
     The 'lrc' and 'rrc' parameters specify the local and remote Git repository
-    caches used for resolving the sources.
+    caches used for resolving the sources. Up to 'concurrent_git_updates'
+    repositories are updated or cloned at the same time.
+
+    If every chunk is at a fixed commit, the pool is saved in 'cachedir',
+    and later calls for the same definitions tree return the saved pool
+    without resolving anything else.
 
     '''
     pool = morphlib.sourcepool.SourcePool()
@@ -492,12 +513,28 @@ def create_source_pool(lrc, rrc, repo, ref, filenames, cachedir,
         for source in sources:
             pool.add(source)
 
-    tree_cache_manager = PickleCacheManager(
+    tree_cache_manager = morphlib.treecache.TreeCacheManager(
         os.path.join(cachedir, tree_cache_filename), tree_cache_size)
 
-    resolver = SourceResolver(lrc, rrc, tree_cache_manager, update_repos,
-                              status_cb)
-    resolver.traverse_morphs(repo, ref, filenames,
+    resolver = SourceResolver(
+        lrc, rrc, tree_cache_manager, update_repos, status_cb,
+        concurrent_git_updates,
+        morphology_cache_dir=os.path.join(cachedir, morphology_cache_dirname))
+
+    absref, tree = resolver.resolve_definitions_ref(repo, ref)
+    original_ref = original_ref or ref
+
+    snapshots = morphlib.sourcepoolcache.SourcePoolCache(
+        os.path.join(cachedir, source_pool_cache_dirname))
+    snapshot_key = snapshots.key(repo, original_ref, tree, filenames)
+    cached_pool = snapshots.get(snapshot_key, absref)
+    if cached_pool is not None:
+        if status_cb:
+            status_cb(msg='Using saved sources for definitions tree %(tree)s',
+                      tree=tree, chatty=True)
+        return cached_pool
+
+    resolver.traverse_morphs(repo, absref, filenames,
                              visit=add_to_pool,
                              definitions_original_ref=original_ref)
 
@@ -506,4 +543,8 @@ def create_source_pool(lrc, rrc, repo, ref, filenames, cachedir,
     if duplicate_chunks:
         raise DuplicateChunkError(duplicate_chunks)
 
+    # Sources at named refs may resolve differently next time.
+    if morphlib.sourcepoolcache.is_petrified(pool, repo, absref):
+        snapshots.put(snapshot_key, pool, absref)
+
     return pool
@@ -1,4 +1,4 @@
-# Copyright (C) 2012-2015  Codethink Limited
+# Copyright (C) 2012-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -15,6 +15,7 @@
 
 import logging
 import os
+import platform
 import shutil
 import stat
 import cliapp
@@ -26,6 +27,138 @@ import pipes
 import morphlib
 
 
+# The FICLONE ioctl is _IOW(0x94, 9, int), which encodes differently on
+# architectures that use the alternative ioctl direction bits.
+if platform.machine().startswith(('ppc', 'mips')):  # pragma: no cover
+    FICLONE = 0x80049409
+else:
+    FICLONE = 0x40049409
+
+# The deepest stack of lower layers that overlayfs allows.
+OVERLAYFS_MAX_LAYERS = 500
+
+
+class ReflinkNotSupportedError(morphlib.Error):
+
+    def __init__(self, path, error):
+        self.msg = ('Cannot make a copy-on-write clone of %s: %s'
+                    % (path, error))
+
+
+def reflink_file(srcpath, destpath):  # pragma: no cover
+    '''Make ``destpath`` a copy-on-write clone of the regular file ``srcpath``.
+
+    Raises ReflinkNotSupportedError if the filesystem can't do this.
+
+    '''
+
+    file_stat = os.lstat(srcpath)
+    with open(srcpath, 'rb') as src:
+        fd = os.open(destpath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            fcntl.ioctl(fd, FICLONE, src.fileno())
+        except (IOError, OSError) as e:
+            os.close(fd)
+            os.remove(destpath)
+            raise ReflinkNotSupportedError(srcpath, e)
+        os.close(fd)
+    if os.geteuid() == 0:
+        os.chown(destpath, file_stat.st_uid, file_stat.st_gid)
+    shutil.copystat(srcpath, destpath)
+
+
+def overlayfs_supported():  # pragma: no cover
+    '''Can we mount overlay filesystems here?'''
+
+    if os.geteuid() != 0:
+        return False
+    try:
+        with open('/proc/filesystems') as f:
+            return any(line.split()[-1] == 'overlay'
+                       for line in f if line.strip())
+    except IOError:
+        return False
+
+
+def hardlink_all_files(srcpath, destpath,
+                       link_file=os.link):  # pragma: no cover
+    '''Hardlink every file in the path to the staging-area
+
+    Regular files are linked with ``link_file``, which can be replaced
+    to clone them in some other way.
+
+    If an exception is raised, the staging-area is indeterminate.
+
+    '''
+
+    file_stat = os.lstat(srcpath)
+    mode = file_stat.st_mode
+
+    if stat.S_ISDIR(mode):
+        # Ensure directory exists in destination, then recurse.
+        if not os.path.lexists(destpath):
+            os.makedirs(destpath)
+        dest_stat = os.stat(os.path.realpath(destpath))
+        if not stat.S_ISDIR(dest_stat.st_mode):
+            raise IOError('Destination not a directory. source has %s'
+                          ' destination has %s' % (srcpath, destpath))
+
+        for entry in os.listdir(srcpath):
+            hardlink_all_files(os.path.join(srcpath, entry),
+                               os.path.join(destpath, entry),
+                               link_file)
+    elif stat.S_ISLNK(mode):
+        # Copy the symlink.
+        if os.path.lexists(destpath):
+            os.remove(destpath)
+        os.symlink(os.readlink(srcpath), destpath)
+
+    elif stat.S_ISREG(mode):
+        # Hardlink the file.
+        if os.path.lexists(destpath):
+            os.remove(destpath)
+        link_file(srcpath, destpath)
+
+    elif stat.S_ISCHR(mode) or stat.S_ISBLK(mode):
+        # Block or character device. Put contents of st_dev in a mknod.
+        if os.path.lexists(destpath):
+            os.remove(destpath)
+        os.mknod(destpath, file_stat.st_mode, file_stat.st_rdev)
+        os.chmod(destpath, file_stat.st_mode)
+
+    else:
+        # Unsupported type.
+        raise IOError('Cannot extract %s into staging-area. Unsupported'
+                      ' type.' % srcpath)
+
+
+def unpacked_chunk_cache(app):
+    '''Return the cache of unpacked chunks in tempdir.'''
+
+    max_size = app.settings['chunk-cache-size'] or None
+    return morphlib.dircache.DirectoryCache(
+        os.path.join(app.settings['tempdir'], 'chunks'), max_size)
+
+
+def unpack_artifact(app, handle):
+    '''Unpack a chunk artifact into the cache of unpacked chunks.
+
+    We access the artifact via an open file handle. For now, we assume
+    the artifact is a tarball. Returns a CachedDirectory, which must be
+    released when the unpacked artifact is no longer being used.
+
+    '''
+
+    def unpack(root):
+        app.status(
+            msg='Unpacking chunk from cache %(filename)s',
+            filename=os.path.basename(handle.name))
+        morphlib.bins.unpack_binary_from_file(handle, root + '/')
+
+    return unpacked_chunk_cache(app).get(os.path.basename(handle.name),
+                                         unpack)
+
+
 class StagingArea(object):
 
     '''Represent the staging area for building software.
@@ -36,16 +169,39 @@ class StagingArea(object):
     system. Chunks built in 'test' or 'build-essential' mode have an empty
     staging area and are allowed to use the tools of the host.
 
+    The ``mode`` says how installed artifacts are put into the staging area:
+
+    * ``hardlink`` hardlinks every file of the unpacked artifact.
+    * ``reflink`` makes copy-on-write clones of every file instead, so that
+      a build can never write through to the unpacked artifact. It falls
+      back to ``hardlink`` if the filesystem does not support it.
+    * ``overlayfs`` mounts the unpacked artifacts as the read-only lower
+      layers of an overlay filesystem, which costs one mount rather than a
+      few syscalls per file. The mount is done by mount_layers(). It falls
+      back to ``reflink`` if overlay filesystems cannot be mounted.
+
+    Note that overlayfs does not merge a directory in one artifact into a
+    symlink to a directory in an earlier one, as the other modes do.
+
     '''
 
     _base_path = ['/sbin', '/usr/sbin', '/bin', '/usr/bin']
 
+    modes = ('hardlink', 'reflink', 'overlayfs')
+
     def __init__(self, app, source, dirname, build_env, use_chroot=True,
-                 extra_env={}, extra_path=[]):
+                 extra_env={}, extra_path=[], mode='hardlink'):
         self._app = app
         self.source = source
         self.dirname = dirname
 
+        assert mode in self.modes
+        self.mode = mode
+        self._layers = []
+        self._mounted = False
+        self._overlay_fds = []
+        self._held = []
+
         self.use_chroot = use_chroot
         self.env = build_env.env
         self.env.update(extra_env)
@@ -108,51 +264,16 @@ class StagingArea(object):
 
         return os.path.join(self.dirname, '%s.inst' % (self.source.name))
 
-    def hardlink_all_files(self, srcpath, destpath): # pragma: no cover
-        '''Hardlink every file in the path to the staging-area
-
-        If an exception is raised, the staging-area is indeterminate.
+    def overlay_dirname(self):
+        '''Directory for the upper layer and work area of the overlay.'''
 
-        '''
+        return self.dirname + '.overlay'
 
-        file_stat = os.lstat(srcpath)
-        mode = file_stat.st_mode
-
-        if stat.S_ISDIR(mode):
-            # Ensure directory exists in destination, then recurse.
-            if not os.path.lexists(destpath):
-                os.makedirs(destpath)
-            dest_stat = os.stat(os.path.realpath(destpath))
-            if not stat.S_ISDIR(dest_stat.st_mode):
-                raise IOError('Destination not a directory. source has %s'
-                              ' destination has %s' % (srcpath, destpath))
-
-            for entry in os.listdir(srcpath):
-                self.hardlink_all_files(os.path.join(srcpath, entry),
-                                        os.path.join(destpath, entry))
-        elif stat.S_ISLNK(mode):
-            # Copy the symlink.
-            if os.path.lexists(destpath):
-                os.remove(destpath)
-            os.symlink(os.readlink(srcpath), destpath)
-
-        elif stat.S_ISREG(mode):
-            # Hardlink the file.
-            if os.path.lexists(destpath):
-                os.remove(destpath)
-            os.link(srcpath, destpath)
-
-        elif stat.S_ISCHR(mode) or stat.S_ISBLK(mode):
-            # Block or character device. Put contents of st_dev in a mknod.
-            if os.path.lexists(destpath):
-                os.remove(destpath)
-            os.mknod(destpath, file_stat.st_mode, file_stat.st_rdev)
-            os.chmod(destpath, file_stat.st_mode)
+    def hardlink_all_files(self, srcpath, destpath,
+                           link_file=os.link): # pragma: no cover
+        '''Hardlink every file in the path to the staging-area'''
 
-        else:
-            # Unsupported type.
-            raise IOError('Cannot extract %s into staging-area. Unsupported'
-                          ' type.' % srcpath)
+        hardlink_all_files(srcpath, destpath, link_file)
 
     def install_artifact(self, handle):
         '''Install a build artifact into the staging area.
@@ -162,23 +283,116 @@ class StagingArea(object):
 
         '''
 
-        chunk_cache_dir = os.path.join(self._app.settings['tempdir'], 'chunks')
-        unpacked_artifact = os.path.join(
-            chunk_cache_dir, os.path.basename(handle.name) + '.d')
-        if not os.path.exists(unpacked_artifact):
-            self._app.status(
-                msg='Unpacking chunk from cache %(filename)s',
-                filename=os.path.basename(handle.name))
-            with morphlib.util.temp_dir(dir=chunk_cache_dir,
-                                        cleanup_on_success=False) as savedir:
-                morphlib.bins.unpack_binary_from_file(
-                    handle, savedir + '/')
-            # TODO: This rename is not concurrency safe if two builds are
-            #       extracting the same chunk, one build will fail because
-            #       the other renamed its tempdir here first.
-            os.rename(savedir, unpacked_artifact)
-
-        self.hardlink_all_files(unpacked_artifact, self.dirname)
+        self._install_cached_directory(unpack_artifact(self._app, handle))
+
+    def install_base(self, base):
+        '''Install a prepared root from a StagingBaseCache.'''
+
+        self._install_cached_directory(base)
+
+    def _install_cached_directory(self, cached):
+        # Hold it, so that it is not evicted from its cache, until the
+        # staging area is removed.
+        self._held.append(cached)
+        self._install_tree(cached.root)
+
+    def _install_tree(self, path):
+        if self.mode == 'overlayfs':
+            assert not self._mounted
+            self._layers.append(path)
+        else:
+            self._link_all_files(path)
+
+    def _link_all_files(self, unpacked_artifact):  # pragma: no cover
+        if self.mode == 'reflink':
+            try:
+                hardlink_all_files(unpacked_artifact, self.dirname,
+                                   link_file=reflink_file)
+                return
+            except ReflinkNotSupportedError as e:
+                logging.info('%s; hardlinking files instead', e)
+                self.mode = 'hardlink'
+        hardlink_all_files(unpacked_artifact, self.dirname)
+
+    def mount_layers(self):
+        '''Make the artifacts installed in overlayfs mode visible.
+
+        Artifacts installed in the other modes are visible straight away,
+        so this does nothing for them. Nothing more can be installed once
+        this has been called.
+
+        '''
+
+        if self.mode != 'overlayfs' or self._mounted or not self._layers:
+            return
+
+        layers = self._layers
+        if not overlayfs_supported():
+            logging.info('Cannot mount overlay filesystems, cloning files '
+                         'into the staging area instead')
+        elif len(layers) > OVERLAYFS_MAX_LAYERS:  # pragma: no cover
+            logging.info('%d layers are too many for overlayfs, cloning '
+                         'files into the staging area instead', len(layers))
+        elif self._mount_overlay(layers):  # pragma: no cover
+            return
+        else:  # pragma: no cover
+            logging.info('Mounting overlay filesystem failed, cloning files '
+                         'into the staging area instead')
+
+        self.mode = 'reflink'
+        for layer in layers:
+            self._link_all_files(layer)
+
+    def _mount_overlay(self, layers):  # pragma: no cover
+        '''Mount the layers on the staging area, and say if that worked.'''
+
+        overlay_dir = self.overlay_dirname()
+        upper_dir = os.path.join(overlay_dir, 'upper')
+        work_dir = os.path.join(overlay_dir, 'work')
+        links_dir = os.path.join(overlay_dir, 'layers')
+        for d in (upper_dir, work_dir, links_dir):
+            os.makedirs(d)
+        self._overlay_fds.append(self._lock_dir(overlay_dir))
+
+        # The mount options must fit in a page, so the layers are named by
+        # short symlinks, given relative to the directory holding them.
+        # Later layers go on top.
+        names = []
+        for i, layer in enumerate(layers):
+            os.symlink(layer, os.path.join(links_dir, str(i)))
+            names.insert(0, str(i))
+
+        # Whatever is in the staging area already becomes the upper layer.
+        for entry in os.listdir(self.dirname):
+            os.rename(os.path.join(self.dirname, entry),
+                      os.path.join(upper_dir, entry))
+
+        options = 'lowerdir=%s,upperdir=%s,workdir=%s' % (
+            ':'.join(names), upper_dir, work_dir)
+        try:
+            self._app.runcmd(['mount', '-t', 'overlay', 'overlay',
+                              '-o', options, self.dirname], cwd=links_dir)
+        except cliapp.AppException:
+            for entry in os.listdir(upper_dir):
+                os.rename(os.path.join(upper_dir, entry),
+                          os.path.join(self.dirname, entry))
+            for fd in self._overlay_fds:
+                os.close(fd)
+            self._overlay_fds = []
+            shutil.rmtree(overlay_dir)
+            return False
+        self._mounted = True
+
+        # The lock taken in the constructor is on the directory underneath
+        # the mount, so lock the mounted directory too, for `morph gc`.
+        self._overlay_fds.append(self._lock_dir(self.dirname))
+        return True
+
+    @staticmethod
+    def _lock_dir(dirname):  # pragma: no cover
+        fd = os.open(dirname, os.O_RDONLY)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
 
     def remove(self):
         '''Remove the entire staging area.
@@ -189,6 +403,14 @@ class StagingArea(object):
 
         '''
 
+        if self._mounted:  # pragma: no cover
+            for fd in self._overlay_fds:
+                os.close(fd)
+            self._app.runcmd(['umount', self.dirname])
+            self._mounted = False
+            shutil.rmtree(self.overlay_dirname())
+        for cached in self._held:
+            cached.release()
         shutil.rmtree(self.dirname)
         os.close(self.staging_area_fd)
 
@@ -229,6 +451,7 @@ class StagingArea(object):
     def runcmd(self, argv, **kwargs):  # pragma: no cover
         '''Run a command in a chroot in the staging area.'''
         assert 'env' not in kwargs
+        self.mount_layers()
         kwargs['env'] = dict(self.env)
         if 'extra_env' in kwargs:
             kwargs['env'].update(kwargs['extra_env'])
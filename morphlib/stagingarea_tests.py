@@ -1,4 +1,4 @@
-# Copyright (C) 2012-2015  Codethink Limited
+# Copyright (C) 2012-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -45,6 +45,7 @@ class FakeApplication(object):
         self.settings = {
             'cachedir': cachedir,
             'tempdir': tempdir,
+            'chunk-cache-size': 0,
         }
         for leaf in ('chunks',):
             d = os.path.join(tempdir, leaf)
@@ -121,6 +122,93 @@ class StagingAreaTests(unittest.TestCase):
         self.sa.remove()
         self.assertFalse(os.path.exists(self.staging))
 
+    def test_installs_base_and_releases_it_on_removal(self):
+        cache = morphlib.dircache.DirectoryCache(
+            os.path.join(self.tempdir, 'bases'))
+
+        def populate(root):
+            with open(os.path.join(root, 'file.txt'), 'w'):
+                pass
+
+        base = cache.get('base', populate)
+        self.sa.install_base(base)
+        self.assertTrue(os.path.exists(os.path.join(self.staging,
+                                                    'file.txt')))
+        self.assertFalse(cache.remove('base'))
+        self.sa.remove()
+        self.assertTrue(cache.remove('base'))
+
+    def test_mount_layers_does_nothing_in_hardlink_mode(self):
+        chunk_tar = self.create_chunk()
+        with open(chunk_tar, 'rb') as f:
+            self.sa.install_artifact(f)
+        self.sa.mount_layers()
+        self.assertEqual(self.sa.mode, 'hardlink')
+        self.assertTrue(os.path.exists(os.path.join(self.staging,
+                                                    'file.txt')))
+
+
+class StagingAreaModeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.app = FakeApplication(self.tempdir, self.tempdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def create_staging_area(self, mode):
+        staging = os.path.join(self.tempdir, 'staging-%s' % mode)
+        return morphlib.stagingarea.StagingArea(
+            self.app, FakeSource(), staging, FakeBuildEnvironment(),
+            mode=mode)
+
+    def install_chunk(self, sa):
+        chunkdir = os.path.join(self.tempdir, 'chunk')
+        if not os.path.exists(chunkdir):
+            os.mkdir(chunkdir)
+            with open(os.path.join(chunkdir, 'file.txt'), 'w') as f:
+                f.write('contents')
+        chunk_tar = os.path.join(self.tempdir, 'chunk.tar')
+        with tarfile.TarFile(name=chunk_tar, mode='w') as tf:
+            tf.add(chunkdir, arcname='.')
+        with open(chunk_tar, 'rb') as f:
+            sa.install_artifact(f)
+
+    def test_rejects_unknown_mode(self):
+        self.assertRaises(AssertionError, self.create_staging_area, 'copy')
+
+    def test_installs_artifact_in_reflink_mode(self):
+        sa = self.create_staging_area('reflink')
+        self.install_chunk(sa)
+        with open(os.path.join(sa.dirname, 'file.txt')) as f:
+            self.assertEqual(f.read(), 'contents')
+        sa.remove()
+
+    def test_installs_artifact_in_overlayfs_mode(self):
+        sa = self.create_staging_area('overlayfs')
+        self.install_chunk(sa)
+        sa.mount_layers()
+        with open(os.path.join(sa.dirname, 'file.txt')) as f:
+            self.assertEqual(f.read(), 'contents')
+        self.assertTrue(os.path.isdir(sa.real_builddir()))
+        sa.remove()
+        self.assertFalse(os.path.exists(sa.dirname))
+
+    def test_clones_files_when_overlayfs_is_unsupported(self):
+        sa = self.create_staging_area('overlayfs')
+        self.install_chunk(sa)
+        supported = morphlib.stagingarea.overlayfs_supported
+        morphlib.stagingarea.overlayfs_supported = lambda: False
+        try:
+            sa.mount_layers()
+        finally:
+            morphlib.stagingarea.overlayfs_supported = supported
+        self.assertNotEqual(sa.mode, 'overlayfs')
+        with open(os.path.join(sa.dirname, 'file.txt')) as f:
+            self.assertEqual(f.read(), 'contents')
+        sa.remove()
+
 
 class StagingAreaNonIsolatedTests(unittest.TestCase):
 
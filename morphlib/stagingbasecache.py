@@ -0,0 +1,47 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import hashlib
+
+import morphlib
+
+
+class StagingBaseCache(morphlib.dircache.DirectoryCache):
+
+    '''Prepared staging area roots, ready to be cloned into staging areas.
+
+    Chunks that build-depend on the same artifacts need the same staging
+    area, apart from their own build and install directories. The first
+    build to need a given set of artifacts installs them, and runs
+    ldconfig if needed, into a base in this cache. Later builds install
+    the base instead, which is a single overlayfs layer or a single pass
+    of hardlinking or cloning.
+
+    Bases are made by hardlinking the unpacked chunks, whatever the
+    staging area mode is. Nothing writes to a base, and the mode applies
+    when the base is installed, so a base never needs to be cloned or
+    layered itself.
+
+    '''
+
+    @staticmethod
+    def key(artifacts, build_mode):
+        '''Return the key of the base with ``artifacts`` installed.'''
+
+        sha = hashlib.sha256()
+        sha.update('build-mode=%s\n' % build_mode)
+        for basename in sorted(a.basename() for a in artifacts):
+            sha.update('%s\n' % basename)
+        return sha.hexdigest()
@@ -0,0 +1,43 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+
+import morphlib
+
+
+class FakeArtifact(object):
+
+    def __init__(self, basename):
+        self._basename = basename
+
+    def basename(self):
+        return self._basename
+
+
+class StagingBaseCacheTests(unittest.TestCase):
+
+    def test_key_does_not_depend_on_order(self):
+        a = FakeArtifact('a.chunk.a')
+        b = FakeArtifact('b.chunk.b')
+        key = morphlib.stagingbasecache.StagingBaseCache.key
+        self.assertEqual(key([a, b], 'staging'), key([b, a], 'staging'))
+
+    def test_key_depends_on_artifacts_and_build_mode(self):
+        a = FakeArtifact('a.chunk.a')
+        b = FakeArtifact('b.chunk.b')
+        key = morphlib.stagingbasecache.StagingBaseCache.key
+        self.assertNotEqual(key([a], 'staging'), key([a, b], 'staging'))
+        self.assertNotEqual(key([a], 'staging'), key([a], 'bootstrap'))
@@ -0,0 +1,114 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import contextlib
+import logging
+import sqlite3
+import time
+
+
+class TreeCache(object):
+    '''A persistent (repo, commit) -> tree mapping, backed by SQLite.
+
+    It behaves like a dict keyed by (repo, commit) tuples, but looks up
+    and writes entries one at a time rather than loading and saving the
+    whole mapping, and any number of processes can use the same file at
+    once. Entries that are used are remembered in memory, and their
+    last-used times written back when the cache is closed.
+
+    '''
+
+    def __init__(self, filename, size):
+        self.size = size
+        self._db = sqlite3.connect(filename, timeout=60,
+                                   check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS trees ('
+                'repo TEXT NOT NULL, ref TEXT NOT NULL, tree TEXT NOT NULL, '
+                'last_used INTEGER NOT NULL, PRIMARY KEY (repo, ref))')
+            self._db.execute('CREATE INDEX IF NOT EXISTS trees_last_used '
+                             'ON trees (last_used)')
+        self._known = {}
+        self._used = set()
+
+    def _lookup(self, key):
+        if key not in self._known:
+            row = self._db.execute(
+                'SELECT tree FROM trees WHERE repo = ? AND ref = ?',
+                key).fetchone()
+            if row is None:
+                return None
+            self._known[key] = str(row[0])
+        self._used.add(key)
+        return self._known[key]
+
+    def __contains__(self, key):
+        return self._lookup(key) is not None
+
+    def __getitem__(self, key):
+        tree = self._lookup(key)
+        if tree is None:
+            raise KeyError(key)
+        return tree
+
+    def __setitem__(self, key, tree):
+        with self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO trees (repo, ref, tree, last_used) '
+                'VALUES (?, ?, ?, ?)',
+                (key[0], key[1], tree, int(time.time())))
+        self._known[key] = tree
+
+    def close(self):
+        '''Record which entries were used and evict the oldest ones.'''
+
+        with self._db:
+            now = int(time.time())
+            self._db.executemany(
+                'UPDATE trees SET last_used = ? WHERE repo = ? AND ref = ?',
+                ((now, repo, ref) for repo, ref in self._used))
+            self._db.execute(
+                'DELETE FROM trees WHERE rowid IN ('
+                'SELECT rowid FROM trees ORDER BY last_used DESC, rowid DESC '
+                'LIMIT -1 OFFSET ?)', (self.size,))
+        self._db.close()
+
+
+class TreeCacheManager(object):
+    '''Opens the TreeCache in a given file.'''
+
+    def __init__(self, filename, size):
+        self.filename = filename
+        self.size = size
+
+    @contextlib.contextmanager
+    def open(self):
+        try:
+            cache = TreeCache(self.filename, self.size)
+        except sqlite3.Error as e:
+            # The tree cache is only an optimisation.
+            logging.warning('Failed to open cache %s: %s', self.filename, e)
+            yield {}
+            return
+        try:
+            yield cache
+        finally:
+            try:
+                cache.close()
+            except sqlite3.Error as e:
+                logging.warning('Failed to save cache %s: %s',
+                                self.filename, e)
@@ -0,0 +1,89 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import morphlib
+
+
+class TreeCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'trees.cache.sqlite')
+        self.manager = morphlib.treecache.TreeCacheManager(
+            self.filename, 10)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_missing_entry(self):
+        with self.manager.open() as trees:
+            self.assertFalse(('repo', 'ref') in trees)
+            self.assertRaises(KeyError, lambda: trees[('repo', 'ref')])
+
+    def test_entries_persist(self):
+        with self.manager.open() as trees:
+            trees[('repo', 'ref')] = 'tree'
+        with self.manager.open() as trees:
+            self.assertTrue(('repo', 'ref') in trees)
+            self.assertEqual(trees[('repo', 'ref')], 'tree')
+
+    def test_writes_are_seen_by_other_users_at_once(self):
+        with self.manager.open() as trees:
+            with self.manager.open() as other:
+                trees[('repo', 'ref')] = 'tree'
+                self.assertEqual(other[('repo', 'ref')], 'tree')
+
+    def test_concurrent_writes_are_not_lost(self):
+        with self.manager.open() as trees:
+            with self.manager.open() as other:
+                trees[('repo', 'a')] = 'tree-a'
+                other[('repo', 'b')] = 'tree-b'
+        with self.manager.open() as trees:
+            self.assertEqual(trees[('repo', 'a')], 'tree-a')
+            self.assertEqual(trees[('repo', 'b')], 'tree-b')
+
+    def test_evicts_least_recently_used(self):
+        manager = morphlib.treecache.TreeCacheManager(self.filename, 2)
+        with manager.open() as trees:
+            trees[('repo', 'a')] = 'tree-a'
+        with manager.open() as trees:
+            trees[('repo', 'b')] = 'tree-b'
+        with manager.open() as trees:
+            trees[('repo', 'c')] = 'tree-c'
+        with manager.open() as trees:
+            self.assertEqual(
+                sorted(ref for ref in 'abc' if ('repo', ref) in trees),
+                ['b', 'c'])
+
+    def test_falls_back_to_no_cache_if_file_unusable(self):
+        manager = morphlib.treecache.TreeCacheManager(
+            os.path.join(self.tempdir, 'missing', 'trees'), 10)
+        with manager.open() as trees:
+            trees[('repo', 'ref')] = 'tree'
+            self.assertEqual(trees[('repo', 'ref')], 'tree')
+
+    def test_carries_on_if_saving_fails(self):
+        with self.manager.open() as trees:
+            trees[('repo', 'ref')] = 'tree'
+            db = sqlite3.connect(self.filename)
+            db.execute('DROP TABLE trees')
+            db.commit()
+            db.close()
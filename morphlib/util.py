@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-# Copyright (C) 2011-2015  Codethink Limited
+# Copyright (C) 2011-2015,2026  Codethink Limited
 # Copyright © 2015  Richard Ipsum
 #
 # This program is free software; you can redistribute it and/or modify
@@ -23,6 +23,7 @@ import shutil
 import subprocess
 import textwrap
 import tempfile
+import threading
 import sys
 
 import fs.osfs
@@ -144,7 +145,8 @@ def new_artifact_caches(settings):  # pragma: no cover
     rac_url = get_artifact_cache_server(settings)
     rac = None
     if rac_url:
-        rac = morphlib.remoteartifactcache.RemoteArtifactCache(rac_url)
+        rac = morphlib.remoteartifactcache.RemoteArtifactCache(
+            rac_url, max_downloads=settings['concurrent-artifact-downloads'])
     return lac, rac
 
 
@@ -512,6 +514,52 @@ def iter_trickle(iterable, limit):
         yield buf
 
 
+def map_in_threads(function, items, max_threads):
+    '''Return [function(item) for item in items], using several threads.
+
+    At most `max_threads` calls run at once. The results are in the same
+    order as the items. If any call raises an exception, the rest are
+    still finished, and then the exception for the earliest item is
+    raised again.
+
+    '''
+
+    items = list(items)
+    results = [None] * len(items)
+    errors = [None] * len(items)
+    next_index = itertools.count()
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                i = next(next_index)
+            if i >= len(items):
+                return
+            try:
+                results[i] = function(items[i])
+            except BaseException:
+                errors[i] = sys.exc_info()
+
+    if max_threads <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+
+    threads = [threading.Thread(target=worker)
+               for i in xrange(min(max_threads, len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        # join() without a timeout cannot be interrupted by Ctrl+C.
+        while thread.is_alive():
+            thread.join(1)
+
+    for error in errors:
+        if error is not None:
+            raise error[0], error[1], error[2]
+    return results
+
+
 def get_data_path(relative_path): # pragma: no cover
     '''Return path to a data file in the morphlib Python package.
 
@@ -1,4 +1,4 @@
-# Copyright (C) 2011-2015  Codethink Limited
+# Copyright (C) 2011-2015,2026  Codethink Limited
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -16,6 +16,8 @@
 import os
 import shutil
 import tempfile
+import threading
+import time
 import unittest
 
 import morphlib
@@ -128,3 +130,48 @@ class IterTrickleTests(unittest.TestCase):
     def test_truncated_final_sequence(self):
         self.assertEqual(list(morphlib.util.iter_trickle("barquux", 3)),
                          [["b", "a", "r"], ["q", "u", "u"], ["x"]])
+
+
+class MapInThreadsTests(unittest.TestCase):
+
+    def test_keeps_order(self):
+        self.assertEqual(
+            morphlib.util.map_in_threads(lambda x: x * 2, range(20), 4),
+            [x * 2 for x in range(20)])
+
+    def test_runs_calls_at_the_same_time(self):
+        lock = threading.Lock()
+        running = []
+        most_running = []
+
+        def function(x):
+            with lock:
+                running.append(x)
+                most_running.append(len(running))
+            time.sleep(0.1)
+            with lock:
+                running.remove(x)
+
+        morphlib.util.map_in_threads(function, range(4), 4)
+        self.assertEqual(max(most_running), 4)
+
+    def test_runs_serially_with_one_thread(self):
+        self.assertEqual(
+            morphlib.util.map_in_threads(lambda x: x + 1, [1, 2, 3], 1),
+            [2, 3, 4])
+
+    def test_raises_error_for_earliest_item(self):
+        finished = []
+
+        def function(x):
+            if x in (3, 7):
+                raise ValueError(x)
+            finished.append(x)
+
+        try:
+            morphlib.util.map_in_threads(function, range(10), 3)
+        except ValueError as e:
+            self.assertEqual(e.args, (3,))
+        else:  # pragma: no cover
+            self.fail('No exception raised')
+        self.assertEqual(sorted(finished), [0, 1, 2, 4, 5, 6, 8, 9])